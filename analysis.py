@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+import threading
+
+import psycopg2
+
+from misc import run_query
+from metrics import format_duration
+from config import ANALYSIS_BATCH_SIZE, ANALYSIS_INTERVAL
+
+logger = logging.getLogger("MARA")
+
+
+class IncrementalAnalysis:
+    """Analyses the collected itineraries batch by batch while the scraping is still running.
+
+    A trigger queues every itinerary written by the scraping workers (see
+    create_tables_incremental_analysis.sql). A background thread takes the queued itineraries
+    every interval seconds and folds their contributions into the derived tables and the
+    result tables (see analyse_pending_itineraries.sql), each batch in its own transaction.
+    Once the scraping is done, only the last batches and the remaining indexes are left.
+    """
+
+    def __init__(self, dsn, parameters, interval=ANALYSIS_INTERVAL, batch_size=ANALYSIS_BATCH_SIZE):
+        """
+        Args:
+            dsn (str): DSN
+            parameters (dict): Parameters of the itinerary filters, see Importer.filter_parameters()
+            interval (float): (Optional) Seconds between the checks for queued itineraries
+            batch_size (int): (Optional) Itineraries analysed per transaction
+        """
+        self.dsn = dsn
+        self.parameters = dict(parameters, batch_size=batch_size)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.analysed = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+        with open(os.path.join(os.path.curdir, "queries", "analyse_pending_itineraries.sql")) as file:
+            self.query = file.read()
+
+    def prepare(self):
+        """Creates the (empty) derived and result tables and queues the itineraries collected so far."""
+        run_query("create_tables_incremental_analysis", self.dsn)
+
+    def analyse_batch(self):
+        """Analyses a batch of queued itineraries.
+
+        Returns:
+            int: Number of itineraries taken from the queue, less than the batch size if it ran empty
+        """
+        with psycopg2.connect(self.dsn) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(self.query, self.parameters)
+                cursor.execute("SELECT count(*) FROM batch;")  # dropped on commit
+                taken = cursor.fetchone()[0]
+        self.analysed += taken
+        return taken
+
+    def start(self):
+        """Analyses the queued itineraries every interval seconds in a background thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background thread after its current batch, the rest is left to finalize()."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            started = time.monotonic()
+            analysed = self.analysed
+            try:
+                while not self.stopping.is_set() and self.analyse_batch() == self.batch_size:
+                    pass
+            except psycopg2.Error as e:
+                # e. g. a restart of the server, the itineraries stay queued
+                logger.warning(f"Analysing collected itineraries failed, trying again later: {e}")
+            if self.analysed > analysed:
+                logger.info((
+                    f"Analysed {self.analysed - analysed} collected itineraries in "
+                    f"{format_duration(time.monotonic() - started)}, {self.analysed} in total."
+                ))
+
+    def abort(self):
+        """Stops the background thread and the queueing of itineraries, if scraping or analysing failed.
+
+        The tables are left as they are, they are dropped by the next run.
+        """
+        self.stop()
+        try:
+            run_query("drop_incremental_analysis_trigger", self.dsn)
+        except psycopg2.Error as e:
+            # the next run drops it as well, see drop_derived_tables.sql
+            logger.warning(f"Could not remove the trigger of the incremental analysis: {e}")
+
+    def finalize(self):
+        """Analyses the itineraries still queued and creates the remaining indexes, once the scraping is done."""
+        self.stop()
+        while self.analyse_batch() == self.batch_size:
+            pass
+        logger.info(f"Analysed {self.analysed} itineraries incrementally.")
+        run_query("finalize_incremental_analysis", self.dsn)
@@ -1,26 +1,102 @@
 # general configuration
-LOCAL_OTP_PORT = 8088  # port for OTP to use, HTTPS will be served on +1
+LOCAL_OTP_PORT = 8088  # port for OTP to use, HTTPS will be served on +1, further OTP instances use the next ports
 TEMP_DIRECTORY = "mara-ptm-temp"
-PROGRESS_WATCHER_INTERVAL = 5 * 60 * 1000  # milliseconds
-JVM_PARAMETERS = "-Xmx8G"  # 6-8GB of RAM is good for bigger graphs
+FEED_INDEX_DIRECTORY = "mara-ptm-feeds"  # metadata of inspected GTFS feeds, so they are not inspected again
+IMPORT_STOP_TIMES = False  # origins and destinations come straight from the GTFS feed, the table is not needed
+PROGRESS_WATCHER_INTERVAL = 10 * 1000  # milliseconds between updates of the progress bar while scraping
+PROGRESS_LOG_INTERVAL = 5 * 60  # seconds between log messages about the progress
+JVM_PARAMETERS = "-Xmx8G"  # 6-8GB of RAM is good for bigger graphs, -Xmx is shared by all OTP instances
+OTP_INSTANCES = 1  # OTP processes to spread the requests over, more scale better on many cores if there is enough RAM
+OTP_MAX_RESTARTS = 3  # how often a failed OTP instance is restarted before giving up on it
+OTP_HEALTH_CHECK_INTERVAL = 30  # seconds between checks whether the OTP instances are alive
+# concurrent requests to OTP adapt to how it copes, within these limits (for all instances together)
+OTP_INITIAL_CONCURRENCY = 8
+OTP_MIN_CONCURRENCY = 1
+OTP_MAX_CONCURRENCY = 128  # the pool engine can't have more than one request per CPU thread anyway
+OTP_LATENCY_TOLERANCE = 2.0  # concurrency is reduced when requests take this many times longer than at best
+# retries of requests OTP was temporarily unavailable for
+OTP_MAX_ATTEMPTS = 5
+OTP_BACKOFF_BASE = 2.0  # seconds, the maximum wait before a retry, doubled for each further attempt...
+OTP_BACKOFF_MAX = 60.0  # ...up to this, the actual wait is random below that
+OTP_RETRY_BUDGET = 0.1  # retries may be at most this share of all requests
+OTP_REQUEST_TIMEOUT = 600  # seconds, a request without a complete response by then is sent again
+# save the graph built by OTP and load it in later runs with the same GTFS, OSM and OTP,
+# the inputs are hashed on every run for that, which takes a while for big OSM files
+GRAPH_CACHE_ENABLED = False
+GRAPH_CACHE_DIRECTORY = "mara-ptm-graphs"  # must not be inside TEMP_DIRECTORY, anything there that is not a staged input is removed on every run
+GRAPH_CACHE_MAX_GRAPHS = 3  # saved graphs to keep, the least recently used are deleted beyond this
+DB_MAX_ATTEMPTS = 3  # how often the scraping workers try to write to the database, reconnecting in between
+INGESTION_FLUSH_ROWS = 50000  # the scraping workers write their buffered itinerary stop times once this many...
+INGESTION_FLUSH_SECONDS = 30  # ...or after this many seconds, also while a worker waits for tasks or OTP
+
+# scraping engine
+# "pool": one process per CPU thread, each waiting for its OTP request
+# "async": one process keeps OTP_MAX_IN_FLIGHT requests open, parsing happens in PARSER_PROCESSES processes
+SCRAPER_ENGINE = "pool"
+TASK_CHUNKSIZE = 100  # O-D relations sent to a pool worker at once
+OTP_MAX_IN_FLIGHT = 32  # request loops, the adaptive limit of concurrent requests (see below) can't exceed this
+PARSER_PROCESSES = 4
+
+# plan cache, keeps OTP's responses so changed filter parameters or analysis queries don't need a re-scrape
+PLAN_CACHE_ENABLED = False
+PLAN_CACHE_REPLAY = False  # only feed itineraries from the cache, OTP is not launched at all
+PLAN_CACHE_DIRECTORY = "mara-ptm-cache"  # must not be inside TEMP_DIRECTORY, anything there that is not a staged input is removed on every run
+PLAN_CACHE_MAX_SIZE = 50 * 1024 ** 3  # bytes (compressed), least recently used responses are evicted beyond this
+PLAN_CACHE_SHARDS = 16  # SQLite files the responses are spread over
+
+# metrics of the scraping, a Prometheus text file (mara_ptm.prom) and a JSON summary per run
+METRICS_DIRECTORY = "mara-ptm-metrics"
+METRICS_EXPORT_INTERVAL = 15  # seconds between rewrites of the Prometheus text file while scraping
+
+# analyse the collected itineraries batch by batch while scraping instead of all at once afterwards
+# the result tables are the same, only which one of equal stop times from different itineraries is kept may differ
+ANALYSIS_INCREMENTAL = False
+ANALYSIS_INTERVAL = 60  # seconds between the checks for newly collected itineraries
+ANALYSIS_BATCH_SIZE = 10000  # itineraries analysed per transaction
+# queries of the analysis that don't depend on each other run on this many connections at once, 1 runs one after another
+ANALYSIS_MAX_CONNECTIONS = 4
 
 # itinerary filter parameters
 CAR_KMH = 50
 CAR_TRAVEL_FACTOR = 1.4  # as the crow flies vs street, how much longer is realistic
 # note: the factor that public transport may take longer is configured in the GUI
+# keep the itineraries rejected by the filters, they are only applied in the analysis then
+# this allows to compare thresholds on one collection (see create_table_itineraries_with_regions.sql) but needs more space
+STORE_REJECTED_ITINERARIES = False
+
+# O-D relations that are not requested from OTP at all
+OD_MIN_DISTANCE = 0  # meters, stops closer than this are skipped, co-located stops are always skipped
+OD_EXCLUDED_REGION_PAIRS = []  # (origin region ID, destination region ID), "*" matches any, e. g. [("13076006", "*")]
+# stops of the same place (e. g. the platforms of a station) are merged into one origin resp. destination,
+# only stops within the same region are merged, the mapping is kept in the stop_clusters table
+# don't change these when resuming a collection
+STOP_CLUSTER_BY_PARENT_STATION = False  # merge stops with the same parent_station
+STOP_CLUSTER_DISTANCE = 0  # meters, merge stops at most this far apart, 0 disables
 
 # itinerary parameters
 ALLOWED_TRANSIT_MODES = ["WALK", "BUS", "TRAM", "SUBWAY", "RAIL"]
 MAX_WALK_DISTANCE = 1000  # meters
+# each O-D relation and date is requested in this many slices of the day, as separate tasks
+# smaller, more uniform requests balance better and need less memory, 1 requests the whole day at once
+# days with a DST change are split by their actual length of 23 or 25 hours in the time zone of the feed, this needs
+# Python 3.9+ and agency.txt, otherwise every day is taken to have 24 hours
+# don't change this when resuming a collection
+SEARCH_WINDOW_SLICES = 1
+# only one date of those with exactly the same services (e. g. Monday to Friday) is requested,
+# its itineraries are copied to the others, see feed_index.service_day_classes()
+# the results are copies instead of answers of OTP, only enable it if OTP has no data that depends on the date
+# besides the calendars of the feeds (e. g. real-time updates) and no itinerary runs later than the next day
+# don't change this when resuming a collection
+SERVICE_DAY_CLASSES = False
 OTP_PARAMETERS_TEMPLATE = "&".join([
     "fromPlace=1:{origin}",
     "toPlace=1:{destination}",
-    "time=00%3A00",
+    "time={time}",
     "date={date}",
     "mode=TRANSIT%2CWALK",
     "maxWalkDistance={max_walk_distance}",
     "arriveBy=false",
-    "searchWindow=86400",
+    "searchWindow={search_window}",
     "numOfItineraries=99999",
     "keepNumOfItineraries=99999",
     "showIntermediateStops=true",
@@ -0,0 +1,292 @@
+import os
+import json
+import hashlib
+import logging
+import datetime
+from pathlib import Path
+from zipfile import ZipFile
+from collections import defaultdict
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError  # Python 3.9+
+except ImportError:
+    ZoneInfo = None
+
+from config import FEED_INDEX_DIRECTORY
+from misc import zipped_csv_columns, file_digest, filename
+
+logger = logging.getLogger("MARA")
+
+INDEX_VERSION = 2  # increase when the contents of the metadata change, older entries are recomputed then
+
+
+class FeedIndex:
+    """An on-disk index of GTFS feed metadata, so a known feed does not have to be inspected again.
+
+    The metadata of a feed is stored as JSON named by the SHA-256 digest of the feed. A second
+    file maps the paths of inspected feeds to their size, mtime and digest, so an unchanged feed
+    is found without even reading it. A renamed or copied feed is found by its digest.
+    """
+
+    def __init__(self, directory=FEED_INDEX_DIRECTORY):
+        self.directory = Path(directory)
+        self.paths_file = self.directory / "paths.json"
+
+    def _read_paths(self):
+        try:
+            with open(self.paths_file) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_json(self, path, content):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(".part")
+        with open(temporary_path, "w") as file:
+            json.dump(content, file)
+        os.replace(temporary_path, path)  # so a concurrent reader never sees a partial file
+
+    def metadata(self, gtfs_path):
+        """Returns the metadata of a feed, inspecting it only if it is not in the index yet.
+
+        Args:
+            gtfs_path (str): Path to the GTFS feed
+
+        Returns:
+            dict: The metadata, see inspect_feed()
+        """
+        key = str(Path(gtfs_path).resolve())
+        stat = os.stat(gtfs_path)
+        paths = self._read_paths()
+
+        known = paths.get(key)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            digest = known["sha256"]
+        else:
+            digest = file_digest(gtfs_path)
+
+        metadata_file = self.directory / f"{digest}.json"
+        metadata = None
+        try:
+            with open(metadata_file) as file:
+                metadata = json.load(file)
+        except (OSError, ValueError):
+            pass
+
+        if metadata is None or metadata.get("version") != INDEX_VERSION:
+            metadata = inspect_feed(gtfs_path)
+            metadata["sha256"] = digest
+            self._write_json(metadata_file, metadata)
+        else:
+            logger.info(f"Found {filename(gtfs_path)} in the feed index.")
+
+        if known != {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}:
+            paths = self._read_paths()  # might have changed in the meantime
+            paths[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+            self._write_json(self.paths_file, paths)
+
+        return metadata
+
+
+def service_dates(gtfs_path, names):
+    """Determines the active service IDs per date from calendar.txt and calendar_dates.txt.
+
+    Args:
+        gtfs_path (str): Path to the GTFS feed
+        names (list[str]): Names of the files in the feed
+
+    Returns:
+        dict: date (YYYY-MM-DD) -> set of active service IDs
+    """
+    services = defaultdict(set)
+    if "calendar.txt" in names:
+        weekdays = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+        columns = ("service_id", "start_date", "end_date") + weekdays
+        for service_id, start_date, end_date, *days in zipped_csv_columns(gtfs_path, "calendar.txt", columns):
+            date = datetime.datetime.strptime(start_date, "%Y%m%d").date()
+            end = datetime.datetime.strptime(end_date, "%Y%m%d").date()
+            while date <= end:
+                if days[date.weekday()] == "1":
+                    services[date.isoformat()].add(service_id)
+                date += datetime.timedelta(days=1)
+
+    if "calendar_dates.txt" in names:
+        columns = ("service_id", "date", "exception_type")
+        for service_id, date, exception_type in zipped_csv_columns(gtfs_path, "calendar_dates.txt", columns):
+            date = f"{date[:4]}-{date[4:6]}-{date[6:]}"
+            if exception_type == "1":  # added
+                services[date].add(service_id)
+            elif exception_type == "2":  # removed
+                services[date].discard(service_id)
+
+    return {date: active for date, active in services.items() if active}
+
+
+def calendar_weeks(start_date, end_date):
+    """Lists the calendar weeks from the week of start_date to the week of end_date.
+
+    Args:
+        start_date (datetime.date): First date
+        end_date (datetime.date): Last date
+
+    Returns:
+        dict: year -> list of calendar weeks
+    """
+    # the ISO year, e. g. 2024-12-30 is in week 1 of 2025
+    start_year, start_calendar_week = start_date.isocalendar()[:2]
+    end_year, end_calendar_week = end_date.isocalendar()[:2]
+    logger.debug(f"{start_year} W{start_calendar_week} - {end_year} W{end_calendar_week}")
+
+    years_calendar_weeks = defaultdict(list)
+
+    if end_year > start_year:
+        for year in range(start_year, end_year+1):
+            last_week = datetime.date(year, 12, 28)  # ref https://stackoverflow.com/a/29263010/4828720
+            last_week_number = last_week.isocalendar()[1]  # 1 = week
+
+            if year == start_year:
+                years_calendar_weeks[year] = list(range(start_calendar_week, last_week_number+1))
+            elif year == end_year:
+                years_calendar_weeks[year] = list(range(1, end_calendar_week+1))
+            else:
+                years_calendar_weeks[year] = list(range(1, last_week_number+1))
+    else:
+        years_calendar_weeks[start_year] = list(range(start_calendar_week, end_calendar_week+1))
+
+    return years_calendar_weeks
+
+
+def count_rows(gtfs_path, csv_file):
+    """Counts the rows of a CSV file in a GTFS feed, without its header."""
+    return sum(1 for _ in zipped_csv_columns(gtfs_path, csv_file, ()))
+
+
+def inspect_feed(gtfs_path):
+    """Gathers the metadata of a GTFS feed.
+
+    Args:
+        gtfs_path (str): Path to the GTFS feed
+
+    Returns:
+        dict: The metadata with the keys
+            start_date, end_date (str): First and last date with service (YYYY-MM-DD)
+            calendar_weeks (dict): year (str, as in JSON) -> list of calendar weeks from start to end date
+            stops, trips (int): Number of stops and trips
+            timezone (str): Time zone of the (first) agency, None if unknown
+            services (dict): date (YYYY-MM-DD) -> number and SHA-1 digest of the sorted, active service IDs
+
+    Raises:
+        ValueError: If the feed has no service dates
+    """
+    logger.info(f"Inspecting GTFS feed {filename(gtfs_path)} for serviced calender weeks...")
+    with ZipFile(gtfs_path) as gtfs_file:
+        names = gtfs_file.namelist()
+
+    # either might not exist, they are optional in a way
+    services = service_dates(gtfs_path, names)
+    if not services:
+        raise ValueError(
+            f"Malformed GTFS feed {filename(gtfs_path)}, no service dates in calendar.txt or calendar_dates.txt!"
+        )
+
+    timezones = []
+    if "agency.txt" in names:
+        timezones = [timezone for timezone, in zipped_csv_columns(gtfs_path, "agency.txt", ("agency_timezone",))]
+
+    start_date, end_date = min(services), max(services)
+    logger.info(f"{filename(gtfs_path)} covers {start_date} to {end_date}.")
+
+    return {
+        "version": INDEX_VERSION,
+        "start_date": start_date,
+        "end_date": end_date,
+        "calendar_weeks": calendar_weeks(
+            datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date)
+        ),
+        "stops": count_rows(gtfs_path, "stops.txt") if "stops.txt" in names else 0,
+        "trips": count_rows(gtfs_path, "trips.txt") if "trips.txt" in names else 0,
+        "timezone": timezones[0] if timezones else None,
+        "services": {
+            date: {
+                "count": len(active),
+                "digest": hashlib.sha1("\n".join(sorted(active)).encode("utf-8")).hexdigest(),
+            }
+            for date, active in sorted(services.items())
+        },
+    }
+
+
+def serviced_calendar_weeks(gtfs_path):
+    """Extracts the serviced calendar weeks from a GTFS feed, see FeedIndex.
+
+    Args:
+        gtfs_path (str): Path to the GTFS file to inspect
+
+    Returns:
+        dict: year -> list of calendar weeks
+    """
+    metadata = FeedIndex().metadata(gtfs_path)
+    return {int(year): weeks for year, weeks in metadata["calendar_weeks"].items()}
+
+
+def feed_time_zone(gtfs_path):
+    """Returns the time zone of a GTFS feed, see FeedIndex.
+
+    Args:
+        gtfs_path (str): Path to the GTFS feed
+
+    Returns:
+        zoneinfo.ZoneInfo: The time zone of the (first) agency, None if unknown or zoneinfo is not available
+    """
+    timezone = FeedIndex().metadata(gtfs_path).get("timezone")
+    if ZoneInfo is None or not timezone:
+        return None
+    try:
+        return ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def service_day_classes(dates, gtfs_paths):
+    """Groups the dates on which exactly the same services run, so only one of them has to be requested.
+
+    Dates are equivalent if all feeds have the same active service IDs on them, on the days
+    before (for trips running past midnight) and on the days after (for itineraries departing
+    late that arrive after midnight), and if the UTC offsets of the feeds' time zone on them and
+    on the days after are the same, so the itineraries of one date are those of another shifted
+    by whole days.
+    Without a known time zone every date is a class of its own.
+
+    Args:
+        dates (list[str]): Dates in YYYY-MM-DD, in order
+        gtfs_paths (list[str]): Paths to the GTFS feeds, the first one's time zone is used
+
+    Returns:
+        dict: representative date -> list of (equivalent date, shift from the representative in milliseconds)
+    """
+    feeds = [FeedIndex().metadata(gtfs_path) for gtfs_path in gtfs_paths]
+
+    zone = feed_time_zone(gtfs_paths[0])
+    if zone is None:
+        logger.warning("The time zone of the GTFS feed is unknown, every date is requested.")
+        return {date: [] for date in dates}
+
+    classes = {}
+    for date in dates:
+        day = datetime.date.fromisoformat(date)
+        previous_day = (day - datetime.timedelta(days=1)).isoformat()
+        next_day = day + datetime.timedelta(days=1)
+        key = tuple(
+            feed["services"].get(d, {}).get("digest")
+            for feed in feeds for d in (previous_day, date, next_day.isoformat())
+        )
+        key += tuple(
+            datetime.datetime.combine(d, time, tzinfo=zone).utcoffset()
+            for d in (day, next_day) for time in (datetime.time(0, 0), datetime.time(23, 59))
+        )
+        classes.setdefault(key, []).append(day)
+
+    return {
+        days[0].isoformat(): [(day.isoformat(), (day - days[0]).days * 86400 * 1000) for day in days[1:]]
+        for days in classes.values()
+    }
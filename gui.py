@@ -0,0 +1,498 @@
+import sys
+import time
+import logging
+from functools import partial
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import QIntValidator
+from PyQt5.QtWidgets import *
+
+from misc import get_dates_of_week
+from feed_index import serviced_calendar_weeks
+from importer import Importer, make_dsn, log_configuration
+
+from config import PROGRESS_WATCHER_INTERVAL, PROGRESS_LOG_INTERVAL
+
+logger = logging.getLogger("MARA")
+
+
+class Worker(QThread):
+    def __init__(self, func, args):
+        super().__init__()
+        self.func = func
+        self.args = args
+
+    def run(self):
+        self.func(*self.args)
+
+
+class FeedInspector(QThread):
+    """Determines the serviced calendar weeks of a GTFS feed without blocking the GUI."""
+    inspected = pyqtSignal(str, object)
+
+    def __init__(self, gtfs_path):
+        super().__init__()
+        self.gtfs_path = gtfs_path
+
+    def run(self):
+        try:
+            years_calendar_weeks = serviced_calendar_weeks(self.gtfs_path)
+        except Exception:  # any exception is fine
+            logger.critical(f"Malformed GTFS feed {self.gtfs_path}!")
+            return
+        self.inspected.emit(self.gtfs_path, years_calendar_weeks)
+
+
+class SignallingLogHandler(logging.Handler, QObject):
+    """A logging handler that emits new messages as signals-"""
+    logMessage = pyqtSignal(str)
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        QObject.__init__(self)
+
+    def emit(self, log_record):
+        message = self.formatter.format(log_record)
+        if log_record.levelno > 20:
+            message = f"{message}"
+        self.logMessage.emit(message)
+
+
+signalling_log_handler = SignallingLogHandler()
+
+
+class MaraPtm(QDialog):
+
+    def __init__(self):
+        super().__init__()
+
+        self.importer = None  # does the work, for the progress watcher and killing OTP when closed
+        self.progress_logged = 0  # time.monotonic() of the last log message about the progress
+        self.years_calendar_weeks = None  # calender weeks of main GTFS feed
+        self.feed_inspectors = []  # running FeedInspectors
+        self.travel_time_factor_threshold = 2.0  # 2.0 as default value in MARA project
+
+        self.worker = Worker(self.try_analysis, ())
+        self.worker.terminate()
+        self.worker.started.connect(self.start_timer)
+        self.worker.finished.connect(self.stop_timer)
+
+        # layout
+        def make_line():
+            line = QFrame()
+            line.setFrameShape(QFrame.HLine)
+            line.setFrameShadow(QFrame.Sunken)
+            return line
+
+        self.layout = QVBoxLayout(self)
+        layout_files = QVBoxLayout()
+        layout_settings = QHBoxLayout()
+        layout_log_and_buttons = QVBoxLayout()
+        self.layout.addLayout(layout_files)
+        self.layout.addWidget(make_line())
+        self.layout.addLayout(layout_settings)
+        self.layout.addWidget(make_line())
+        self.layout.addLayout(layout_log_and_buttons)
+
+        # # # files layout
+        self.lineedit_gtfs_file1 = QLineEdit()
+        self.lineedit_gtfs_file1.setPlaceholderText("gtfs-vlp.zip")
+        self.lineedit_gtfs_file1.setMinimumWidth(500)
+        self.gtfs_file1_button = QPushButton("...")
+        layout_gtfs_file1 = QHBoxLayout()
+        layout_gtfs_file1.addWidget(QLabel("<b>GTFS Feed (main)</b>"))
+        layout_gtfs_file1.addStretch()
+        layout_gtfs_file1.addWidget(self.lineedit_gtfs_file1)
+        layout_gtfs_file1.addWidget(self.gtfs_file1_button)
+
+        self.lineedit_gtfs_file2 = QLineEdit()
+        self.lineedit_gtfs_file2.setPlaceholderText("gtfs-trains.zip")
+        self.lineedit_gtfs_file2.setMinimumWidth(500)
+        self.gtfs_file2_button = QPushButton("...")
+        layout_gtfs_file2 = QHBoxLayout()
+        layout_gtfs_file2.addWidget(QLabel("GTFS Feed (additional/optional)"))
+        layout_gtfs_file2.addStretch()
+        layout_gtfs_file2.addWidget(self.lineedit_gtfs_file2)
+        layout_gtfs_file2.addWidget(self.gtfs_file2_button)
+
+        self.lineedit_osm_file = QLineEdit()
+        self.lineedit_osm_file.setPlaceholderText("mecklenburg-vorpommern-latest.osm.pbf")
+        self.lineedit_osm_file.setMinimumWidth(500)
+        self.osm_file_button = QPushButton("...")
+        layout_osm_file = QHBoxLayout()
+        layout_osm_file.addWidget(QLabel("<b>OSM data</b>"))
+        layout_osm_file.addStretch()
+        layout_osm_file.addWidget(self.lineedit_osm_file)
+        layout_osm_file.addWidget(self.osm_file_button)
+
+        layout_files.addLayout(layout_gtfs_file1)
+        layout_files.addLayout(layout_gtfs_file2)
+        layout_files.addLayout(layout_osm_file)
+
+        # # # settings layout
+        # # postgres
+        layout_postgres = QVBoxLayout()
+        layout_postgres.addWidget(QLabel("<b>PostgreSQL/PostGIS connection</b>"))
+        layout_postgres_grid = QGridLayout()
+
+        layout_postgres_grid.addWidget(QLabel("Host"), 0, 0)
+        self.lineedit_postgres_host = QLineEdit()
+        self.lineedit_postgres_host.setPlaceholderText("localhost")
+        layout_postgres_grid.addWidget(self.lineedit_postgres_host, 0, 1)
+
+        layout_postgres_grid.addWidget(QLabel("Port"), 1, 0)
+        self.lineedit_postgres_port = QLineEdit()
+        self.lineedit_postgres_port.setPlaceholderText("5432")
+        self.lineedit_postgres_port.setValidator(QIntValidator())
+        layout_postgres_grid.addWidget(self.lineedit_postgres_port, 1, 1)
+
+        layout_postgres_grid.addWidget(QLabel("Database"), 2, 0)
+        self.lineedit_postgres_database = QLineEdit()
+        self.lineedit_postgres_database.setPlaceholderText("postgres")
+        layout_postgres_grid.addWidget(self.lineedit_postgres_database, 2, 1)
+
+        layout_postgres_grid.addWidget(QLabel("User"), 3, 0)
+        self.lineedit_postgres_user = QLineEdit()
+        self.lineedit_postgres_user.setPlaceholderText("postgres")
+        layout_postgres_grid.addWidget(self.lineedit_postgres_user, 3, 1)
+
+        layout_postgres_grid.addWidget(QLabel("Password"), 4, 0)
+        self.lineedit_postgres_password = QLineEdit()
+        self.lineedit_postgres_password.setPlaceholderText("")
+        self.lineedit_postgres_password.setEchoMode(QLineEdit.Password)
+        layout_postgres_grid.addWidget(self.lineedit_postgres_password, 4, 1)
+
+        layout_postgres.addLayout(layout_postgres_grid)
+        layout_postgres.addStretch()
+
+        # # regions table
+        layout_region_table = QVBoxLayout()
+        layout_region_table.addWidget(QLabel("<b>Regions</b>"))
+        layout_region_table_grid = QGridLayout()
+
+        layout_region_table_grid.addWidget(QLabel("Table"), 0, 0)
+        self.lineedit_regions_table = QLineEdit()
+        self.lineedit_regions_table.setPlaceholderText("public.vg250_gem")
+        layout_region_table_grid.addWidget(self.lineedit_regions_table, 0, 1)
+
+        layout_region_table_grid.addWidget(QLabel("Unique ID column"), 1, 0)
+        self.lineedit_regions_idcolumn = QLineEdit()
+        self.lineedit_regions_idcolumn.setPlaceholderText("ags")
+        layout_region_table_grid.addWidget(self.lineedit_regions_idcolumn, 1, 1)
+
+        layout_region_table_grid.addWidget(QLabel("Geometry column"), 2, 0)
+        self.lineedit_regions_geomcolumn = QLineEdit()
+        self.lineedit_regions_geomcolumn.setPlaceholderText("geom")
+        layout_region_table_grid.addWidget(self.lineedit_regions_geomcolumn, 2, 1)
+
+        layout_region_table_grid.addWidget(QLabel("Label column"), 3, 0)
+        self.lineedit_regions_labelcolumn = QLineEdit()
+        self.lineedit_regions_labelcolumn.setPlaceholderText("gen")
+        layout_region_table_grid.addWidget(self.lineedit_regions_labelcolumn, 3, 1)
+
+        layout_region_table.addLayout(layout_region_table_grid)
+        layout_region_table.addStretch()
+
+        # # year and week
+        layout_year_week = QVBoxLayout()
+        layout_year_week.addWidget(QLabel("<b>Time frame</b>"))
+        layout_year_week_grid = QGridLayout()
+        label_year = QLabel("Year: ")
+        self.year_chooser = QComboBox()
+        label_week = QLabel("Calendar Week: ")
+        self.calender_week_chooser = QComboBox()
+        layout_year_week_grid.addWidget(label_year, 0, 0)
+        layout_year_week_grid.addWidget(self.year_chooser, 0, 1)
+        layout_year_week_grid.addWidget(label_week, 1, 0)
+        layout_year_week_grid.addWidget(self.calender_week_chooser, 1, 1)
+        layout_year_week.addLayout(layout_year_week_grid)
+        layout_year_week.addStretch()
+        layout_year_week.addWidget(make_line())
+        layout_year_week.addStretch()
+
+        layout_spinbox_travel_time_factor_threshold = QHBoxLayout()
+        travel_time_factor_threshold_tooltip = "Discard itineraries that take X times longer than car"
+        self.spinbox_travel_time_factor_threshold = QDoubleSpinBox()
+        self.spinbox_travel_time_factor_threshold.setMinimum(0.01)
+        self.spinbox_travel_time_factor_threshold.setValue(self.travel_time_factor_threshold)
+        self.spinbox_travel_time_factor_threshold.setToolTip(travel_time_factor_threshold_tooltip)
+        layout_spinbox_travel_time_factor_threshold.addWidget(self.spinbox_travel_time_factor_threshold)
+        travel_time_factor_threshold_label = QLabel("PT/Car time threshold")
+        layout_spinbox_travel_time_factor_threshold.addWidget(travel_time_factor_threshold_label)
+        travel_time_factor_threshold_label.setToolTip(travel_time_factor_threshold_tooltip)
+        layout_spinbox_travel_time_factor_threshold.addStretch()
+        layout_year_week.addLayout(layout_spinbox_travel_time_factor_threshold)
+
+        layout_checkbox_proxy_stops = QHBoxLayout()
+        self.checkbox_proxy_stops = QCheckBox()
+        self.checkbox_proxy_stops.setChecked(True)
+        layout_checkbox_proxy_stops.addWidget(self.checkbox_proxy_stops)
+        layout_checkbox_proxy_stops.addWidget(QLabel("Process proxy stops"))
+        layout_checkbox_proxy_stops.addStretch()
+        layout_year_week.addLayout(layout_checkbox_proxy_stops)
+
+        layout_checkbox_purge_tables = QHBoxLayout()
+        self.checkbox_purge_tables = QCheckBox()
+        self.checkbox_purge_tables.setChecked(False)
+        layout_checkbox_purge_tables.addWidget(self.checkbox_purge_tables)
+        layout_checkbox_purge_tables.addWidget(QLabel("Purge intermediate data"))
+        layout_checkbox_purge_tables.addStretch()
+        layout_year_week.addLayout(layout_checkbox_purge_tables)
+
+        layout_checkbox_resume = QHBoxLayout()
+        resume_tooltip = (
+            "Continue the collection of a previous run with the same settings, keeping its itineraries. "
+            "Already collected O-D relations are skipped."
+        )
+        self.checkbox_resume = QCheckBox()
+        self.checkbox_resume.setChecked(False)
+        self.checkbox_resume.setToolTip(resume_tooltip)
+        layout_checkbox_resume.addWidget(self.checkbox_resume)
+        resume_label = QLabel("Resume previous collection")
+        resume_label.setToolTip(resume_tooltip)
+        layout_checkbox_resume.addWidget(resume_label)
+        layout_checkbox_resume.addStretch()
+        layout_year_week.addLayout(layout_checkbox_resume)
+        layout_year_week.addStretch()
+
+        # # # # #
+
+        layout_settings.addLayout(layout_postgres)
+        layout_settings.addStretch()
+        layout_settings.addLayout(layout_region_table)
+        layout_settings.addStretch()
+        layout_settings.addLayout(layout_year_week)
+
+        # # # log and buttons layout
+        self.logging_box = QTextEdit()
+        self.logging_box.setReadOnly(True)
+        self.logging_box.setMinimumHeight(300)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setVisible(False)
+
+        layout_buttons = QHBoxLayout()
+        self.run_button = QPushButton("Run")
+        self.exit_button = QPushButton("Close/Cancel")
+        layout_buttons.addWidget(self.run_button)
+        layout_buttons.addWidget(self.exit_button)
+
+        layout_log_and_buttons.addWidget(self.logging_box)
+        layout_log_and_buttons.addWidget(self.progress_bar)
+        layout_log_and_buttons.addLayout(layout_buttons)
+
+        # signals
+        self.gtfs_file1_button.clicked.connect(partial(self.select_gtfs_file, self.lineedit_gtfs_file1, True))
+        self.gtfs_file2_button.clicked.connect(partial(self.select_gtfs_file, self.lineedit_gtfs_file2))
+        self.osm_file_button.clicked.connect(self.select_osm_file)
+        self.year_chooser.currentIndexChanged.connect(self.fill_calender_week_combobox)
+        self.run_button.clicked.connect(self.worker.start)
+        self.exit_button.clicked.connect(self.close)
+        signalling_log_handler.logMessage.connect(self.logging_box.append)
+
+        # timer for scraper progress watcher, started by the worker when needed
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.timed_progress_watcher)
+        self.timer.setInterval(PROGRESS_WATCHER_INTERVAL)
+
+        self.setWindowTitle('MARA PTM Importer')
+        self.resize(800, 600)
+
+        # log known values from config
+        logger.info(f"Welcome to the MARA PTM Importer!\n{'-' * 80}")
+        log_configuration()
+
+    @pyqtSlot()
+    def start_timer(self):
+        """Start the timer, can be called from a separate worker thread."""
+        logger.debug("Starting timer")
+        self.timer.start()
+
+    @pyqtSlot()
+    def stop_timer(self):
+        """Stop the timer, can be called from a separate worker thread."""
+        logger.debug("Stopping timer")
+        self.timer.stop()
+
+    def reject(self):
+        """Called when user hit Esc."""
+        pass
+
+    def closeEvent(self, event):
+        """Called when user clicked the X or cancels the dialog."""
+        logging.info("Closing! Interrupted work-in-progress will be left as is (if exist).")
+        if self.importer:
+            self.importer.kill_otp()
+        event.accept()
+        self.close()
+
+    def disable_everything(self):
+        """Disable all relevant widgets."""
+        self.run_button.setEnabled(False)
+
+        self.lineedit_gtfs_file1.setEnabled(False)
+        self.lineedit_gtfs_file2.setEnabled(False)
+        self.lineedit_osm_file.setEnabled(False)
+
+        self.gtfs_file1_button.setEnabled(False)
+        self.gtfs_file2_button.setEnabled(False)
+        self.osm_file_button.setEnabled(False)
+
+        self.lineedit_postgres_host.setEnabled(False)
+        self.lineedit_postgres_port.setEnabled(False)
+        self.lineedit_postgres_database.setEnabled(False)
+        self.lineedit_postgres_user.setEnabled(False)
+        self.lineedit_postgres_password.setEnabled(False)
+
+        self.lineedit_regions_table.setEnabled(False)
+        self.lineedit_regions_idcolumn.setEnabled(False)
+        self.lineedit_regions_geomcolumn.setEnabled(False)
+        self.lineedit_regions_labelcolumn.setEnabled(False)
+
+        self.year_chooser.setEnabled(False)
+        self.calender_week_chooser.setEnabled(False)
+        self.checkbox_proxy_stops.setEnabled(False)
+        self.checkbox_resume.setEnabled(False)
+
+    def enable_everything(self):
+        """Enable all relevant widgets."""
+        self.run_button.setEnabled(True)
+
+        self.lineedit_gtfs_file1.setEnabled(True)
+        self.lineedit_gtfs_file2.setEnabled(True)
+        self.lineedit_osm_file.setEnabled(True)
+
+        self.gtfs_file1_button.setEnabled(True)
+        self.gtfs_file2_button.setEnabled(True)
+        self.osm_file_button.setEnabled(True)
+
+        self.lineedit_postgres_host.setEnabled(True)
+        self.lineedit_postgres_port.setEnabled(True)
+        self.lineedit_postgres_database.setEnabled(True)
+        self.lineedit_postgres_user.setEnabled(True)
+        self.lineedit_postgres_password.setEnabled(True)
+
+        self.lineedit_regions_table.setEnabled(True)
+        self.lineedit_regions_idcolumn.setEnabled(True)
+        self.lineedit_regions_geomcolumn.setEnabled(True)
+        self.lineedit_regions_labelcolumn.setEnabled(True)
+
+        self.year_chooser.setEnabled(True)
+        self.calender_week_chooser.setEnabled(True)
+        self.checkbox_proxy_stops.setEnabled(True)
+        self.checkbox_resume.setEnabled(True)
+
+    def select_gtfs_file(self, lineedit, main_feed=False):
+        gtfs_path, _ = QFileDialog.getOpenFileName(
+            parent=self, caption='Select GTFS feed', filter='GTFS feeds (*gtfs*.zip);;All files (*)'
+        )
+
+        if gtfs_path:
+            # inspecting a feed that is not in the feed index yet can take a while
+            inspector = FeedInspector(gtfs_path)
+            inspector.inspected.connect(partial(self.show_gtfs_file, lineedit, main_feed))
+            inspector.finished.connect(partial(self.feed_inspectors.remove, inspector))
+            self.feed_inspectors.append(inspector)  # keeps it alive while it runs
+            inspector.start()
+
+    def show_gtfs_file(self, lineedit, main_feed, gtfs_path, years_calendar_weeks):
+        """Takes a GTFS feed once FeedInspector is done with it."""
+        lineedit.setText(gtfs_path)
+        logger.info(f"{gtfs_path} contains data for serviced weeks: {[e for e in years_calendar_weeks.items()]}")
+
+        if main_feed:
+            self.years_calendar_weeks = years_calendar_weeks
+            self.year_chooser.clear()
+            self.year_chooser.setEnabled(True)
+            self.year_chooser.addItems([str(y) for y in self.years_calendar_weeks.keys()])
+
+    def select_osm_file(self):
+        file_path, _ = QFileDialog.getOpenFileName(
+            parent=self, caption='Select OSM PBF file', filter='OSM PBF (*.osm.pbf);;All files (*)'
+        )
+
+        if file_path:
+            self.lineedit_osm_file.setText(file_path)
+
+    def fill_calender_week_combobox(self):
+        year = int(self.year_chooser.currentText())
+        weeks = self.years_calendar_weeks[year]
+        self.calender_week_chooser.clear()
+        self.calender_week_chooser.setEnabled(True)
+        for i, week in enumerate(weeks):
+            dates = get_dates_of_week(year, week)
+            self.calender_week_chooser.addItem(str(week))
+            self.calender_week_chooser.setItemData(i, "\n".join(dates), Qt.ToolTipRole)
+
+    def timed_progress_watcher(self):
+        """Shows the progress of the scraping in the progress bar and logs it every PROGRESS_LOG_INTERVAL.
+
+        The progress is counted in memory by the scraping itself, the database is not queried.
+        """
+        progress = self.importer.progress if self.importer else None
+        if progress is None:  # not scraping (yet)
+            return
+
+        description = progress.describe()
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setValue(int(progress.done / progress.total * 1000) if progress.total else 1000)
+        self.progress_bar.setFormat(description)
+
+        now = time.monotonic()
+        if now - self.progress_logged >= PROGRESS_LOG_INTERVAL:
+            logger.info(f"Progress: {description}")
+            self.progress_logged = now
+
+    def try_analysis(self):
+        """Tries to do all the work, except and show errors if it fails.
+
+        This function runs in a worker thread.
+        """
+        # the progress watcher timer is restarted via a slot on the worker itself
+        self.disable_everything()
+
+        try:
+            self.importer = Importer(
+                make_dsn(
+                    self.lineedit_postgres_host.text(),
+                    self.lineedit_postgres_port.text(),
+                    self.lineedit_postgres_database.text(),
+                    self.lineedit_postgres_user.text(),
+                    self.lineedit_postgres_password.text(),
+                ),
+                gtfs_file_path1=self.lineedit_gtfs_file1.text(),
+                gtfs_file_path2=self.lineedit_gtfs_file2.text(),
+                osm_file_path=self.lineedit_osm_file.text(),
+                year=int(self.year_chooser.currentText()),
+                calendar_week=int(self.calender_week_chooser.currentText()),
+                regions_table=self.lineedit_regions_table.text(),
+                regions_idcolumn=self.lineedit_regions_idcolumn.text(),
+                regions_geomcolumn=self.lineedit_regions_geomcolumn.text(),
+                regions_labelcolumn=self.lineedit_regions_labelcolumn.text(),
+                travel_time_factor_threshold=self.spinbox_travel_time_factor_threshold.value(),
+                process_proxy_stops=self.checkbox_proxy_stops.isChecked(),
+                purge_intermediate_tables=self.checkbox_purge_tables.isChecked(),
+                resume_collection=self.checkbox_resume.isChecked(),
+            )
+            self.importer.run()
+            logger.info("You can now close this tool.")
+        except Exception as e:
+            logger.exception(e)
+
+        self.enable_everything()
+
+
+def main(log_formatter):
+    """Shows the GUI until it is closed.
+
+    Args:
+        log_formatter (logging.Formatter): Formats the log messages shown in the GUI
+    """
+    signalling_log_handler.setFormatter(log_formatter)
+    logger.addHandler(signalling_log_handler)
+
+    app = QApplication(sys.argv)
+    dialog = MaraPtm()
+    dialog.show()
+    app.exec_()
@@ -0,0 +1,653 @@
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import quote_ident
+
+from misc import *
+from feed_index import serviced_calendar_weeks, service_day_classes, feed_time_zone
+from scraper import AsyncScraper
+from analysis import IncrementalAnalysis
+from query_pipeline import QueryPipeline
+from metrics import Metrics, Progress, format_duration
+from od_matrix import OdFilter, cluster_stops
+from otp import OtpCluster, OTP_JAR, graph_fingerprint, graph_inputs
+
+from config import (
+    ALLOWED_TRANSIT_MODES, MAX_WALK_DISTANCE,
+    CAR_KMH, CAR_TRAVEL_FACTOR, STORE_REJECTED_ITINERARIES,
+    LOCAL_OTP_PORT, JVM_PARAMETERS, OTP_INSTANCES,
+    OTP_INITIAL_CONCURRENCY, OTP_MIN_CONCURRENCY, OTP_MAX_CONCURRENCY,
+    SCRAPER_ENGINE, OTP_MAX_IN_FLIGHT, PARSER_PROCESSES, TASK_CHUNKSIZE,
+    PLAN_CACHE_ENABLED, PLAN_CACHE_REPLAY, PLAN_CACHE_DIRECTORY, GRAPH_CACHE_ENABLED, IMPORT_STOP_TIMES,
+    SEARCH_WINDOW_SLICES, SERVICE_DAY_CLASSES, ANALYSIS_INCREMENTAL, STOP_CLUSTER_BY_PARENT_STATION, STOP_CLUSTER_DISTANCE,
+)
+
+logger = logging.getLogger("MARA")
+
+
+def make_dsn(host, port, dbname, user, password):
+    """Returns the DSN for connecting to PG.
+
+    Args:
+        host (str): Host of the database server
+        port (str): Port of the database server
+        dbname (str): Name of the database
+        user (str): User name
+        password (str): Password
+
+    Returns:
+        str: DSN
+    """
+    return f"host={host} port={port} dbname={dbname} user={user} password={password}"
+
+
+def log_configuration():
+    """Logs the known values from config that affect the results or the resources used."""
+    logger.info(f"Considering transit modes: {', '.join(ALLOWED_TRANSIT_MODES)}")
+    logger.info(f"Using a maximum walking distance for transfers of {MAX_WALK_DISTANCE} m")
+    logger.info(f"Assuming a car speed of {CAR_KMH} km/h and a linear distance factor of {CAR_TRAVEL_FACTOR}")
+    if STORE_REJECTED_ITINERARIES:
+        logger.info("Itineraries rejected by the filters are stored, they are only filtered in the analysis")
+    logger.info((
+        f"OpenTripPlanner will run {OTP_INSTANCES} instance(s) with {JVM_PARAMETERS} in total, "
+        f"trying to use local ports {LOCAL_OTP_PORT} to {LOCAL_OTP_PORT + 2 * OTP_INSTANCES - 1}"
+    ))
+    logger.info(f"Temporary data will be written to {TEMP_DIRECTORY}/")
+
+
+class Importer:
+    """The whole process from GTFS and OSM files to the result tables, independent of any user interface.
+
+    The GUI (see gui.py) and the batch runner (see mara-ptm-batch.py) only collect the settings,
+    run() does all the work.
+    """
+
+    def __init__(self, dsn, gtfs_file_path1, osm_file_path, year, calendar_week,
+                 regions_table, regions_idcolumn, regions_geomcolumn, regions_labelcolumn,
+                 gtfs_file_path2="", travel_time_factor_threshold=2.0, process_proxy_stops=True,
+                 purge_intermediate_tables=False, resume_collection=False):
+        """
+        Args:
+            dsn (str): DSN of the database, see make_dsn()
+            gtfs_file_path1 (str): Path to the main GTFS feed
+            osm_file_path (str): Path to the OSM PBF file covering the region of service
+            year (int): Year of the week to analyse
+            calendar_week (int): Calendar week to analyse, must be serviced by the GTFS feeds
+            regions_table (str): Table with the regions
+            regions_idcolumn (str): Unique ID column of the regions table
+            regions_geomcolumn (str): Geometry column of the regions table
+            regions_labelcolumn (str): Label column of the regions table
+            gtfs_file_path2 (str): (Optional) Path to an additional GTFS feed
+            travel_time_factor_threshold (float): (Optional) How much longer than a car may public transport take
+            process_proxy_stops (bool): (Optional) Should proxy stops for non-regional destinations be processed
+            purge_intermediate_tables (bool): (Optional) Should intermediate tables be purged after completion
+            resume_collection (bool): (Optional) Should a previous, interrupted collection of itineraries be continued
+        """
+        self.dsn = dsn
+        self.gtfs_file_path1 = gtfs_file_path1
+        self.gtfs_file_path2 = gtfs_file_path2
+        self.osm_file_path = osm_file_path
+        self.year = year
+        self.calendar_week = calendar_week
+        self.regions_table = regions_table
+        self.regions_idcolumn = regions_idcolumn
+        self.regions_geomcolumn = regions_geomcolumn
+        self.regions_labelcolumn = regions_labelcolumn
+        self.travel_time_factor_threshold = travel_time_factor_threshold
+        self.process_proxy_stops = process_proxy_stops
+        self.purge_intermediate_tables = purge_intermediate_tables
+        self.resume_collection = resume_collection
+
+        self.otp_cluster = None  # for killing OTP when done or failed
+        self.progress = None  # progress of the scraping, while it runs
+        self.incremental_analysis = None  # analyses while scraping, see ANALYSIS_INCREMENTAL
+
+    def run(self):
+        """Does all the work, from collecting the files to the result tables."""
+        logger.info((
+            f"Public transport itineraries taking {self.travel_time_factor_threshold} "
+            "times longer than car are discarded."
+        ))
+        logger.info(f"Proxy stops are used: {'Yes' if self.process_proxy_stops else 'No'}")
+        logger.info(f"Intermediate tables are purged: {'Yes' if self.purge_intermediate_tables else 'No'}")
+        logger.info(f"Previous collection is resumed: {'Yes' if self.resume_collection else 'No'}")
+
+        gtfs_path, dates = self.prepare_settings()
+        if self.resume_collection:
+            self.prepare_resume()
+        else:
+            self.prepare_database(gtfs_path)
+        if ANALYSIS_INCREMENTAL:
+            logger.info("##### Preparing the analysis of the itineraries while they are collected...")
+            self.incremental_analysis = IncrementalAnalysis(self.dsn, self.filter_parameters())
+            self.incremental_analysis.prepare()
+        try:
+            self.scrape_itineraries(gtfs_path, dates)
+            self.analyse_data()
+        except Exception:
+            if self.incremental_analysis is not None:
+                self.incremental_analysis.abort()
+                self.incremental_analysis = None
+            raise
+        self.housekeeping()
+
+    def check_database(self):
+        """Makes sure the database server can be reached and logs its versions."""
+        logger.info(f"Trying to reach database server...")
+        try:
+            with psycopg2.connect(self.dsn) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT version() || ', PostGIS: ' || PostGIS_Version();")
+                    versions = cursor.fetchone()[0]
+                    logger.info(f"Successful database server connection: {versions}")
+        except Exception:
+            raise
+
+    def kill_otp(self):
+        """Tries to kill OTP if it was spawned by this tool, only supported on Windows, Linux and macOS."""
+        if not self.otp_cluster:
+            return
+
+        logger.info("Shutting down OpenTripPlanner...")
+        self.otp_cluster.stop()
+        self.otp_cluster = None
+        logger.info("Shutting down OpenTripPlanner... Probably done!")
+
+    def prepare_settings(self):
+        """Checks the settings and prepares the subsequent steps of analysis.
+
+        Returns:
+            str: Path to main GTFS feed
+            list[str]: List of dates in YYYY-MM-DD
+        """
+        self.check_database()
+
+        gtfs_file_path1 = self.gtfs_file_path1
+        gtfs_file_path2 = self.gtfs_file_path2
+        osm_file_path = self.osm_file_path
+        logger.info("Collecting files...")
+        prepare_files(gtfs_file_path1, osm_file_path, gtfs_file_path2)
+        logger.info("Collecting files... Done!")
+
+        gtfs_path = TEMP_DIRECTORY / Path(gtfs_file_path1)
+
+        selected_year = self.year
+        selected_calendar_week = self.calendar_week
+        dates = get_dates_of_week(selected_year, selected_calendar_week)
+
+        if gtfs_file_path2:
+            logger.info("Checking if service times of the additional GTFS feed include the selected week...")
+            additional_gtfs_serviced_years_weeks = serviced_calendar_weeks(gtfs_file_path2)
+            additional_gtfs_serviced_weeks = additional_gtfs_serviced_years_weeks.get(selected_year)
+            if additional_gtfs_serviced_weeks and selected_calendar_week in additional_gtfs_serviced_weeks:
+                logger.info("Yes.")
+            else:
+                raise Exception("Service times of the additional GTFS feed do not include the selected week!")
+
+        return gtfs_path, dates
+
+    def prepare_database(self, gtfs_path):
+        """Prepares the database, cleans up and creates tables.
+
+        Args:
+            gtfs_path (str): Path to the main GTFS feed
+        """
+        # # Clean up!
+        logger.info("##### Removing potentially existing tables that will be (re-)created...")
+        run_query("drop_base_tables", self.dsn)
+        run_query("drop_derived_tables", self.dsn)
+
+        logger.info("##### Preparing tables, extracting some data from GTFS...")
+        run_query("create_extension_postgis", self.dsn)
+
+        logger.info(f"Extracting stops and stop_times from GTFS feed {filename(gtfs_path)}")
+        # Adding just the necessary fields of stop_times and stops to the DB:
+        # the origins and destinations are taken from the feed, stop_times are only needed for your own queries
+        tables = {"stops": load_gtfs_stops}
+        if IMPORT_STOP_TIMES:
+            tables["stop_times"] = load_gtfs_stop_times
+        for table in tables:
+            run_query(f"create_table_{table}", self.dsn)
+        # the tables are loaded in parallel, streamed from the feed with COPY, indexes are built afterwards
+        with ThreadPoolExecutor(len(tables)) as executor:
+            loads = [executor.submit(self.load_gtfs_table, table, load, gtfs_path) for table, load in tables.items()]
+            for load in loads:
+                load.result()  # raises the exception of a failed load
+
+        # regions table
+        regions_table = self.regions_table
+        regions_table_idcolumn = self.regions_idcolumn
+        regions_table_geomcolumn = self.regions_geomcolumn
+        regions_table_labelcolumn = self.regions_labelcolumn
+        logger.info(f"Preparing regions table from source {regions_table}...")
+        with psycopg2.connect(self.dsn) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                            CREATE TABLE regions AS
+                            SELECT
+                                {regions_table_idcolumn} AS region_id,
+                                {regions_table_labelcolumn} AS region_label,
+                                st_transform(
+                                    {regions_table_geomcolumn}::geometry
+                                    , 4326
+                                ) AS geom
+                            FROM {regions_table};
+                            """.format(
+                    regions_table=quote_ident(regions_table, cursor),
+                    regions_table_idcolumn=quote_ident(regions_table_idcolumn, cursor),
+                    regions_table_labelcolumn=quote_ident(regions_table_labelcolumn, cursor),
+                    regions_table_geomcolumn=quote_ident(regions_table_geomcolumn, cursor),
+                )
+                )
+                cursor.execute("""
+                    CREATE INDEX idx_regions_region_id ON regions(region_id);
+                    CREATE INDEX idx_regions_geom ON regions USING GIST (geom);
+                    """)
+
+        run_query("create_table_stops_with_regions", self.dsn)
+        if self.process_proxy_stops:
+            run_query("create_proxy_stops", self.dsn)
+        run_query("create_table_itinerary_stop_times", self.dsn)
+        run_query("create_table_itineraries", self.dsn)
+        run_query("create_table_completed_ods", self.dsn)
+
+    def load_gtfs_table(self, table, load, gtfs_path):
+        """Loads a table from the GTFS feed and creates its indexes, see load_gtfs_stops().
+
+        Args:
+            table (str): Name of the table, the indexes are in queries/create_indexes_<table>.sql
+            load (callable): Loads the table, called with the DSN and gtfs_path
+            gtfs_path (str): Path to the GTFS feed
+        """
+        logger.info(f"Inserting {table}.txt from GTFS feed {filename(gtfs_path)} into table...")
+        started = time.monotonic()
+        load(self.dsn, gtfs_path)
+        logger.info(f"Inserting {table}.txt... Done in {format_duration(time.monotonic() - started)}!")
+        run_query(f"create_indexes_{table}", self.dsn)
+
+    def prepare_resume(self):
+        """Prepares the database for continuing a previous collection of itineraries.
+
+        The base tables and collected itineraries are kept, only derived tables are removed.
+        """
+        logger.info("##### Resuming the previous collection, keeping collected itineraries...")
+        with psycopg2.connect(self.dsn) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass('itineraries') IS NOT NULL;")
+                if not cursor.fetchone()[0]:
+                    raise Exception("There is no previous collection to resume, run without resuming first!")
+
+        logger.info("##### Removing potentially existing tables that will be (re-)created...")
+        run_query("drop_derived_tables", self.dsn)
+        run_query("create_table_completed_ods", self.dsn)
+
+        with psycopg2.connect(self.dsn) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM completed_ods;")
+                completed_count = cursor.fetchone()[0]
+                logger.info(f"{completed_count} O-D relations have already been collected and will be skipped.")
+
+    def scrape_itineraries(self, gtfs_path, dates):
+        """Runs the scraping of itineraries.
+
+        Args:
+            gtfs_path (str): Path to the main GTFS feed
+            dates (list[str]): List of dates in YYYY-MM-DD
+        """
+        # # Fetch origins and destinations
+        logger.info("##### Determining origin and destination stops...")
+        # straight from the feed, one pass over stop_times.txt
+        starts, ends = trip_terminal_stops(gtfs_path)
+        # ## Origins
+        stops_where_trips_start = stops_by_coordinates(gtfs_path, starts)
+        # ## Destinations
+        stops_where_trips_end = stops_by_coordinates(gtfs_path, ends)
+        if STOP_CLUSTER_BY_PARENT_STATION or STOP_CLUSTER_DISTANCE:
+            stops_where_trips_start, stops_where_trips_end = self.cluster_stops(
+                stops_where_trips_start, stops_where_trips_end
+            )
+        if self.process_proxy_stops:
+            # not clustered, the analysis looks for itineraries ending at the proxy stops themselves
+            # add proxy stops as destinations
+            with psycopg2.connect(self.dsn) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT min(stops.stop_id)
+                        FROM stops
+                        WHERE stop_name IN (SELECT stop_name FROM proxy_stops)
+                        GROUP BY geom
+                        """)
+                    proxy_stops = {r[0] for r in cursor.fetchall()}
+            stops_where_trips_end = sorted(proxy_stops.union(stops_where_trips_end))
+        logger.info(f"Found {len(stops_where_trips_start)} stops where trips start.")
+        logger.info(f"Found {len(stops_where_trips_end)} stops where trips end.")
+
+        fingerprint = None
+        if PLAN_CACHE_ENABLED or PLAN_CACHE_REPLAY or GRAPH_CACHE_ENABLED:
+            logger.info("Calculating the fingerprint of GTFS, OSM and OTP...")
+            fingerprint = graph_fingerprint(graph_inputs())
+            logger.info(f"The fingerprint of the graph is {fingerprint[:12]}.")
+
+        plan_cache_fingerprint = None
+        if PLAN_CACHE_ENABLED or PLAN_CACHE_REPLAY:
+            plan_cache_fingerprint = fingerprint
+            logger.info(f"Using the plan cache in {PLAN_CACHE_DIRECTORY}/")
+
+        if PLAN_CACHE_REPLAY:
+            logger.info("##### Replaying itineraries from the plan cache, OpenTripPlanner is not launched.")
+        elif not self.launch_otp(
+                stops_where_trips_start[0], stops_where_trips_end[-1], dates[0],
+                fingerprint if GRAPH_CACHE_ENABLED else None,
+        ):
+            raise Exception("OpenTripPlanner could not be launched!")
+
+        logger.info("##### Collecting itineraries...")
+        equivalent_dates = {date: [] for date in dates}
+        if SERVICE_DAY_CLASSES:
+            gtfs_paths = [self.gtfs_file_path1] + ([self.gtfs_file_path2] if self.gtfs_file_path2 else [])
+            equivalent_dates = service_day_classes(dates, gtfs_paths)
+            for date, equivalents in equivalent_dates.items():
+                if equivalents:
+                    logger.info((
+                        f"The same services run on {date} and {', '.join(d for d, _ in equivalents)}, "
+                        f"only {date} is requested."
+                    ))
+        requested_dates = list(equivalent_dates)
+        # OTP takes the times of the requests in the time zone of the feed, days with a DST change aren't 24 hours
+        time_zone = feed_time_zone(self.gtfs_file_path1)
+
+        # skip relations that are not worth a request before anything is dispatched
+        od_filter = OdFilter(stops_where_trips_start, stops_where_trips_end, self.dsn)
+        total_number_of_ods = od_filter.count * len(requested_dates) * SEARCH_WINDOW_SLICES
+        logger.info((
+            f"Collecting itineraries for {total_number_of_ods} combinations of "
+            f"stops ({len(stops_where_trips_start)} * {len(stops_where_trips_end)}, pre-filtered) "
+            f"and dates ({', '.join(requested_dates)})"
+            f"{f', each in {SEARCH_WINDOW_SLICES} slices of the day' if SEARCH_WINDOW_SLICES > 1 else ''}. "
+            "This can take a LONG time! Hours to days, depending on the complexity and your hardware."
+        ))
+        # counters and histograms of all processes, exported while scraping
+        metrics = Metrics()
+        tasks = od_filter.ods(requested_dates, SEARCH_WINDOW_SLICES)
+        if self.resume_collection:
+            tasks = pending_ods(tasks, self.dsn, metrics)
+
+        if not PLAN_CACHE_REPLAY:
+            logger.info((
+                f"Concurrent requests to OpenTripPlanner adapt to its load between {OTP_MIN_CONCURRENCY} "
+                f"and {OTP_MAX_CONCURRENCY}, starting with {OTP_INITIAL_CONCURRENCY}."
+            ))
+
+        self.progress = Progress(metrics, total_number_of_ods)
+        metrics.start_export()
+        if self.incremental_analysis is not None:
+            self.incremental_analysis.start()
+        try:
+            if SCRAPER_ENGINE == "async" and not PLAN_CACHE_REPLAY:
+                logger.info(f"Using {OTP_MAX_IN_FLIGHT} concurrent requests and {PARSER_PROCESSES} parsing processes.")
+                scraper = AsyncScraper(
+                    self.dsn, self.travel_time_factor_threshold, self.otp_cluster.balancer, metrics,
+                    plan_cache_fingerprint, equivalent_dates, time_zone,
+                )
+                errors = scraper.run(tasks)
+            else:
+                logger.info(f"Using {multiprocessing.cpu_count()} threads.")
+                errors = 0
+                balancer = self.otp_cluster.balancer if self.otp_cluster else None
+
+                # this is the heavy process
+                # each worker keeps its own database connection, see init_worker()
+                pool = multiprocessing.Pool(
+                    initializer=init_worker,
+                    initargs=(
+                        self.dsn, self.travel_time_factor_threshold, plan_cache_fingerprint, balancer, metrics,
+                        equivalent_dates, time_zone,
+                    ),
+                )
+                # tasks are generated lazily, only a few chunks per worker are pending at any time
+                stream = TaskStream(tasks, max_pending=4 * TASK_CHUNKSIZE * multiprocessing.cpu_count())
+                task = replay_od if PLAN_CACHE_REPLAY else scrape_od
+                try:
+                    for error in pool.imap_unordered(task, stream, chunksize=TASK_CHUNKSIZE):
+                        stream.done()
+                        metrics.inc("ods_completed_total")
+                        # results should all be None, report errors as they happen
+                        if error:
+                            errors += 1
+                            metrics.inc("otp_errors_total")
+                            logger.critical(error)
+                    pool.close()  # lets the workers exit normally so they close their connections
+                except Exception:
+                    stream.stop()
+                    pool.terminate()
+                    raise
+                finally:
+                    pool.join()
+        finally:
+            metrics.stop_export()
+            if self.incremental_analysis is not None:
+                self.incremental_analysis.stop()
+            self.report_metrics(metrics)
+            logger.info(f"Progress: {self.progress.describe()}")
+            logger.info(f"Scraping took {format_duration(time.monotonic() - self.progress.started)}.")
+            self.progress = None
+
+        # the last rows of each process are written when it exits, failures there are not raised
+        lost = metrics.value("db_ods_buffered_total") - metrics.value("db_ods_written_total")
+        if lost:
+            raise Exception((
+                f"The itineraries of {lost:.0f} searches could not be written to the database! "
+                "Resume the collection to request them again."
+            ))
+
+        if errors:
+            raise Exception(f"There were {errors} errors...!")
+
+        logger.info("Finished collecting itineraries!")
+
+    def cluster_stops(self, origins, destinations):
+        """Merges origins and destinations of the same place, see od_matrix.cluster_stops().
+
+        The mapping of all stops to the representatives of their clusters is written to the stop_clusters table.
+
+        Args:
+            origins (list[str]): IDs of the origin stops
+            destinations (list[str]): IDs of the destination stops
+
+        Returns:
+            list[str]: IDs of the origin stops representing the clusters, sorted
+            list[str]: IDs of the destination stops representing the clusters, sorted
+        """
+        logger.info("Clustering stops of the same place...")
+        representatives = cluster_stops(set(origins).union(destinations), self.dsn)
+        run_query("create_table_stop_clusters", self.dsn)
+        copy_lines(
+            self.dsn, "stop_clusters", ("stop_id", "cluster_stop_id"), map(copy_line, representatives.items())
+        )
+        return (
+            sorted({representatives[stop_id] for stop_id in origins}),
+            sorted({representatives[stop_id] for stop_id in destinations}),
+        )
+
+    def report_metrics(self, metrics):
+        """Writes the summary of the scraping metrics and logs the key figures.
+
+        Args:
+            metrics (Metrics): Metrics of the scraping
+        """
+        path = metrics.write_summary(f"summary-{datetime.datetime.now():%Y%m%d-%H%M%S}")
+        summary = metrics.summary()
+        requests = summary["otp_request_seconds"]
+        if requests["count"]:
+            logger.info((
+                f"OpenTripPlanner answered {requests['count']:.0f} requests in {requests['mean']:.2f} s on average "
+                f"(p90 <= {requests['p90']} s), {summary['otp_retries_total']:.0f} retries."
+            ))
+        for name, description in (
+                ("decode_seconds", "Decoding a response"), ("build_seconds", "Building the rows of a plan"),
+                ("db_flush_seconds", "Writing buffered rows to the database"),
+        ):
+            if summary[name]["count"]:
+                logger.info(f"{description} took {summary[name]['mean'] * 1000:.1f} ms on average.")
+        rejected = sum(summary["itineraries_rejected_total"].values())
+        logger.info(f"Kept {summary['itineraries_kept_total']:.0f} itineraries, rejected {rejected:.0f}.")
+        logger.info(f"Metrics of the scraping are in {path}")
+
+    def launch_otp(self, origin, destination, date, graph_fingerprint=None):
+        """Launches the OTP instances and waits until they are ready to answer requests.
+
+        Args:
+            origin (str): Stop ID of the origin for a first, dummy request
+            destination (str): Stop ID of the destination for a first, dummy request
+            date (str): Date in YYYY-MM-DD for a first, dummy request
+            graph_fingerprint (str): (Optional) Fingerprint of the graph inputs, the graph is saved resp. loaded then
+
+        Returns:
+            bool: Whether OTP is ready
+        """
+        logger.info("##### Launching OpenTripPlanner...")
+
+        # trying to make sure it will launch
+        if b"version" not in list(get_subprocess_output("java -version"))[0]:
+            raise Exception("Java is not available!")
+        if b"OTPMain" not in list(get_subprocess_output(f"java -jar {OTP_JAR}"))[0]:
+            raise Exception((
+                f"Java works but OTP ({OTP_JAR}) is not available or broken!"
+                " Make sure it is available in the same directory as this tool."
+            ))
+
+        self.otp_cluster = OtpCluster(graph_fingerprint)
+        if not self.otp_cluster.start(otp_plan_path(origin, destination, date)):
+            logger.critical((
+                "OpenTripPlanners seems to have failed! "
+                "Please make sure your GTFS and OSM PBF files are valid and try again. "
+                "Hint: If you run the tool from a terminal/shell you will see OTP's logging output."
+            ))
+            return False
+
+        return True
+
+    def filter_parameters(self):
+        """Returns the parameters of the itinerary filters in the analysis, see create_table_itineraries_with_regions.sql.
+
+        Returns:
+            dict: The parameters
+        """
+        return {
+            "travel_time_factor_threshold": self.travel_time_factor_threshold,
+            "car_kmh": CAR_KMH,
+            "car_travel_factor": CAR_TRAVEL_FACTOR,
+        }
+
+    def analyse_data(self):
+        incremental = self.incremental_analysis is not None
+        if incremental:
+            # most of it is done already, see IncrementalAnalysis
+            logger.info("##### Analysing the last collected itineraries...")
+            self.incremental_analysis.finalize()
+            self.incremental_analysis = None
+
+        # # Vacuum
+        # vacuum can only be run outside a transaction
+        vacuum_database(self.dsn)
+
+        # independent queries run at the same time, see QueryPipeline
+        pipeline = QueryPipeline(self.dsn)
+        if not incremental:
+            # # Extract data into tables
+            pipeline.add(
+                "create_table_itineraries_with_regions",
+                ("itineraries", "stops_with_regions"), ("itineraries_with_regions",),
+                self.filter_parameters(),
+            )
+            pipeline.add(
+                "create_table_itinerary_stop_times_with_regions",
+                ("itinerary_stop_times", "stops_with_regions", "itineraries_with_regions"),
+                ("itinerary_stop_times_with_regions",),
+            )
+            pipeline.add(
+                "create_table_itinerary_stop_times_with_lead_region",
+                ("itinerary_stop_times_with_regions",), ("itinerary_stop_times_with_lead_region",),
+            )
+            pipeline.add(
+                "create_table_itinerary_stop_times_with_lag_region",
+                ("itinerary_stop_times_with_regions",), ("itinerary_stop_times_with_lag_region",),
+            )
+            pipeline.add(
+                "create_table_stop_times_from_origin",
+                ("itineraries_with_regions", "itinerary_stop_times_with_lead_region"), ("stop_times_from_origin",),
+            )
+
+            # # Calculate final tables
+            pipeline.add(
+                "create_table_starting_in_origin_dow_hour",
+                ("stop_times_from_origin",), ("starting_in_origin_dow_hour",),
+            )
+            pipeline.add(
+                "create_table_incoming_per_region_dow_hour",
+                ("itinerary_stop_times_with_regions",), ("incoming_per_region_dow_hour",),
+            )
+            pipeline.add(
+                "create_table_outgoing_per_region_dow_hour",
+                ("itinerary_stop_times_with_regions",), ("outgoing_per_region_dow_hour",),
+            )
+
+        if self.process_proxy_stops:
+            # data on non-regional destinations
+            pipeline.add(
+                "create_table_itinerary_stop_times_at_proxy_stops",
+                ("itinerary_stop_times_with_regions", "proxy_stops", "stops"),
+                ("itinerary_stop_times_at_proxy_stops",),
+            )
+            for direction in ("from", "to"):
+                pipeline.add(
+                    f"create_table_itinerary_stop_times_{direction}_nonregional",
+                    (
+                        "itinerary_stop_times_at_proxy_stops", "stop_times_from_origin", "proxy_stops",
+                        "stops", "regions", "mobility_hourly",
+                    ),
+                    (f"itinerary_stop_times_{direction}_nonregional",),
+                )
+            pipeline.add(
+                "create_table_starting_in_origin_dow_hour_with_nonregional",
+                (
+                    "starting_in_origin_dow_hour", "itinerary_stop_times_from_nonregional",
+                    "itinerary_stop_times_to_nonregional",
+                ),
+                ("starting_in_origin_dow_hour_with_nonregional",),
+            )
+
+        logger.info("##### Running the queries of the analysis...")
+        pipeline.run()
+
+    def housekeeping(self):
+        """Kills OTP, prints statistics."""
+        self.kill_otp()
+
+        if self.purge_intermediate_tables:
+            logger.info("Purging intermediate tables...")
+            run_query("drop_intermediate_tables", self.dsn)
+            vacuum_database(self.dsn)
+
+        logger.info("##### Finished!")
+
+        with psycopg2.connect(self.dsn) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM itineraries;")
+                itineraries_count = cursor.fetchone()[0]
+                cursor.execute("SELECT count(*) FROM itinerary_stop_times;")
+                itinerary_stop_times_count = cursor.fetchone()[0]
+                logger.info((
+                    f"Collected a total of {itineraries_count} itineraries "
+                    f"with {itinerary_stop_times_count} stop times!"
+                ))
+                logger.debug("Hint: If the counts differ between runs, you might have ran with different stops as OD.")
+
+        logger.info("***** All done! *****")
+        logger.info("  Results are available in the following tables:")
+        logger.info("    - incoming_per_region_dow_hour")
+        logger.info("    - outgoing_per_region_dow_hour")
+        logger.info("    - starting_in_origin_dow_hour")
+        if self.process_proxy_stops:
+            logger.info("    - starting_in_origin_dow_hour_with_nonregional")
@@ -0,0 +1,142 @@
+import sys
+import logging
+import argparse
+import threading
+import configparser
+
+import multiprocessing
+multiprocessing.freeze_support()  # MUST FOLLOW THE IMPORT IMMEDIATELY or you will get errors in the built .exe
+
+from importer import Importer, make_dsn, log_configuration
+from config import PROGRESS_LOG_INTERVAL
+
+# # # # # # # # # #
+
+# set up logging
+logging_format = '%(asctime)s %(levelname)-4s %(message)s'
+logging_datefmt = '%Y-%m-%d %H:%M:%S'
+logging.basicConfig(format=logging_format, level=logging.INFO, datefmt=logging_datefmt)
+logger = logging.getLogger("MARA")
+
+
+def importer_from_section(section):
+    """Creates the importer for a job, see the README for the keys of a job.
+
+    Args:
+        section (configparser.SectionProxy): The job's section of a jobs file
+
+    Returns:
+        Importer: The importer
+    """
+    return Importer(
+        make_dsn(
+            section.get("host", "localhost"),
+            section.get("port", "5432"),
+            section.get("database", "postgres"),
+            section.get("user", "postgres"),
+            section.get("password", ""),
+        ),
+        gtfs_file_path1=section["gtfs"],
+        gtfs_file_path2=section.get("gtfs_additional", ""),
+        osm_file_path=section["osm"],
+        year=section.getint("year"),
+        calendar_week=section.getint("week"),
+        regions_table=section["regions_table"],
+        regions_idcolumn=section["regions_id_column"],
+        regions_geomcolumn=section["regions_geom_column"],
+        regions_labelcolumn=section["regions_label_column"],
+        travel_time_factor_threshold=section.getfloat("travel_time_factor_threshold", 2.0),
+        process_proxy_stops=section.getboolean("proxy_stops", True),
+        purge_intermediate_tables=section.getboolean("purge_intermediate_tables", False),
+        resume_collection=section.getboolean("resume", False),
+    )
+
+
+def log_progress(importer, stopping):
+    """Logs the progress of the scraping every PROGRESS_LOG_INTERVAL until stopping is set.
+
+    Args:
+        importer (Importer): The importer of the running job
+        stopping (threading.Event): Set when the job is done
+    """
+    while not stopping.wait(PROGRESS_LOG_INTERVAL):
+        progress = importer.progress
+        if progress is not None:
+            logger.info(f"Progress: {progress.describe()}")
+
+
+def run_job(name, section):
+    """Runs a job, OTP is shut down afterwards even if it failed.
+
+    Args:
+        name (str): Name of the job
+        section (configparser.SectionProxy): The job's section of a jobs file
+
+    Returns:
+        bool: Whether the job succeeded
+    """
+    logger.info(f"##### Starting job {name}...")
+    try:
+        importer = importer_from_section(section)
+    except (KeyError, ValueError) as e:
+        logger.critical(f"Job {name} is not configured correctly, missing or invalid: {e}")
+        return False
+
+    stopping = threading.Event()
+    watcher = threading.Thread(target=log_progress, args=(importer, stopping), daemon=True)
+    watcher.start()
+    try:
+        importer.run()
+        return True
+    except Exception as e:
+        logger.exception(e)
+        return False
+    finally:
+        stopping.set()
+        importer.kill_otp()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Runs the MARA PTM Importer without GUI. Each section of the jobs files is a job, "
+            "they run one after the other. Keys in a [DEFAULT] section apply to all jobs of a file."
+        )
+    )
+    parser.add_argument("jobs_files", nargs="+", help="INI files with the jobs")
+    parser.add_argument("--job", action="append", dest="selected_jobs", help="Only run this job (repeatable)")
+    parser.add_argument("--keep-going", action="store_true", help="Run the remaining jobs if one fails")
+    args = parser.parse_args()
+
+    jobs = []
+    for jobs_file in args.jobs_files:
+        jobs_config = configparser.ConfigParser()
+        if not jobs_config.read(jobs_file, encoding="utf-8"):
+            parser.error(f"Cannot read {jobs_file}")
+        jobs.extend(
+            (name, jobs_config[name]) for name in jobs_config.sections()
+            if not args.selected_jobs or name in args.selected_jobs
+        )
+    if not jobs:
+        parser.error("No jobs to run")
+
+    logger.info(f"Welcome to the MARA PTM Importer! Running {len(jobs)} job(s).\n{'-' * 80}")
+    log_configuration()
+
+    succeeded, failed = 0, []
+    for name, section in jobs:
+        if run_job(name, section):
+            succeeded += 1
+        else:
+            failed.append(name)
+            if not args.keep_going:
+                break
+
+    logger.info(f"##### {succeeded} of {len(jobs)} job(s) finished successfully.")
+    if failed:
+        logger.critical(f"Failed job(s): {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import logging
+import threading
+import multiprocessing
+from bisect import bisect_left
+from pathlib import Path
+
+from config import METRICS_DIRECTORY, METRICS_EXPORT_INTERVAL
+
+logger = logging.getLogger("MARA")
+
+PREFIX = "mara_ptm_"
+
+# name: (help, label name, label values), a counter per label value
+COUNTERS = {
+    "otp_requests_total": ("Plan requests answered by OTP", None, None),
+    "otp_retries_total": ("Plan requests sent again because OTP was temporarily unavailable", None, None),
+    "otp_errors_total": ("Searches given up on", None, None),
+    "otp_response_bytes_total": ("Size of the plan responses", None, None),
+    "plan_cache_hits_total": ("Plans taken from the plan cache instead of OTP", None, None),
+    "itineraries_kept_total": ("Itineraries written to the database", None, None),
+    "itineraries_copied_total": ("Itineraries copied to dates with the same services instead of requesting", None, None),
+    "itineraries_rejected_total": (
+        "Itineraries dropped by the filters", "reason", ("transit_legs", "walk_limit", "travel_time")
+    ),
+    "db_rows_total": ("Rows written to the database", "table", ("itineraries", "itinerary_stop_times")),
+    "db_retries_total": ("Database writes repeated after reconnecting", None, None),
+    "db_ods_buffered_total": ("Searches whose itineraries were buffered for writing to the database", None, None),
+    "db_ods_written_total": ("Searches whose itineraries were written to the database", None, None),
+    "ods_completed_total": (
+        "Searches (O-D relation, date and slice of the day) processed in this run, including failed ones", None, None
+    ),
+    "ods_skipped_total": ("Searches skipped because a previous run completed them", None, None),
+}
+
+# name: (help, upper bounds of the buckets)
+HISTOGRAMS = {
+    "otp_request_seconds": (
+        "Time OTP took to answer a plan request", (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+    ),
+    "otp_response_bytes": ("Size of a plan response", (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7, 1e8)),
+    "decode_seconds": ("Time spent decoding a plan response", (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)),
+    "build_seconds": ("Time spent building the rows of a plan", (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)),
+    "db_flush_seconds": ("Time a flush of buffered rows to the database took", (0.1, 0.5, 1, 2.5, 5, 10, 30, 60)),
+}
+
+
+class Metrics:
+    """Counters and histograms of the scraping, shared by all processes involved.
+
+    All values live in one array in shared memory, so a Metrics object can be handed to the
+    processes of the scraping pool (see init_worker()) like the OtpBalancer. The parent process
+    rewrites a Prometheus text file every METRICS_EXPORT_INTERVAL seconds while scraping and
+    writes a JSON summary at the end.
+    """
+
+    def __init__(self):
+        self.offsets = {}
+        size = 0
+        for name, (_, label, values) in COUNTERS.items():
+            for value in values or (None,):
+                self.offsets[name, value] = size
+                size += 1
+        for name, (_, bounds) in HISTOGRAMS.items():
+            self.offsets[name, None] = size
+            size += len(bounds) + 3  # buckets, +Inf, sum, count
+
+        self.values = multiprocessing.Array("d", size)
+        self.stopping = threading.Event()
+        self.exporter = None
+
+    def inc(self, name, amount=1, label=None):
+        """Increases a counter.
+
+        Args:
+            name (str): Name of the counter, see COUNTERS
+            amount (float): (Optional) How much to add
+            label (str): (Optional) Value of the counter's label
+        """
+        offset = self.offsets[name, label]
+        with self.values.get_lock():
+            self.values[offset] += amount
+
+    def value(self, name, label=None):
+        """Returns the current value of a counter.
+
+        Args:
+            name (str): Name of the counter, see COUNTERS
+            label (str): (Optional) Value of the counter's label
+
+        Returns:
+            float: The value
+        """
+        return self.values[self.offsets[name, label]]
+
+    def observe(self, name, value):
+        """Records a value in a histogram.
+
+        Args:
+            name (str): Name of the histogram, see HISTOGRAMS
+            value (float): The value
+        """
+        bounds = HISTOGRAMS[name][1]
+        offset = self.offsets[name, None]
+        with self.values.get_lock():
+            self.values[offset + bisect_left(bounds, value)] += 1
+            self.values[offset + len(bounds) + 1] += value
+            self.values[offset + len(bounds) + 2] += 1
+
+    def _histogram(self, values, name):
+        bounds = HISTOGRAMS[name][1]
+        offset = self.offsets[name, None]
+        buckets = values[offset:offset + len(bounds) + 1]
+        return bounds, buckets, values[offset + len(bounds) + 1], values[offset + len(bounds) + 2]
+
+    def prometheus_text(self):
+        """Returns all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics
+        """
+        with self.values.get_lock():
+            values = self.values[:]
+
+        lines = []
+        for name, (description, label, label_values) in COUNTERS.items():
+            lines.append(f"# HELP {PREFIX}{name} {description}")
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for value in label_values or (None,):
+                labels = f'{{{label}="{value}"}}' if label else ""
+                lines.append(f"{PREFIX}{name}{labels} {values[self.offsets[name, value]]:g}")
+
+        for name, (description, _) in HISTOGRAMS.items():
+            bounds, buckets, total, count = self._histogram(values, name)
+            lines.append(f"# HELP {PREFIX}{name} {description}")
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            cumulative = 0
+            for bound, bucket in zip(bounds + ("+Inf",), buckets):
+                cumulative += bucket
+                lines.append(f'{PREFIX}{name}_bucket{{le="{bound}"}} {cumulative:g}')
+            lines.append(f"{PREFIX}{name}_sum {total:g}")
+            lines.append(f"{PREFIX}{name}_count {count:g}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Returns the counters and, for each histogram, count, mean and estimated quantiles.
+
+        The quantiles are the upper bounds of the buckets they fall into.
+
+        Returns:
+            dict: The summary
+        """
+        with self.values.get_lock():
+            values = self.values[:]
+
+        summary = {}
+        for name, (_, label, label_values) in COUNTERS.items():
+            if label:
+                summary[name] = {value: values[self.offsets[name, value]] for value in label_values}
+            else:
+                summary[name] = values[self.offsets[name, None]]
+
+        for name in HISTOGRAMS:
+            bounds, buckets, total, count = self._histogram(values, name)
+            histogram = {"count": count, "mean": total / count if count else None}
+            for quantile in (0.5, 0.9, 0.99):
+                cumulative = 0
+                for bound, bucket in zip(bounds + (float("inf"),), buckets):
+                    cumulative += bucket
+                    if count and cumulative >= quantile * count:
+                        histogram[f"p{round(quantile * 100)}"] = bound
+                        break
+            summary[name] = histogram
+
+        return summary
+
+    def write_prometheus(self, directory=METRICS_DIRECTORY):
+        """(Re-)writes the Prometheus text file, e. g. for the textfile collector of the node exporter.
+
+        Args:
+            directory (str): (Optional) Where to write mara_ptm.prom
+        """
+        path = Path(directory) / "mara_ptm.prom"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(".prom.part")
+        temporary_path.write_text(self.prometheus_text())
+        os.replace(temporary_path, path)  # so readers never see a partial file
+
+    def write_summary(self, name, directory=METRICS_DIRECTORY):
+        """Writes the JSON summary.
+
+        Args:
+            name (str): Name of the file, without extension
+            directory (str): (Optional) Where to write it
+
+        Returns:
+            Path: The file written
+        """
+        path = Path(directory) / f"{name}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+        return path
+
+    def start_export(self, interval=METRICS_EXPORT_INTERVAL):
+        """Rewrites the Prometheus text file every interval seconds in a background thread."""
+        self.stopping.clear()
+        self.exporter = threading.Thread(target=self._export, args=(interval,), daemon=True)
+        self.exporter.start()
+
+    def stop_export(self):
+        """Stops the background thread after a last rewrite of the Prometheus text file."""
+        self.stopping.set()
+        if self.exporter is not None:
+            self.exporter.join()
+            self.exporter = None
+
+    def _export(self, interval):
+        while True:
+            stopping = self.stopping.wait(interval)
+            try:
+                self.write_prometheus()
+            except OSError as e:
+                logger.warning(f"Could not write the metrics: {e}")
+            if stopping:
+                return
+
+    def __getstate__(self):
+        # only the shared values travel to the processes of the scraping pool
+        return {"offsets": self.offsets, "values": self.values}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stopping = threading.Event()
+        self.exporter = None
+
+
+def format_duration(seconds):
+    """Returns a rough, human readable duration like "2 d 5 h" or "12 min 30 s".
+
+    Args:
+        seconds (float): The duration
+
+    Returns:
+        str: The duration
+    """
+    seconds = int(seconds)
+    for unit, subunit, size, subsize in (("d", "h", 86400, 3600), ("h", "min", 3600, 60), ("min", "s", 60, 1)):
+        if seconds >= size:
+            return f"{seconds // size} {unit} {seconds % size // subsize} {subunit}"
+    return f"{seconds} s"
+
+
+class Progress:
+    """Progress of the scraping, based on the searches counted in the metrics.
+
+    The throughput is smoothed over the calls of update(), so the estimated time of arrival
+    follows changes of the speed (e. g. while OTP adapts its concurrency) without jumping around.
+    """
+
+    SMOOTHING = 0.3  # weight of the latest interval in the throughput
+
+    def __init__(self, metrics, total):
+        """
+        Args:
+            metrics (Metrics): Metrics of the scraping, counting the processed searches
+            total (int): Number of searches to process, including those completed by a previous run
+        """
+        self.metrics = metrics
+        self.total = total
+        self.started = time.monotonic()
+        self.last_update = self.started
+        self.last_completed = 0
+        self.throughput = None  # searches per second
+        self.done = 0
+
+    def update(self):
+        """Takes the current counts and updates the throughput.
+
+        Returns:
+            int: Searches done, including those completed by a previous run
+            float: Searches processed per second, None before the first one is done
+            float: Estimated seconds until all are done, None if unknown
+        """
+        now = time.monotonic()
+        completed = int(self.metrics.value("ods_completed_total"))
+        done = self.done = completed + int(self.metrics.value("ods_skipped_total"))
+
+        if now > self.last_update and completed > self.last_completed:
+            throughput = (completed - self.last_completed) / (now - self.last_update)
+            if self.throughput is None:
+                self.throughput = throughput
+            else:
+                self.throughput += self.SMOOTHING * (throughput - self.throughput)
+            self.last_update = now
+            self.last_completed = completed
+
+        eta = None
+        if self.throughput:
+            eta = max(self.total - done, 0) / self.throughput
+        return done, self.throughput, eta
+
+    def describe(self):
+        """Updates the progress and describes it in a line for the log or the GUI.
+
+        Returns:
+            str: The description
+        """
+        done, throughput, eta = self.update()
+        share = done / self.total * 100 if self.total else 100
+        description = f"{done} of {self.total} searches done ({share:.1f} %)"
+        if throughput is not None:
+            description += f", {throughput:.1f} per second"
+        if eta is not None:
+            description += f", about {format_duration(eta)} left"
+        return description
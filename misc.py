@@ -1,60 +1,82 @@
 import os
 import csv
+import copy
 import json
 import time
+import hashlib
 import shutil
 import logging
 import datetime
+import threading
 import subprocess
 import urllib.error
 import urllib.request
-from uuid import uuid4
+from array import array
 from pathlib import Path
 from zipfile import ZipFile
-from io import TextIOWrapper
+from io import TextIOWrapper, StringIO
+from itertools import chain, groupby, islice
+from operator import itemgetter
 from collections import defaultdict
 from math import sqrt, radians, cos, sin, asin
-
-from PyQt5.QtCore import QThread, QObject, pyqtSignal
+from multiprocessing.util import Finalize
 
 import psycopg2
-from psycopg2.extras import execute_values
+import psycopg2.extras
+
+try:
+    import orjson  # optional, considerably faster than json for decoding OTP responses
+except ImportError:
+    orjson = None
 
 from config import (
-    ALLOWED_TRANSIT_MODES, MAX_WALK_DISTANCE, OTP_PARAMETERS_TEMPLATE,
-    CAR_KMH, CAR_TRAVEL_FACTOR,
-    LOCAL_OTP_PORT,
+    ALLOWED_TRANSIT_MODES, MAX_WALK_DISTANCE, OTP_PARAMETERS_TEMPLATE, SEARCH_WINDOW_SLICES,
+    CAR_KMH, CAR_TRAVEL_FACTOR, STORE_REJECTED_ITINERARIES,
     TEMP_DIRECTORY,
+    DB_MAX_ATTEMPTS, INGESTION_FLUSH_ROWS, INGESTION_FLUSH_SECONDS, OTP_REQUEST_TIMEOUT,
 )
+from plan_cache import PlanCache
+from otp import backoff_delay
+from metrics import Metrics
 
-psycopg2.extras.register_uuid()  # so we can use UUIDs with PG directly
 logger = logging.getLogger("MARA")
 
-
-# worker for threading
-class Worker(QThread):
-    def __init__(self, func, args):
-        super().__init__()
-        self.func = func
-        self.args = args
-
-    def run(self):
-        self.func(*self.args)
-
-
-class SignallingLogHandler(logging.Handler, QObject):
-    """A logging handler that emits new messages as signals-"""
-    logMessage = pyqtSignal(str)
-
-    def __init__(self):
-        logging.Handler.__init__(self)
-        QObject.__init__(self)
-
-    def emit(self, log_record):
-        message = self.formatter.format(log_record)
-        if log_record.levelno > 20:
-            message = f"{message}"
-        self.logMessage.emit(message)
+# state of a scraping worker process, see init_worker()
+_worker_dsn = None
+_worker_connection = None
+_worker_buffer = None
+_worker_travel_time_factor_threshold = None
+_worker_itinerary_ids = None
+_worker_plan_cache = None
+_worker_balancer = None
+_worker_metrics = None
+_worker_equivalent_dates = None
+_worker_database_lock = threading.Lock()  # the buffer is flushed from a thread of its own, see IngestionBuffer
+_search_time_zone = None  # time zone the search windows are laid out in, see set_search_time_zone()
+
+ITINERARY_ID_BLOCK_SIZE = 2 ** 20  # itinerary IDs reserved by a worker at once, see ItineraryIds
+NULL = -1  # marks missing values in the typed arrays of PlanColumns, no valid index or timestamp
+
+# the error message of OTP for requests that might succeed if tried again
+OTP_TEMPORARILY_UNAVAILABLE = "We're sorry. The trip planner is temporarily unavailable. Please try again later."
+# HTTP status codes of responses that might succeed if tried again, e. g. while OTP is overloaded
+OTP_RETRYABLE_STATUSES = frozenset([500, 502, 503, 504])
+
+# the fields of OTP plan responses that are used, the rest is dropped while decoding
+PLAN_FIELDS = frozenset([
+    "plan", "error", "id", "msg", "message", "date",
+    "from", "to", "lon", "lat",
+    "itineraries", "duration", "startTime", "endTime", "walkLimitExceeded",
+    "legs", "mode", "routeId", "tripId", "intermediateStops",
+    "stopId", "stopIndex", "arrival", "departure",
+])
+
+# escaping for the text format of COPY
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+COPY_NULL = "\\N"
+COPY_READ_SIZE = 1024 ** 2  # characters handed to COPY at once when streaming from a file
+
+_timestamp_texts = {NULL: COPY_NULL}  # cache of format_timestamps()
 
 
 def haversine(lon1, lat1, lon2, lat2):
@@ -98,18 +120,16 @@ def get_dates_of_week(year, calendar_week):
     """Returns a formatted list of dates in the specified week.
 
     Args:
-        year (int): Year
-        calendar_week (int): Calendar week
+        year (int): ISO year
+        calendar_week (int): ISO calendar week
 
     Returns:
         list[str]: List of formatted dates
     """
-    # via https://stackoverflow.com/a/55929919
-    first = next(
-        (datetime.date(year, 1, 1) + datetime.timedelta(days=i)
-         for i in range(367)
-         if (datetime.date(year, 1, 1) + datetime.timedelta(days=i)).isocalendar()[1] == calendar_week))
-    dates = [first + datetime.timedelta(days=i) for i in range(7)]
+    # week 1 is the one with 4 January, date.fromisocalendar() would need Python 3.8
+    january_4 = datetime.date(year, 1, 4)
+    monday = january_4 - datetime.timedelta(days=january_4.isoweekday() - 1) + datetime.timedelta(weeks=calendar_week - 1)
+    dates = [monday + datetime.timedelta(days=i) for i in range(7)]
     return [date.strftime('%Y-%m-%d') for date in dates]
 
 
@@ -132,103 +152,274 @@ def zipped_csv_file_as_dicts(zipfile, filepath):
                 yield row
 
 
-def serviced_calendar_weeks(gtfs_path):
-    """Extracts the serviced calendar weeks from a GTFS feed.
+def zipped_csv_columns(zipfile, filepath, columns):
+    """Reads some columns of a CSV data set line by line from inside a ZIP file.
+
+    Only the given columns are picked from each line, without building a dict per line.
+    Columns the CSV does not have and empty values are None.
+
+    Args:
+        zipfile (str): Path to the ZIP file
+        filepath (str): Path to the CSV file relative to the ZIP root
+        columns (tuple[str]): Names of the columns, in the order they are returned
+
+    Yields:
+        list: The values of a row of the CSV
+    """
+    with ZipFile(zipfile) as zf:
+        with zf.open(filepath) as csv_file:
+            # GTFS files are UTF-8, often with a byte order mark
+            reader = csv.reader(TextIOWrapper(csv_file, encoding="utf-8-sig", newline=""))
+            header = [name.strip() for name in next(reader)]
+            indexes = [header.index(column) if column in header else None for column in columns]
+            for row in reader:
+                if not row:
+                    continue
+                yield [row[i] or None if i is not None and i < len(row) else None for i in indexes]
+
+
+class CopyStream:
+    """A file-like object reading the text of lines from an iterator, so COPY can stream them.
+
+    psycopg2's copy_expert() only calls read(), the lines are consumed as they are needed.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ""
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data, self.buffer = self.buffer + "".join(self.lines), ""
+            return data
+
+        while len(self.buffer) < size:
+            chunk = "".join(islice(self.lines, 1000))
+            if not chunk:
+                break
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_lines(dsn, table, columns, lines):
+    """Streams rows into a table with COPY.
+
+    Args:
+        dsn (str): DSN
+        table (str): Name of the table
+        columns (tuple[str]): Columns of the table the rows are for
+        lines (iterable[str]): Rows in COPY's text format, see copy_line()
+    """
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table}({', '.join(columns)}) FROM STDIN", CopyStream(lines), COPY_READ_SIZE)
+
+
+def copy_line(values):
+    """Formats a row for COPY ... FROM STDIN in its text format, see copy_text().
 
     Args:
-        gtfs_path (str): Path to the GTFS file to inspect
+        values (list[str]): Values of the row, None becomes NULL
 
     Returns:
-        dict: year -> list of calendar weeks
-    """
-    logger.info(f"Inspecting GTFS feed {filename(gtfs_path)} for serviced calender weeks...")
-    gtfs_file = ZipFile(gtfs_path)
-
-    # extract the first and last service dates
-    dates = set()
-    # either might not exist, they are optional in a way
-    if "calendar.txt" in gtfs_file.namelist():
-        logger.debug("Found calendar.txt, gathering dates...")
-        for entry in zipped_csv_file_as_dicts(gtfs_path, "calendar.txt"):
-            dates.add(entry["start_date"])
-            dates.add(entry["end_date"])
-    elif "calendar_dates.txt" in gtfs_file.namelist():
-        logger.debug("Found calendar_dates.txt, gathering dates...")
-        for entry in zipped_csv_file_as_dicts(gtfs_path, "calendar_dates.txt"):
-            dates.add(entry["date"])
-    else:
-        logger.critical(
-            "Malformed GTFS feed {filename(gtfs_path)}, no calendar dates (neither calendar.txt nor calendar_dates.txt exist)!"
-        )
-        return None, None
-
-    start_date = min(dates)
-    end_date = max(dates)
-    logger.info(f"{filename(gtfs_path)} covers {start_date} to {end_date}.")
-
-    # extract the year and week of the first resp. last service dates
-    start_year = int(start_date[:4])
-    end_year = int(end_date[:4])
-    start_calendar_week = datetime.datetime.strptime(start_date, "%Y%m%d").isocalendar()[1]  # 1 = week
-    end_calendar_week = datetime.datetime.strptime(end_date, "%Y%m%d").isocalendar()[1]  # 1 = week
-    logger.debug(f"{start_year} W{start_calendar_week} - {end_year} W{end_calendar_week}")
-
-    # generate list of calendar weeks
-    years_calendar_weeks = defaultdict(list)
-
-    if end_year > start_year:
-        for year in range(start_year, end_year+1):
-            last_week = datetime.date(year, 12, 28)  # ref https://stackoverflow.com/a/29263010/4828720
-            last_week_number = last_week.isocalendar()[1]  # 1 = week
-
-            if year == start_year:
-                years_calendar_weeks[year] = list(range(start_calendar_week, last_week_number+1))
-            elif year == end_year:
-                years_calendar_weeks[year] = list(range(1, end_calendar_week+1))
-            else:
-                years_calendar_weeks[year] = list(range(1, last_week_number+1))
-    else:
-        years_calendar_weeks[start_year] = list(range(start_calendar_week, end_calendar_week+1))
+        str: The formatted row including the line break
+    """
+    return "\t".join(COPY_NULL if value is None else value.translate(COPY_ESCAPES) for value in values) + "\n"
+
+
+def load_gtfs_stops(dsn, gtfs_path):
+    """Loads the stops of a GTFS feed into the stops table.
+
+    Args:
+        dsn (str): DSN
+        gtfs_path (str): Path to the GTFS feed
+    """
+    columns = ("stop_id", "stop_code", "stop_name", "location_type", "parent_station", "stop_lon", "stop_lat")
+
+    def lines():
+        for stop_id, stop_code, stop_name, location_type, parent_station, lon, lat in zipped_csv_columns(
+                gtfs_path, "stops.txt", columns):
+            # EWKT, so PostGIS does not need ST_MakePoint() per row
+            geom = f"SRID=4326;POINT({lon} {lat})" if lon and lat else None
+            yield copy_line((stop_id, stop_code, stop_name, location_type, parent_station, geom))
+
+    copy_lines(dsn, "stops", columns[:5] + ("geom",), lines())
+
+
+def load_gtfs_stop_times(dsn, gtfs_path):
+    """Loads the stop times of a GTFS feed into the stop_times table.
+
+    Args:
+        dsn (str): DSN
+        gtfs_path (str): Path to the GTFS feed
+    """
+    columns = ("trip_id", "stop_id", "stop_sequence")
+    copy_lines(dsn, "stop_times", columns, map(copy_line, zipped_csv_columns(gtfs_path, "stop_times.txt", columns)))
+
+
+def trip_terminal_stops(gtfs_path):
+    """Finds the stops where trips start and end in a single pass over stop_times.txt of a GTFS feed.
+
+    Per trip only the lowest and highest stop_sequence seen so far and their stops are kept,
+    in typed arrays indexed by the number of the trip.
+
+    Args:
+        gtfs_path (str): Path to the GTFS feed
+
+    Returns:
+        set[str]: IDs of the stops where trips start
+        set[str]: IDs of the stops where trips end
+    """
+    trips = {}  # trip_id -> number of the trip
+    stop_numbers = {}  # stop_id -> number of the stop
+    first_sequence, first_stop = array("q"), array("i")
+    last_sequence, last_stop = array("q"), array("i")
+
+    rows = zipped_csv_columns(gtfs_path, "stop_times.txt", ("trip_id", "stop_id", "stop_sequence"))
+    for trip_id, stop_id, stop_sequence in rows:
+        sequence = int(stop_sequence)
+        stop = stop_numbers.setdefault(stop_id, len(stop_numbers))
+        trip = trips.get(trip_id)
+        if trip is None:
+            trips[trip_id] = len(trips)
+            first_sequence.append(sequence)
+            first_stop.append(stop)
+            last_sequence.append(sequence)
+            last_stop.append(stop)
+        elif sequence < first_sequence[trip]:
+            first_sequence[trip] = sequence
+            first_stop[trip] = stop
+        elif sequence > last_sequence[trip]:
+            last_sequence[trip] = sequence
+            last_stop[trip] = stop
+
+    stop_ids = list(stop_numbers)
+    return {stop_ids[stop] for stop in set(first_stop)}, {stop_ids[stop] for stop in set(last_stop)}
+
+
+def stops_by_coordinates(gtfs_path, stop_ids):
+    """Picks one stop per coordinate, the one with the lowest ID, like GROUP BY geom in SQL.
+
+    There are stops with the same coordinates, we are not interested in those, just one.
+    IDs that are not in stops.txt of the feed are dropped.
+
+    Args:
+        gtfs_path (str): Path to the GTFS feed
+        stop_ids (set[str]): IDs of the stops to pick from
+
+    Returns:
+        list[str]: The picked stop IDs, sorted
+    """
+    picked = {}  # (lon, lat) -> stop_id
+    for stop_id, lon, lat in zipped_csv_columns(gtfs_path, "stops.txt", ("stop_id", "stop_lon", "stop_lat")):
+        if stop_id not in stop_ids:
+            continue
+        coordinates = (float(lon), float(lat)) if lon and lat else None
+        if coordinates not in picked or stop_id < picked[coordinates]:
+            picked[coordinates] = stop_id
+    return sorted(picked.values())
+
+
+def file_digest(path):
+    """Calculates the SHA-256 digest of a file's content.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_file(source, target):
+    """Makes a file available at another path without copying it if possible.
+
+    A hardlink is tried first, then a symlink. Only if neither is supported by the file system
+    (or the permissions) the file is copied, unless an identical copy is already there.
+
+    Args:
+        source (Path): The original file
+        target (Path): Where it should be available
+    """
+    if target.is_symlink() and not target.exists():
+        target.unlink()  # dangling, the original was moved or deleted
+
+    if target.exists():
+        if os.path.samefile(source, target):
+            logger.info(f"{source} is already staged as {target}")
+            return
+        if (
+                not target.is_symlink()
+                and source.stat().st_size == target.stat().st_size
+                and file_digest(source) == file_digest(target)
+        ):
+            logger.info(f"An identical copy of {source} is already staged as {target}")
+            return
+        target.unlink()
+
+    try:
+        os.link(source, target)
+        logger.info(f"Staged {source} as {target} (hardlink)")
+        return
+    except OSError:
+        pass  # e. g. another file system
 
-    return years_calendar_weeks
+    try:
+        os.symlink(source.resolve(), target)
+        logger.info(f"Staged {source} as {target} (symlink)")
+        return
+    except OSError:
+        pass  # e. g. missing privileges on Windows
+
+    logger.info(f"Copying {source} to {target}")
+    shutil.copy(source, target)
 
 
 def prepare_files(gtfs_file1, osm_file, gtfs_file2=None):
-    """Copies files to the temp directory for OTP.
+    """Stages the files in the temp directory for OTP.
+
+    Files staged by a previous run are kept if they are still the same, all others are removed
+    as OTP builds its graph from everything in the directory.
 
     Args:
         gtfs_file1 (str): Path to the main GTFS feed
         osm_file (str): Path to the OSM PBF data
         gtfs_file2 (str): (Optional) Path to another GTFS feed
     """
-    try:
-        temp_directory = Path(TEMP_DIRECTORY)
-
-        logger.info(f"Deleting directory {TEMP_DIRECTORY}/")
-        shutil.rmtree(temp_directory, ignore_errors=True)
-
-        temp_directory.mkdir()
-
-        if not gtfs_file2:
-            logger.info(f"Copying {gtfs_file1} to {TEMP_DIRECTORY}/")
-            shutil.copy(gtfs_file1, temp_directory)
-        else:
-            # We want to use the stops from the main file as basis for OD analysis
-            # OTP will add different prefixes to stops depending on the order it sees their agencies.
-            # So by making sure the main feed has a "higher" filename than the other, we assure its
-            # stops will get the "1:" prefix. This might break in future OTP releases of course...
-            # Hint: http://localhost:8088/otp/routers/default/index/agencies/1 and /2
-            # Hint: http://localhost:8088/otp/routers/default/index/stops
-            logger.info(f"Copying {gtfs_file1} to {TEMP_DIRECTORY}/")
-            shutil.copy(gtfs_file1, temp_directory/"gtfs.2.zip")
-            logger.info(f"Copying {gtfs_file2} to {TEMP_DIRECTORY}/")
-            shutil.copy(gtfs_file2, temp_directory/"gtfs.1.zip")  # OTP will use 1: for the second file it sees
-
-        logger.info(f"Copying {osm_file} to {TEMP_DIRECTORY}/")
-        shutil.copy(osm_file, temp_directory)
-
-    except Exception:
-        raise
+    temp_directory = Path(TEMP_DIRECTORY)
+    temp_directory.mkdir(exist_ok=True)
+
+    if not gtfs_file2:
+        staged = {filename(gtfs_file1): Path(gtfs_file1)}
+    else:
+        # We want to use the stops from the main file as basis for OD analysis
+        # OTP will add different prefixes to stops depending on the order it sees their agencies.
+        # So by making sure the main feed has a "higher" filename than the other, we assure its
+        # stops will get the "1:" prefix. This might break in future OTP releases of course...
+        # Hint: http://localhost:8088/otp/routers/default/index/agencies/1 and /2
+        # Hint: http://localhost:8088/otp/routers/default/index/stops
+        staged = {
+            "gtfs.2.zip": Path(gtfs_file1),
+            "gtfs.1.zip": Path(gtfs_file2),  # OTP will use 1: for the second file it sees
+        }
+    staged[filename(osm_file)] = Path(osm_file)
+
+    for path in temp_directory.iterdir():
+        if path.name not in staged:
+            logger.info(f"Removing {path} which is not needed anymore")
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink()
+
+    for name, source in staged.items():
+        stage_file(source, temp_directory / name)
 
 
 def get_subprocess_output(command):
@@ -241,7 +432,7 @@ def get_subprocess_output(command):
     return iter(p.stdout.readline, b'')
 
 
-def run_query(filename, dsn):
+def run_query(filename, dsn, parameters=None):
     """Runs the contents of from a .sql file as query.
 
     The file will be searched in cwd/queries/*.sql
@@ -252,6 +443,7 @@ def run_query(filename, dsn):
     Args:
         filename (str): Path to a .sql file
         dsn (str): DSN
+        parameters (dict): (Optional) Values for the %(name)s placeholders in the file, % must be escaped as %% then
 
     Raises:
         whatever exception might occur
@@ -266,7 +458,7 @@ def run_query(filename, dsn):
             logger.debug(f"Full query: {query}")
             with psycopg2.connect(dsn) as conn:
                 with conn.cursor() as cursor:
-                    cursor.execute(query)
+                    cursor.execute(query, parameters)
                     logger.info(f"Running query {filename}... Success!")
     except Exception as e:
         raise
@@ -291,142 +483,777 @@ def vacuum_database(dsn):
     logger.info("VACUUMing database done!")
 
 
-def plan_to_postgres(plan: dict, travel_time_factor_threshold, dsn):
-    """'Parse' a OTP plan and feed the relevant stuff into PG.
+def pending_ods(ods, dsn, metrics=None):
+    """Filters out the O-D relations per date that have been completed by a previous run.
+
+    The completed relations are looked up per origin so memory use stays low.
+
+    Args:
+        ods (iterable[tuple]): (origin, destination, date, time slice), grouped by origin
+        dsn (str): DSN
+        metrics (metrics.Metrics): (Optional) Counts the skipped relations for the progress
+
+    Yields:
+        tuple: (origin, destination, date, time slice)
+    """
+    for origin, group in groupby(ods, key=itemgetter(0)):
+        with psycopg2.connect(dsn) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT destination, date::text, time_slice FROM completed_ods WHERE origin = %s;",
+                    (origin,)
+                )
+                completed = set(cursor.fetchall())
+
+        for od in group:
+            if od[1:] not in completed:
+                yield od
+            elif metrics is not None:
+                metrics.inc("ods_skipped_total")
+
+
+def connect(dsn):
+    """Opens a connection to PG with the session time zone set to UTC.
+
+    Args:
+        dsn (str): DSN
+
+    Returns:
+        psycopg2.extensions.connection: The connection
+    """
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute("SET TIME ZONE 'UTC';")  # making sure the inserted timestamps are treated correctly...
+    conn.commit()
+    return conn
+
+
+def init_worker(dsn, travel_time_factor_threshold, plan_cache_fingerprint=None, balancer=None, metrics=None,
+                equivalent_dates=None, time_zone=None):
+    """Initializer for the processes of the scraping pool.
+
+    Opens a connection that is kept for the lifetime of the worker and sets up the buffer
+    for its rows. Both are flushed resp. closed when the worker exits after the pool was closed.
+    Settings that are the same for all tasks are kept here as well so they are not sent along
+    with every single task.
+
+    Args:
+        dsn (str): DSN
+        travel_time_factor_threshold (float): How much longer than a car may public transport take
+        plan_cache_fingerprint (str): (Optional) Fingerprint of the graph, enables the plan cache
+        balancer (otp.OtpBalancer): (Optional) Picks the OTP instance for each request, not needed for replaying
+        metrics (metrics.Metrics): (Optional) Shared metrics of the scraping, collected for this process only if not given
+        equivalent_dates (dict): (Optional) Date -> list of (date, shift in milliseconds) its itineraries are copied to,
+            see feed_index.service_day_classes()
+        time_zone (zoneinfo.ZoneInfo): (Optional) Time zone of the feed, see set_search_time_zone()
+    """
+    global _worker_dsn, _worker_connection, _worker_buffer, _worker_travel_time_factor_threshold
+    global _worker_itinerary_ids, _worker_plan_cache, _worker_balancer, _worker_metrics, _worker_equivalent_dates
+    _worker_dsn = dsn
+    _worker_equivalent_dates = equivalent_dates or {}
+    set_search_time_zone(time_zone)
+    _worker_balancer = balancer
+    _worker_metrics = metrics if metrics is not None else Metrics()
+    _worker_travel_time_factor_threshold = travel_time_factor_threshold
+    _worker_connection = connect(dsn)
+    _worker_buffer = IngestionBuffer(_worker_metrics)
+    _worker_itinerary_ids = ItineraryIds()
+    _worker_plan_cache = PlanCache(plan_cache_fingerprint) if plan_cache_fingerprint else None
+    # higher exitpriority runs first
+    Finalize(None, close_worker_connection, exitpriority=10)
+    Finalize(_worker_buffer, _worker_buffer.close, exitpriority=20)
+    threading.Thread(target=_worker_buffer.flush_periodically, daemon=True).start()
+    if _worker_plan_cache is not None:
+        Finalize(_worker_plan_cache, _worker_plan_cache.close, exitpriority=10)
+
+
+def worker_connection():
+    """Returns the connection of this worker process, (re-)connecting if necessary.
+
+    Returns:
+        psycopg2.extensions.connection: The connection
+    """
+    global _worker_connection
+    if _worker_connection is None or _worker_connection.closed:
+        _worker_connection = connect(_worker_dsn)
+    return _worker_connection
+
+
+def close_worker_connection():
+    """Closes the connection of this worker process, if any."""
+    global _worker_connection
+    if _worker_connection is not None and not _worker_connection.closed:
+        try:
+            _worker_connection.close()
+        except psycopg2.Error:
+            pass  # it is gone either way
+    _worker_connection = None
+
+
+def copy_text(rows):
+    """Formats rows for COPY ... FROM STDIN in its text format.
+
+    Args:
+        rows (list[tuple]): Rows of values, None becomes NULL
+
+    Returns:
+        StringIO: The formatted rows, ready to be read
+    """
+    buffer = StringIO()
+    for row in rows:
+        buffer.write("\t".join(
+            COPY_NULL if value is None else str(value).translate(COPY_ESCAPES)
+            for value in row
+        ))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def run_with_reconnect(func):
+    """Runs func(cursor) in a transaction on the connection of this worker process.
+
+    On server errors (restart, dropped connection etc.) the worker reconnects and tries again,
+    up to DB_MAX_ATTEMPTS times.
+
+    Args:
+        func (callable): Gets a cursor, its return value is passed on
+
+    Returns:
+        Whatever func returns
+    """
+    with _worker_database_lock:  # one transaction at a time on the connection
+        return _run_with_reconnect(func)
+
+
+def _run_with_reconnect(func):
+    for attempt in range(1, DB_MAX_ATTEMPTS + 1):
+        conn = worker_connection()
+        try:
+            with conn:  # commits or rolls back, the connection stays open
+                with conn.cursor() as cursor:
+                    return func(cursor)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # a fresh connection usually helps
+            close_worker_connection()
+            if attempt == DB_MAX_ATTEMPTS:
+                raise
+            logger.warning(f"Database error, reconnecting (attempt {attempt}/{DB_MAX_ATTEMPTS}): {e}")
+            _worker_metrics.inc("db_retries_total")
+            time.sleep(attempt)
+
+
+class IngestionBuffer:
+    """Collects the rows of many plans and writes them to PG in bulk using COPY.
+
+    The rows are kept in the text format of COPY already. They are flushed in a single
+    transaction once max_rows stop times are buffered or max_seconds have passed since
+    the last flush, checked by a thread of its own (see flush_periodically()) so rows don't
+    wait for the next plan of an idle worker. The O-D relations the rows belong to are recorded in completed_ods
+    in the same transaction, so a run can be resumed from exactly what made it into
+    the database.
+    """
+
+    def __init__(self, metrics, max_rows=INGESTION_FLUSH_ROWS, max_seconds=INGESTION_FLUSH_SECONDS):
+        self.metrics = metrics
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.itineraries = StringIO()
+        self.itinerary_stops = StringIO()
+        self.itinerary_count = 0
+        self.stop_count = 0
+        self.completed_ods = []
+        self.last_flush = time.monotonic()
+
+    def add(self, columns, od):
+        """Adds the rows of a plan, flushing if due.
+
+        Args:
+            columns (PlanColumns): The rows of the plan
+            od (tuple): (origin, destination, date, time slice) of the plan
+        """
+        with self.lock:
+            columns.write_itineraries(self.itineraries)
+            columns.write_itinerary_stops(self.itinerary_stops)
+            self.itinerary_count += columns.itinerary_count
+            self.stop_count += columns.stop_count
+            self.completed_ods.append(od)
+            self.metrics.inc("db_ods_buffered_total")
+
+            if (self.stop_count >= self.max_rows
+                    or time.monotonic() - self.last_flush >= self.max_seconds):
+                self._flush()
+
+    def _copy(self, cursor):
+        self.itinerary_stops.seek(0)
+        cursor.copy_expert("COPY itinerary_stop_times FROM STDIN", self.itinerary_stops)
+        self.itineraries.seek(0)
+        cursor.copy_expert("COPY itineraries FROM STDIN", self.itineraries)
+        cursor.copy_expert("COPY completed_ods FROM STDIN", copy_text(self.completed_ods))
+
+    def flush(self):
+        """Writes all buffered rows to PG, reconnecting on server errors."""
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """Writes the remaining rows when the worker exits.
+
+        Exceptions raised in finalizers are swallowed by multiprocessing, so a failure is only
+        logged here. The parent process notices the missing rows by the counters of buffered
+        and written searches, see Importer.scrape_itineraries().
+        """
+        try:
+            self.flush()
+        except Exception as e:
+            logger.critical(f"Writing the last buffered itineraries of process {os.getpid()} failed: {e}")
+
+    def flush_periodically(self):
+        """Flushes once max_seconds have passed since the last flush, even if no rows are added. Never returns."""
+        while True:
+            time.sleep(self.max_seconds / 10)
+            with self.lock:
+                if not self.completed_ods or time.monotonic() - self.last_flush < self.max_seconds:
+                    continue
+                try:
+                    self._flush()
+                except psycopg2.Error as e:
+                    # the rows are kept, the next flush tries again
+                    logger.warning(f"Writing buffered itineraries failed: {e}")
+
+    def _flush(self):
+        if self.completed_ods:
+            started = time.perf_counter()
+            run_with_reconnect(self._copy)
+            self.metrics.observe("db_flush_seconds", time.perf_counter() - started)
+            self.metrics.inc("db_rows_total", self.itinerary_count, label="itineraries")
+            self.metrics.inc("db_rows_total", self.stop_count, label="itinerary_stop_times")
+            self.metrics.inc("db_ods_written_total", len(self.completed_ods))
+        self._reset()
+
+
+class ItineraryIds:
+    """Hands out unique itinerary IDs, reserving them from PG in blocks.
+
+    Each block is one value of the itinerary_id_blocks sequence and spans ITINERARY_ID_BLOCK_SIZE
+    IDs, so IDs are unique across all workers and resumed runs without a round trip per itinerary.
+    """
+
+    def __init__(self):
+        self.next_id = 0
+        self.end = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.next_id == self.end:
+            block = run_with_reconnect(self._reserve_block)
+            self.next_id = block * ITINERARY_ID_BLOCK_SIZE
+            self.end = self.next_id + ITINERARY_ID_BLOCK_SIZE
+        itinerary_id = self.next_id
+        self.next_id += 1
+        return itinerary_id
+
+    @staticmethod
+    def _reserve_block(cursor):
+        cursor.execute("SELECT nextval('itinerary_id_blocks');")
+        return cursor.fetchone()[0]
+
+
+def format_timestamps(timestamps):
+    """Converts epoch milliseconds to timestamps in the text format of COPY, in bulk.
+
+    A plan repeats the same few times a lot, so every distinct value is only converted once
+    and the results are kept for later plans.
+
+    Args:
+        timestamps (iterable[int]): Unix timestamps in milliseconds, NULL for missing values
+
+    Returns:
+        dict: timestamp -> text, covering all given timestamps
+    """
+    if len(_timestamp_texts) > 500000:  # a few days worth of seconds, don't grow forever
+        _timestamp_texts.clear()
+        _timestamp_texts[NULL] = COPY_NULL
+
+    for timestamp in set(timestamps).difference(_timestamp_texts):
+        _timestamp_texts[timestamp] = f"{to_datetime(timestamp).isoformat(' ')}+00"
+
+    return _timestamp_texts
+
+
+def filter_itineraries(plan: dict, travel_time_factor_threshold, store_rejected=STORE_REJECTED_ITINERARIES,
+                       window_end=None):
+    """Returns the itineraries of a plan that are relevant for the analysis.
+
+    The same filters are applied again in create_table_itineraries_with_regions.sql, based on the
+    values stored along with the itineraries. With store_rejected they are only applied there,
+    so the analysis can be repeated with other thresholds.
 
     Args:
         plan (dict): A plan scraped from OTP
         travel_time_factor_threshold (float): How much longer than a car may public transport take
-        dsn (str): A DSN
+        store_rejected (bool): (Optional) Keep the itineraries the filters would reject
+        window_end (int): (Optional) Epoch milliseconds, itineraries starting then or later are dropped
+
+    Returns:
+        float: Linear distance between origin and destination in km
+        list[tuple]: (itinerary (dict), number of transit legs (int))
+        dict: Number of rejected itineraries by the filter that rejected them
     """
+    rejected = defaultdict(int)
 
     # check if there were any itineraries at all
     if not plan["itineraries"]:
-        return
-
-    itineraries = []
-    itinerary_stops = []
+        return 0.0, [], rejected
 
     # ignore itineraries between the same coordinate
     if (plan["from"]["lon"], plan["from"]["lat"]) == (plan["to"]["lon"], plan["to"]["lat"]):
-        return
+        return 0.0, [], rejected
 
     linear_distance_km = haversine(plan["from"]["lon"], plan["from"]["lat"], plan["to"]["lon"], plan["to"]["lat"])
+    car_duration = linear_distance_km*CAR_TRAVEL_FACTOR / CAR_KMH
 
+    itineraries = []
     for itinerary in plan["itineraries"]:
-
-        # filter to just the specified kind of itinerary, e. g. max of 3 PT legs (2 changes)
-        iti_modes = [leg["mode"] for leg in itinerary["legs"] if leg["mode"] != "WALK"]
-        if len(iti_modes) > 3:
-            # logger.debug(f"len(iti_modes) > 3: {iti_modes=}")
+        # OTP also returns itineraries beyond the search window, the next slice of the day has them as well
+        if window_end is not None and itinerary["startTime"] >= window_end:
             continue
 
-        # OTP includes itineraries that exceed the maxWalkDistance but marks them with a flag
-        if itinerary["walkLimitExceeded"]:
-            # logger.debug(f"{itinerary['walkDistance']=} > {itinerary['walkLimitExceeded']=}")
-            continue
+        transit_legs = sum(1 for leg in itinerary["legs"] if leg["mode"] != "WALK")
+
+        if not store_rejected:
+            # filter to just the specified kind of itinerary, e. g. max of 3 PT legs (2 changes)
+            if transit_legs > 3:
+                rejected["transit_legs"] += 1
+                continue
+
+            # OTP includes itineraries that exceed the maxWalkDistance but marks them with a flag
+            if itinerary["walkLimitExceeded"]:
+                rejected["walk_limit"] += 1
+                continue
+
+            # discard if ÖPNV takes too long compared to car
+            itinerary_duration = itinerary["duration"]/3600
+            if (itinerary_duration / car_duration) > travel_time_factor_threshold:
+                rejected["travel_time"] += 1
+                continue
+
+        itineraries.append((itinerary, transit_legs))
+
+    return linear_distance_km, itineraries, rejected
 
-        # discard if ÖPNV takes too long compared to car
-        itinerary_duration = itinerary["duration"]/3600
-        car_duration = linear_distance_km*CAR_TRAVEL_FACTOR / CAR_KMH
-        if (itinerary_duration / car_duration) > travel_time_factor_threshold:
-            # logger.debug(f"{itinerary_duration=} / {car_duration=} > {travel_time_factor_threshold=}")
-            continue
 
-        itinerary_index = 0  # counter of stop index within itinerary
+class PlanColumns:
+    """The rows of a plan for the itineraries and itinerary_stop_times tables, column by column.
 
-        from_stop_id = itinerary["legs"][0]["from"]["stopId"]
-        to_stop_id = itinerary["legs"][-1]["to"]["stopId"]
-        start_time = to_datetime(itinerary["startTime"])
-        end_time = to_datetime(itinerary["endTime"])
+    All columns are allocated upfront, numbers go into typed arrays with NULL marking missing
+    values. Timestamps stay epoch milliseconds until the rows are written for COPY, then they
+    are converted in bulk.
+    """
 
-        itinerary_id = uuid4()
+    def __init__(self, plan: dict, travel_time_factor_threshold, itinerary_ids, window_end=None):
+        """
+        Args:
+            plan (dict): A plan scraped from OTP
+            travel_time_factor_threshold (float): How much longer than a car may public transport take
+            itinerary_ids (iterator[int]): Source of unique itinerary IDs
+            window_end (int): (Optional) End of the search window in epoch milliseconds, see filter_itineraries()
+        """
+        self.linear_distance_km, itineraries, self.rejected = filter_itineraries(
+            plan, travel_time_factor_threshold, window_end=window_end
+        )
 
-        itinerary_values = (
-            itinerary_id, from_stop_id, to_stop_id, start_time, end_time
+        n = self.itinerary_count = len(itineraries)
+        m = self.stop_count = sum(
+            len(leg["intermediateStops"]) + 2 if leg["mode"] != "WALK" else 2
+            for itinerary, _ in itineraries
+            for leg in itinerary["legs"]
         )
-        itineraries.append(itinerary_values)
-
-        for leg in itinerary["legs"]:
-            itinerary_index += 1
-
-            route_id = leg["routeId"] if leg["mode"] != "WALK" else None
-            trip_id = leg["tripId"] if leg["mode"] != "WALK" else None
-
-            from_stop = (
-                itinerary_id,
-                itinerary_index,
-                leg["from"]["stopId"],
-                route_id,
-                trip_id,
-                leg["from"]["stopIndex"] if leg["mode"] != "WALK" else None,
-                None,  # no arrival at first stop
-                to_datetime(leg["from"]["departure"]),
-                leg["mode"]
+
+        self.itinerary_id = array("q", [0]) * n
+        self.from_stop_id = [None] * n
+        self.to_stop_id = [None] * n
+        self.start_time = array("q", [0]) * n
+        self.end_time = array("q", [0]) * n
+        self.duration = array("q", [0]) * n
+        self.transit_legs = array("i", [0]) * n
+        self.walk_limit_exceeded = [False] * n
+
+        self.stop_itinerary_id = array("q", [0]) * m
+        self.itinerary_stop_index = array("i", [0]) * m
+        self.stop_id = [None] * m
+        self.route_id = [None] * m
+        self.trip_id = [None] * m
+        self.trip_stop_index = array("i", [NULL]) * m
+        self.arrival = array("q", [NULL]) * m
+        self.departure = array("q", [NULL]) * m
+        self.mode = [None] * m
+
+        row = 0
+        for i, (itinerary, transit_legs) in enumerate(itineraries):
+            itinerary_id = next(itinerary_ids)
+            legs = itinerary["legs"]
+
+            self.itinerary_id[i] = itinerary_id
+            self.from_stop_id[i] = legs[0]["from"]["stopId"]
+            self.to_stop_id[i] = legs[-1]["to"]["stopId"]
+            self.start_time[i] = itinerary["startTime"]
+            self.end_time[i] = itinerary["endTime"]
+            self.duration[i] = itinerary["duration"]
+            self.transit_legs[i] = transit_legs
+            self.walk_limit_exceeded[i] = itinerary["walkLimitExceeded"]
+
+            itinerary_index = 0  # counter of stop index within itinerary
+            for leg in legs:
+                mode = leg["mode"]
+                assert mode in ALLOWED_TRANSIT_MODES, f"{mode} is not one of {ALLOWED_TRANSIT_MODES}"
+                transit = mode != "WALK"  # then we assume we got some PT
+                route_id = leg["routeId"] if transit else None
+                trip_id = leg["tripId"] if transit else None
+
+                # first stop of the leg, no arrival
+                itinerary_index += 1
+                stop = leg["from"]
+                self.stop_itinerary_id[row] = itinerary_id
+                self.itinerary_stop_index[row] = itinerary_index
+                self.stop_id[row] = stop["stopId"]
+                self.route_id[row] = route_id
+                self.trip_id[row] = trip_id
+                if transit:
+                    self.trip_stop_index[row] = stop["stopIndex"]
+                self.departure[row] = stop["departure"]
+                self.mode[row] = mode
+                row += 1
+
+                if transit:
+                    for stop in leg["intermediateStops"]:
+                        itinerary_index += 1
+                        self.stop_itinerary_id[row] = itinerary_id
+                        self.itinerary_stop_index[row] = itinerary_index
+                        self.stop_id[row] = stop["stopId"]
+                        self.route_id[row] = route_id
+                        self.trip_id[row] = trip_id
+                        self.trip_stop_index[row] = stop["stopIndex"]
+                        self.arrival[row] = stop["arrival"]
+                        self.departure[row] = stop["departure"]
+                        self.mode[row] = mode
+                        row += 1
+
+                # last stop of the leg, no departure
+                itinerary_index += 1
+                stop = leg["to"]
+                self.stop_itinerary_id[row] = itinerary_id
+                self.itinerary_stop_index[row] = itinerary_index
+                self.stop_id[row] = stop["stopId"]
+                self.route_id[row] = route_id
+                self.trip_id[row] = trip_id
+                if transit:
+                    self.trip_stop_index[row] = stop["stopIndex"]
+                self.arrival[row] = stop["arrival"]
+                self.mode[row] = mode
+                row += 1
+
+    def shifted(self, milliseconds, itinerary_ids):
+        """Returns a copy of the rows with new itinerary IDs and all timestamps shifted, e. g. to another date.
+
+        Args:
+            milliseconds (int): How much to shift the timestamps
+            itinerary_ids (iterator[int]): Source of unique itinerary IDs
+
+        Returns:
+            PlanColumns: The copy, sharing the columns that do not change
+        """
+        shifted = copy.copy(self)
+        shifted.itinerary_id = array("q", islice(itinerary_ids, self.itinerary_count))
+        new_ids = dict(zip(self.itinerary_id, shifted.itinerary_id))
+        shifted.stop_itinerary_id = array("q", (new_ids[i] for i in self.stop_itinerary_id))
+        shifted.start_time = array("q", (t + milliseconds for t in self.start_time))
+        shifted.end_time = array("q", (t + milliseconds for t in self.end_time))
+        shifted.arrival = array("q", (NULL if t == NULL else t + milliseconds for t in self.arrival))
+        shifted.departure = array("q", (NULL if t == NULL else t + milliseconds for t in self.departure))
+        return shifted
+
+    def write_itineraries(self, file):
+        """Writes the rows for the itineraries table in the text format of COPY.
+
+        Args:
+            file (io.TextIOBase): Where to write to
+        """
+        times = format_timestamps(chain(self.start_time, self.end_time))
+        linear_distance_km = repr(self.linear_distance_km)  # repr() keeps full precision for the filter in SQL
+        for i in range(self.itinerary_count):
+            file.write(
+                f"{self.itinerary_id[i]}\t"
+                f"{self.from_stop_id[i].translate(COPY_ESCAPES)}\t"
+                f"{self.to_stop_id[i].translate(COPY_ESCAPES)}\t"
+                f"{times[self.start_time[i]]}\t"
+                f"{times[self.end_time[i]]}\t"
+                f"{self.duration[i]}\t"
+                f"{linear_distance_km}\t"
+                f"{self.transit_legs[i]}\t"
+                f"{'t' if self.walk_limit_exceeded[i] else 'f'}\n"
             )
-            itinerary_stops.append(from_stop)
-
-            assert leg["mode"] in ALLOWED_TRANSIT_MODES, f"{leg['mode']} is not one of {ALLOWED_TRANSIT_MODES}"
-
-            if leg["mode"] != "WALK":  # then we assume we got some PT
-                for stop in leg["intermediateStops"]:
-                    itinerary_index += 1
-                    leg_stop = (
-                        itinerary_id,
-                        itinerary_index,
-                        stop["stopId"],
-                        route_id,
-                        trip_id,
-                        stop["stopIndex"],
-                        to_datetime(stop["arrival"]),
-                        to_datetime(stop["departure"]),
-                        leg["mode"]
-                    )
-                    itinerary_stops.append(leg_stop)
-
-            itinerary_index += 1
-
-            to_stop = (
-                itinerary_id,
-                itinerary_index,
-                leg["to"]["stopId"],
-                route_id,
-                trip_id,
-                leg["to"]["stopIndex"] if leg["mode"] != "WALK" else None,
-                to_datetime(leg["to"]["arrival"]),
-                None,  # no departure from last stop
-                leg["mode"]
+
+    def write_itinerary_stops(self, file):
+        """Writes the rows for the itinerary_stop_times table in the text format of COPY.
+
+        Args:
+            file (io.TextIOBase): Where to write to
+        """
+        times = format_timestamps(chain(self.arrival, self.departure))
+        for row in range(self.stop_count):
+            route_id = self.route_id[row]
+            trip_id = self.trip_id[row]
+            trip_stop_index = self.trip_stop_index[row]
+            file.write(
+                f"{self.stop_itinerary_id[row]}\t"
+                f"{self.itinerary_stop_index[row]}\t"
+                f"{self.stop_id[row].translate(COPY_ESCAPES)}\t"
+                f"{COPY_NULL if route_id is None else route_id.translate(COPY_ESCAPES)}\t"
+                f"{COPY_NULL if trip_id is None else trip_id.translate(COPY_ESCAPES)}\t"
+                f"{COPY_NULL if trip_stop_index == NULL else trip_stop_index}\t"
+                f"{times[self.arrival[row]]}\t"
+                f"{times[self.departure[row]]}\t"
+                f"{self.mode[row]}\n"
             )
 
-            itinerary_stops.append(to_stop)
 
-    with psycopg2.connect(dsn) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SET TIME ZONE 'UTC';")  # making sure the inserted timestamps are treated correctly...
-            execute_values(
-                cursor,
-                """INSERT INTO itinerary_stop_times VALUES %s""",
-                itinerary_stops,
-            )
+def plan_to_postgres(plan: dict, travel_time_factor_threshold, od):
+    """'Parse' a OTP plan and feed the relevant stuff into PG.
 
-            execute_values(
-                cursor,
-                """INSERT INTO itineraries VALUES %s""",
-                itineraries,
-            )
+    The rows are handed to the buffer of the worker process, see init_worker(). They are copied
+    to the dates on which the same services run as on the date of the plan, if any.
+
+    Args:
+        plan (dict): A plan scraped from OTP
+        travel_time_factor_threshold (float): How much longer than a car may public transport take
+        od (tuple): (origin, destination, date, time slice) of the plan, recorded as completed along with its rows
+    """
+    window_end = None
+    origin, destination, date, time_slice = od
+    if time_slice < SEARCH_WINDOW_SLICES - 1:  # the last slice keeps everything, like a single search of the day
+        window_end = plan["date"] + search_window(time_slice, date)[1] * 60 * 1000
+
+    started = time.perf_counter()
+    columns = PlanColumns(plan, travel_time_factor_threshold, _worker_itinerary_ids, window_end)
+    _worker_metrics.observe("build_seconds", time.perf_counter() - started)
+    _worker_metrics.inc("itineraries_kept_total", columns.itinerary_count)
+    for reason, count in columns.rejected.items():
+        _worker_metrics.inc("itineraries_rejected_total", count, label=reason)
+
+    _worker_buffer.add(columns, od)
+
+    for equivalent_date, milliseconds in _worker_equivalent_dates.get(date, ()):
+        _worker_buffer.add(
+            columns.shifted(milliseconds, _worker_itinerary_ids), (origin, destination, equivalent_date, time_slice)
+        )
+        _worker_metrics.inc("itineraries_copied_total", columns.itinerary_count)
+
+
+def http_status_error(status):
+    """Describes a response that is not a plan like OTP describes its errors.
+
+    Args:
+        status (int): HTTP status code of the response
+
+    Returns:
+        dict: The error, with OTP_TEMPORARILY_UNAVAILABLE as message if a retry might succeed
+    """
+    if status in OTP_RETRYABLE_STATUSES:
+        return {"msg": OTP_TEMPORARILY_UNAVAILABLE, "status": status}
+    return {"msg": f"HTTP status {status}", "status": status}
+
+
+def set_search_time_zone(time_zone):
+    """Sets the time zone of the feed for search_window(), so days with a DST change are covered exactly.
+
+    Without one, every day is taken to have 24 hours.
+
+    Args:
+        time_zone (zoneinfo.ZoneInfo): The time zone, None if unknown
+    """
+    global _search_time_zone
+    _search_time_zone = time_zone
+
+
+def search_window(time_slice, date=None):
+    """Returns the part of the day a time slice covers, see SEARCH_WINDOW_SLICES.
+
+    The day is split by its actual length in the time zone set by set_search_time_zone(), i. e. 23
+    or 25 hours on days with a DST change.
+
+    Args:
+        time_slice (int): Number of the slice, from 0
+        date (str): (Optional) Date of the day (YYYY-MM-DD), it has 24 hours if not given
+
+    Returns:
+        int: Start in minutes after midnight, as shown by a clock in the time zone
+        int: Length in minutes, the last slice takes the rest of the day
+    """
+    day_length = 1440
+    midnight = None
+    if date is not None and _search_time_zone is not None:
+        day = datetime.date.fromisoformat(date)
+        # in UTC, the difference of two times in the same time zone ignores DST
+        midnight, next_midnight = (
+            datetime.datetime.combine(d, datetime.time(), tzinfo=_search_time_zone).astimezone(datetime.timezone.utc)
+            for d in (day, day + datetime.timedelta(days=1))
+        )
+        day_length = int((next_midnight - midnight).total_seconds()) // 60
+
+    length = day_length // SEARCH_WINDOW_SLICES
+    start = time_slice * length
+    if time_slice == SEARCH_WINDOW_SLICES - 1:
+        length = day_length - start
+    if midnight is not None and day_length != 1440:
+        local_start = (midnight + datetime.timedelta(minutes=start)).astimezone(_search_time_zone)
+        start = local_start.hour * 60 + local_start.minute
+    return start, length
+
+
+def otp_plan_path(origin, destination, date, time_slice=0):
+    """Returns the path and query of the OTP plan request for a O-D relation.
+
+    Args:
+        origin (int): Stop ID of the origin
+        destination (int): Stop ID of the destination
+        date (str): Date at which to look for itineraries (YYYY-MM-DD)
+        time_slice (int): (Optional) Part of the day in which to look for itineraries, see search_window()
+
+    Returns:
+        str: Path including the query string
+    """
+    start, length = search_window(time_slice, date)
+    parameters = OTP_PARAMETERS_TEMPLATE.format(
+        origin=origin,
+        destination=destination,
+        date=date,
+        time=f"{start // 60:02d}%3A{start % 60:02d}",
+        search_window=length * 60,
+        max_walk_distance=MAX_WALK_DISTANCE,
+    )
+    return f"/otp/routers/default/plan?{parameters}"
+
+
+def _lean_object(pairs):
+    return {key: value for key, value in pairs if key in PLAN_FIELDS}
+
+
+_lean_decoder = json.JSONDecoder(object_pairs_hook=_lean_object)
+
+
+def _lean_tree(node):
+    """Drops the fields that are not in PLAN_FIELDS from a decoded tree, like _lean_decoder does while decoding."""
+    if type(node) is dict:
+        return {
+            key: _lean_tree(value) if type(value) in (dict, list) else value
+            for key, value in node.items() if key in PLAN_FIELDS
+        }
+    return [_lean_tree(value) if type(value) in (dict, list) else value for value in node]
 
 
-def od_to_postgres(origin: int, destination: int, date: str, travel_time_factor_threshold, dsn, attempt=1):
+def decode_plan_response(content):
+    """Decodes the response of an OTP plan request.
+
+    Every field that is not in PLAN_FIELDS is dropped, so large unused parts like leg geometries,
+    walking steps or fares are not kept in the resulting tree. The standard library decoder does so
+    as soon as each object is decoded. orjson, if installed, decodes the whole tree a few times
+    faster, so it is still a bit faster when the fields are dropped afterwards.
+
+    Args:
+        content (bytes): The response body
+
+    Returns:
+        dict: The decoded response
+    """
+    if orjson is not None:
+        return _lean_tree(orjson.loads(content))
+    return _lean_decoder.decode(content.decode("utf-8"))
+
+
+def record_plan_response(metrics, content, latency):
+    """Counts a response of OTP to a plan request in the metrics.
+
+    Args:
+        metrics (metrics.Metrics): Metrics of the scraping
+        content (bytes): The response body
+        latency (float): Seconds it took OTP to respond
+    """
+    metrics.inc("otp_requests_total")
+    metrics.inc("otp_response_bytes_total", len(content))
+    metrics.observe("otp_request_seconds", latency)
+    metrics.observe("otp_response_bytes", len(content))
+
+
+def ingest_plan_response(content, od, path=None):
+    """Parses the response of an OTP plan request and feeds its itineraries into PG.
+
+    Successful responses are stored in the plan cache of the worker process, if enabled.
+
+    Args:
+        content (bytes): The response body
+        od (tuple): (origin, destination, date, time slice) the plan was requested for
+        path (str): (Optional) Path of the request, needed for storing the response in the plan cache
+
+    Returns:
+        None or the error OTP responded with (dict)
+    """
+    started = time.perf_counter()
+    data = decode_plan_response(content)
+    _worker_metrics.observe("decode_seconds", time.perf_counter() - started)
+
+    if data.get("error"):
+        return data["error"]
+
+    plan_to_postgres(data.get("plan"), _worker_travel_time_factor_threshold, od)
+
+    if _worker_plan_cache is not None and path is not None:
+        _worker_plan_cache.put(path, content)
+
+
+def ingest_cached_plan(path, od):
+    """Feeds a plan from the plan cache of the worker process into PG.
+
+    Args:
+        path (str): Path of the request, see otp_plan_path()
+        od (tuple): (origin, destination, date, time slice) the plan was requested for
+
+    Returns:
+        bool: Whether the plan was cached
+    """
+    if _worker_plan_cache is None:
+        return False
+
+    content = _worker_plan_cache.get(path)
+    if content is None:
+        return False
+    _worker_metrics.inc("plan_cache_hits_total")
+
+    # only successful responses are cached
+    started = time.perf_counter()
+    plan = decode_plan_response(content).get("plan")
+    _worker_metrics.observe("decode_seconds", time.perf_counter() - started)
+    plan_to_postgres(plan, _worker_travel_time_factor_threshold, od)
+    return True
+
+
+def od_to_postgres(origin: int, destination: int, date: str, time_slice=0, attempt=1):
     """Query OTP for a O-D relation and feed the result into PG.
 
-    OTP sometimes fails to give a result, so we retry once.
+    OTP sometimes fails to give a result when it is overloaded, so we retry after a randomized,
+    exponentially growing wait as long as the retry budget of the balancer allows it.
 
     Args:
         origin (int): Stop ID of the origin
         destination (int): Stop ID of the destination
         date (str): Date at which to look for itineraries (YYYY-MM-DD)
-        travel_time_factor_threshold (float): How much longer than a car may public transport take
-        dsn (str): DSN
+        time_slice (int): (Optional) Part of the day in which to look for itineraries, see search_window()
         attempt (int): (Optional) The nth time this query has been tried
 
     Returns:
@@ -436,31 +1263,128 @@ def od_to_postgres(origin: int, destination: int, date: str, travel_time_factor_
     if origin == destination:
         return
 
-    parameters = OTP_PARAMETERS_TEMPLATE.format(
-        origin=origin,
-        destination=destination,
-        date=date,
-        max_walk_distance=MAX_WALK_DISTANCE,
-    )
-    url = f"http://localhost:{LOCAL_OTP_PORT}/otp/routers/default/plan?{parameters}"
-
-    with urllib.request.urlopen(url) as response:
-        content = response.read()
-        data = json.loads(content)
-
-        if not data.get("error"):
-            plan = data.get("plan")
-            plan_to_postgres(plan, travel_time_factor_threshold, dsn)
-        else:
-            # we can handle temporary errors with a simple retry
-            if not data["error"].get("msg") == \
-                   "We're sorry. The trip planner is temporarily unavailable. Please try again later.":
-                return f"Unknown error for {url}: {data['error']}"
-
-            if attempt == 1:
-                logger.warning(f"Nonfatal fail: Making 2nd attempt for {url}")
-                time.sleep(3.14)  # arbitrary value, just to make sure the router gets some relieve
-                od_to_postgres(origin, destination, date, travel_time_factor_threshold, dsn, attempt=2)
-            else:
-                logger.critical(f"Final FAIL for {url}!")
-                return "Error, no plan after second attempt"
+    od = (origin, destination, date, time_slice)
+    path = otp_plan_path(*od)
+    if ingest_cached_plan(path, od):
+        return
+
+    status, content, latency = fetch_plan(path)
+    if status == 200:
+        record_plan_response(_worker_metrics, content, latency)
+        error = ingest_plan_response(content, od, path)
+    else:
+        error = http_status_error(status)
+    overloaded = bool(error) and error.get("msg") == OTP_TEMPORARILY_UNAVAILABLE
+    _worker_balancer.record(latency, overloaded)
+
+    if not error:
+        return
+
+    # we can handle temporary errors with a retry
+    if not overloaded:
+        return f"Unknown error for {path}: {error}"
+
+    if _worker_balancer.allow_retry(attempt):
+        delay = backoff_delay(attempt)  # just to make sure the router gets some relieve
+        logger.warning(f"Nonfatal fail: Making attempt {attempt + 1} for {path} in {delay:.1f} s")
+        _worker_metrics.inc("otp_retries_total")
+        time.sleep(delay)
+        return od_to_postgres(origin, destination, date, time_slice, attempt=attempt + 1)
+    else:
+        logger.critical(f"Final FAIL for {path}!")
+        return f"Error, no plan after {attempt} attempts"
+
+
+def fetch_plan(path):
+    """Requests a plan from the OTP instance with the least outstanding requests.
+
+    Instances that are not reachable twice in a row are reported to the balancer, so they get
+    restarted, and the request is sent to another one. A single failure, e. g. a connection
+    reset, only makes the request be sent again.
+
+    Args:
+        path (str): Path including the query string, see otp_plan_path()
+
+    Returns:
+        int: HTTP status code
+        bytes: The response body
+        float: Seconds it took OTP to respond, without waiting for a free slot
+    """
+    failed = set()  # instances this request could not reach once
+    while True:
+        index = _worker_balancer.acquire()
+        port = _worker_balancer.ports[index]
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(f"http://localhost:{port}{path}", timeout=OTP_REQUEST_TIMEOUT) as response:
+                return response.status, response.read(), time.monotonic() - started
+        except urllib.error.HTTPError as e:
+            # OTP is there but did not answer with a plan, see http_status_error()
+            return e.code, e.read(), time.monotonic() - started
+        except OSError:  # not reachable, connection lost or timed out
+            if index not in failed:
+                failed.add(index)
+                continue
+            logger.warning(f"OpenTripPlanner on port {port} is not reachable, trying another instance.")
+            _worker_balancer.mark_down(index)
+        finally:
+            _worker_balancer.release(index)
+
+
+def scrape_od(od):
+    """Task for the scraping pool, see od_to_postgres().
+
+    Args:
+        od (tuple): (origin, destination, date, time slice)
+
+    Returns:
+        None or information about an error
+    """
+    return od_to_postgres(*od)
+
+
+def replay_od(od):
+    """Task for the scraping pool in replay mode, feeds a plan from the plan cache into PG.
+
+    Args:
+        od (tuple): (origin, destination, date, time slice)
+
+    Returns:
+        None or information about an error
+    """
+    if od[0] == od[1]:
+        return
+
+    path = otp_plan_path(*od)
+    if not ingest_cached_plan(path, od):
+        return f"Not in the plan cache: {path}"
+
+
+class TaskStream:
+    """Hands out tasks lazily while limiting how many are pending at once.
+
+    Pool.imap_unordered() consumes its input as fast as it can in a separate thread. Wrapping
+    the input in a TaskStream and calling done() for every result keeps the number of tasks
+    between dispatch and result (and thereby the memory used for them) constant.
+    """
+
+    def __init__(self, tasks, max_pending):
+        self.tasks = tasks
+        self.slots = threading.Semaphore(max_pending)
+        self.stopped = False
+
+    def __iter__(self):
+        for task in self.tasks:
+            self.slots.acquire()
+            if self.stopped:
+                return
+            yield task
+
+    def done(self):
+        """Marks a task as finished."""
+        self.slots.release()
+
+    def stop(self):
+        """Stops handing out tasks, e. g. before terminating the pool."""
+        self.stopped = True
+        self.slots.release()
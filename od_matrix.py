@@ -0,0 +1,208 @@
+import logging
+
+import numpy as np
+import psycopg2
+
+from config import (
+    OD_MIN_DISTANCE, OD_EXCLUDED_REGION_PAIRS, STOP_CLUSTER_BY_PARENT_STATION, STOP_CLUSTER_DISTANCE,
+)
+
+logger = logging.getLogger("MARA")
+
+BLOCK_SIZE = 1024  # origins per block of the distance matrix, keeps memory use bounded
+
+
+def haversine_matrix(lon1, lat1, lon2, lat2):
+    """Calculate the metric distances between two sets of geographic coordinates on a sphere.
+
+    This is the vectorized equivalent of haversine().
+
+    Args:
+        lon1, lat1 (numpy.ndarray): Coordinates of the first set (n)
+        lon2, lat2 (numpy.ndarray): Coordinates of the second set (m)
+
+    Returns:
+        numpy.ndarray: Distances in km (n x m)
+    """
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+
+    dlon = lon2[np.newaxis, :] - lon1[:, np.newaxis]
+    dlat = lat2[np.newaxis, :] - lat1[:, np.newaxis]
+    a = np.sin(dlat/2)**2 + np.cos(lat1)[:, np.newaxis] * np.cos(lat2)[np.newaxis, :] * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+
+    return 6371 * c
+
+
+def load_stop_locations(stop_ids, dsn):
+    """Loads the coordinates and regions of stops.
+
+    Args:
+        stop_ids (list[str]): IDs of the stops
+        dsn (str): DSN
+
+    Returns:
+        numpy.ndarray: Longitudes, NaN if unknown
+        numpy.ndarray: Latitudes, NaN if unknown
+        numpy.ndarray: Region IDs, None if outside of all regions
+    """
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT ON (stops.stop_id)
+                    stops.stop_id,
+                    ST_X(stops.geom),
+                    ST_Y(stops.geom),
+                    stops_with_regions.region_id
+                FROM stops
+                LEFT JOIN stops_with_regions ON stops_with_regions.stop_id = stops.stop_id
+                WHERE stops.stop_id = ANY(%s)
+                ORDER BY stops.stop_id, stops_with_regions.region_id;
+                """, (list(stop_ids),))
+            locations = {stop_id: (lon, lat, region_id) for stop_id, lon, lat, region_id in cursor.fetchall()}
+
+    lons = np.full(len(stop_ids), np.nan)
+    lats = np.full(len(stop_ids), np.nan)
+    regions = np.full(len(stop_ids), None, dtype=object)
+    for i, stop_id in enumerate(stop_ids):
+        if stop_id in locations:
+            lon, lat, regions[i] = locations[stop_id]
+            if lon is not None:
+                lons[i], lats[i] = lon, lat
+
+    return lons, lats, regions
+
+
+def cluster_stops(stop_ids, dsn, by_parent_station=STOP_CLUSTER_BY_PARENT_STATION, distance=STOP_CLUSTER_DISTANCE):
+    """Merges stops of the same place, so only one of them has to be requested as origin resp. destination.
+
+    Stops with the same parent_station are merged into the one with the lowest ID. Then stops
+    at most distance meters apart are merged greedily, in the order of their IDs, into the first
+    one of them that is not merged yet. Stops are only merged within the same region (see
+    load_stop_locations()), so the itineraries of a cluster are assigned to the same region
+    as those of any of its members.
+
+    Args:
+        stop_ids (iterable[str]): IDs of the stops
+        dsn (str): DSN
+        by_parent_station (bool): (Optional) Whether to merge stops with the same parent_station
+        distance (float): (Optional) Merge stops at most this many meters apart, 0 disables
+
+    Returns:
+        dict: stop ID -> ID of the stop representing its cluster, itself if not merged
+    """
+    stop_ids = sorted(stop_ids)
+    representatives = {stop_id: stop_id for stop_id in stop_ids}
+    if not stop_ids:
+        return representatives
+    lons, lats, regions = load_stop_locations(stop_ids, dsn)
+
+    if by_parent_station:
+        with psycopg2.connect(dsn) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT DISTINCT ON (stop_id) stop_id, parent_station
+                    FROM stops
+                    WHERE stop_id = ANY(%s) AND parent_station <> ''
+                    ORDER BY stop_id;
+                    """, (stop_ids,))
+                parent_stations = dict(cursor.fetchall())
+
+        clusters = {}  # (parent station, region) -> representative
+        for i, stop_id in enumerate(stop_ids):
+            parent_station = parent_stations.get(stop_id)
+            if parent_station is not None:
+                # the IDs are sorted, so the first one is the lowest
+                representatives[stop_id] = clusters.setdefault((parent_station, regions[i]), stop_id)
+
+    if distance > 0:
+        heads = np.array([
+            i for i, stop_id in enumerate(stop_ids)
+            if representatives[stop_id] == stop_id and not np.isnan(lons[i])
+        ], dtype=int)
+        assigned = np.zeros(len(heads), dtype=bool)
+        for k, i in enumerate(heads):
+            if assigned[k]:
+                continue
+            assigned[k] = True
+            candidates = np.flatnonzero(~assigned)
+            distances = haversine_matrix(
+                lons[i:i+1], lats[i:i+1], lons[heads[candidates]], lats[heads[candidates]]
+            )[0]
+            near = candidates[(distances * 1000 <= distance) & (regions[heads[candidates]] == regions[i])]
+            assigned[near] = True
+            for j in heads[near]:
+                representatives[stop_ids[j]] = stop_ids[i]
+
+        # stops merged by parent station follow their representative
+        for stop_id, representative in representatives.items():
+            representatives[stop_id] = representatives[representative]
+
+    logger.info(f"Clustering merged {len(stop_ids)} stops into {len(set(representatives.values()))}.")
+    return representatives
+
+
+class OdFilter:
+    """Decides which O-D relations are worth a request to OTP.
+
+    Skipped are relations between stops that are co-located or at most min_distance meters
+    apart and relations matching one of the excluded region pairs. A region pair is a tuple
+    of origin and destination region ID, "*" matches any region.
+    """
+
+    def __init__(self, origins, destinations, dsn,
+                 min_distance=OD_MIN_DISTANCE, excluded_region_pairs=OD_EXCLUDED_REGION_PAIRS):
+        self.origins = origins
+        self.destinations = destinations
+
+        origin_lons, origin_lats, origin_regions = load_stop_locations(origins, dsn)
+        destination_lons, destination_lats, destination_regions = load_stop_locations(destinations, dsn)
+
+        self.mask = np.ones((len(origins), len(destinations)), dtype=bool)
+
+        for start in range(0, len(origins), BLOCK_SIZE):
+            end = start + BLOCK_SIZE
+            distances = haversine_matrix(
+                origin_lons[start:end], origin_lats[start:end], destination_lons, destination_lats
+            )
+            # co-located stops are always skipped, unknown coordinates (NaN) never
+            self.mask[start:end] &= ~((distances == 0) | (distances * 1000 <= min_distance))
+
+        for origin_region, destination_region in excluded_region_pairs:
+            origin_matches = (
+                np.ones(len(origins), dtype=bool) if origin_region == "*" else origin_regions == origin_region
+            )
+            destination_matches = (
+                np.ones(len(destinations), dtype=bool) if destination_region == "*"
+                else destination_regions == destination_region
+            )
+            self.mask &= ~np.outer(origin_matches, destination_matches)
+
+        # the same stop as origin and destination is skipped by the scraper anyway
+        origin_indexes = {stop_id: i for i, stop_id in enumerate(origins)}
+        for j, stop_id in enumerate(destinations):
+            if stop_id in origin_indexes:
+                self.mask[origin_indexes[stop_id], j] = False
+
+        self.count = int(self.mask.sum())
+        logger.info((
+            f"Pre-filter keeps {self.count} of {self.mask.size} O-D relations "
+            f"(minimum distance {min_distance} m, {len(excluded_region_pairs)} excluded region pairs)."
+        ))
+
+    def ods(self, dates, time_slices=1):
+        """Yields the relations that passed the filter, grouped by origin.
+
+        Args:
+            dates (list[str]): Dates in YYYY-MM-DD
+            time_slices (int): (Optional) Number of slices of the day each relation and date is requested in
+
+        Yields:
+            tuple: (origin, destination, date, time slice)
+        """
+        for i, origin in enumerate(self.origins):
+            for j in np.flatnonzero(self.mask[i]):
+                destination = self.destinations[j]
+                for date in dates:
+                    for time_slice in range(time_slices):
+                        yield origin, destination, date, time_slice
@@ -0,0 +1,525 @@
+import os
+import re
+import time
+import random
+import shutil
+import hashlib
+import logging
+import platform
+import threading
+import subprocess
+import http.client
+import urllib.error
+import urllib.request
+import multiprocessing
+from pathlib import Path
+
+from config import (
+    LOCAL_OTP_PORT, JVM_PARAMETERS, TEMP_DIRECTORY,
+    OTP_INSTANCES, OTP_MAX_RESTARTS, OTP_HEALTH_CHECK_INTERVAL,
+    GRAPH_CACHE_DIRECTORY, GRAPH_CACHE_MAX_GRAPHS,
+    OTP_INITIAL_CONCURRENCY, OTP_MIN_CONCURRENCY, OTP_MAX_CONCURRENCY, OTP_LATENCY_TOLERANCE,
+    OTP_BACKOFF_BASE, OTP_BACKOFF_MAX, OTP_RETRY_BUDGET, OTP_MAX_ATTEMPTS,
+)
+
+logger = logging.getLogger("MARA")
+
+OTP_JAR = "otp-2.0.0-shaded.jar"
+
+# states of the instances in OtpBalancer.available
+UP = 1
+DOWN = 0  # not reachable, being restarted
+FAILED = -1  # given up after OTP_MAX_RESTARTS
+
+MEMORY_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+LATENCY_SMOOTHING = 0.05  # weight of a new latency in the moving average of OtpBalancer
+WAIT_INTERVAL = 0.02  # seconds between attempts to acquire a request slot
+DOWN_CHECK_INTERVAL = 1  # seconds between checks whether instances reported as not reachable respond again
+KILL_TIMEOUT = 30  # seconds to wait for a killed instance to exit and free its ports
+
+
+def graph_inputs():
+    """Returns the files OTP builds its graph from.
+
+    Returns:
+        list[Path]: The GTFS feeds and OSM data in TEMP_DIRECTORY and the OTP jar
+    """
+    return [path for path in Path(TEMP_DIRECTORY).iterdir() if path.is_file()] + [Path(OTP_JAR)]
+
+
+def graph_fingerprint(paths):
+    """Calculates a fingerprint of the inputs OTP builds its graph from.
+
+    The names are part of the fingerprint as well, they decide the prefixes OTP gives to the stops.
+
+    Args:
+        paths (list[Path]): The GTFS feeds, OSM data and the OTP jar
+
+    Returns:
+        str: Hex digest
+    """
+    fingerprint = hashlib.sha256()
+    for path in sorted(paths, key=lambda path: path.name):
+        fingerprint.update(path.name.encode("utf-8"))
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                fingerprint.update(block)
+    return fingerprint.hexdigest()
+
+
+def evict_graphs(directory=GRAPH_CACHE_DIRECTORY, max_graphs=GRAPH_CACHE_MAX_GRAPHS):
+    """Deletes the least recently used saved graphs beyond max_graphs.
+
+    Args:
+        directory (str): Directory of the saved graphs
+        max_graphs (int): How many graphs to keep
+    """
+    graphs = sorted(
+        (path for path in Path(directory).iterdir() if (path / "graph.obj").exists()),
+        key=lambda path: (path / "graph.obj").stat().st_mtime,
+        reverse=True,
+    )
+    for path in graphs[max_graphs:]:
+        logger.info(f"Deleting the saved graph {path.name} which was not used for a while.")
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def split_jvm_memory(jvm_parameters, instances):
+    """Divides the maximum heap size of JVM parameters between instances.
+
+    Args:
+        jvm_parameters (str): JVM parameters, e. g. "-Xmx8G"
+        instances (int): Number of instances
+
+    Returns:
+        str: The JVM parameters for one instance
+    """
+    match = re.search(r"-Xmx(\d+)([kKmMgG]?)", jvm_parameters)
+    if not match or instances == 1:
+        return jvm_parameters
+
+    size = int(match.group(1)) * MEMORY_UNITS[match.group(2).lower()]
+    return jvm_parameters.replace(match.group(0), f"-Xmx{size // instances // 1024 ** 2}M")
+
+
+def backoff_delay(attempt):
+    """Returns how long to wait before retrying a request, exponential with full jitter.
+
+    Args:
+        attempt (int): The attempt that failed, starting at 1
+
+    Returns:
+        float: Seconds
+    """
+    return random.uniform(0, min(OTP_BACKOFF_MAX, OTP_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def kill_process(pid):
+    """Kills a process and its children, only supported on Windows, Linux and macOS.
+
+    Args:
+        pid (int): ID of the process
+    """
+    # actually does it in the background and it might take a second or two
+    # and we don't really care if it fails
+    if platform.system() == "Windows":
+        subprocess.Popen(f"TASKKILL /F /PID {pid} /T")
+    elif platform.system() in ("Linux", "Darwin"):
+        subprocess.Popen(f"kill -9 {pid}", shell=True)
+    else:
+        logger.warning(f"Running on {platform.system()}, but we only know how to handle Windows and Linux.")
+
+
+class OtpBalancer:
+    """Spreads requests over OTP instances by their number of outstanding requests.
+
+    The counters live in shared memory, so one balancer can be handed to all processes of the
+    scraping pool (see init_worker()). Instances that are not reachable are marked as down by
+    the scrapers and marked as up again by the OtpCluster once they have been restarted.
+
+    The total number of outstanding requests is limited by a window that adapts to how OTP copes
+    (AIMD): every answered request widens it by 1/window, i. e. by one per round trip. It is
+    halved, at most once per round trip, when OTP reports to be temporarily unavailable or the
+    moving average of the latencies exceeds OTP_LATENCY_TOLERANCE times its lowest value. Retries
+    are limited by a budget of OTP_RETRY_BUDGET times the requests, so a struggling OTP is not
+    buried under them.
+    """
+
+    def __init__(self, ports):
+        self.ports = ports
+        self.outstanding = multiprocessing.Array("i", len(ports))
+        lock = self.outstanding.get_lock()
+        self.available = multiprocessing.Array("b", [UP] * len(ports), lock=lock)
+        # guarded by the same lock as well
+        self.window = multiprocessing.Value("d", OTP_INITIAL_CONCURRENCY, lock=False)
+        self.latency = multiprocessing.Value("d", 0.0, lock=False)  # moving average, seconds
+        self.base_latency = multiprocessing.Value("d", 0.0, lock=False)  # lowest moving average so far
+        self.last_decrease = multiprocessing.Value("d", 0.0, lock=False)  # unix time
+        self.requests = multiprocessing.Value("q", 0, lock=False)
+        self.retries = multiprocessing.Value("q", 0, lock=False)
+
+    def try_acquire(self):
+        """Picks the available instance with the least outstanding requests and counts a request for it.
+
+        Returns:
+            int: Index of the instance, None if the window is full or all instances are being restarted
+
+        Raises:
+            Exception: If all instances have failed for good
+        """
+        with self.outstanding.get_lock():
+            candidates = [i for i, state in enumerate(self.available) if state == UP]
+            if not candidates:
+                if all(state == FAILED for state in self.available):
+                    raise Exception("All OpenTripPlanner instances have failed!")
+                return None
+            if sum(self.outstanding) >= int(self.window.value):
+                return None
+            index = min(candidates, key=self.outstanding.__getitem__)
+            self.outstanding[index] += 1
+            return index
+
+    def acquire(self):
+        """Like try_acquire() but waits for a free slot.
+
+        Returns:
+            int: Index of the instance
+        """
+        while True:
+            index = self.try_acquire()
+            if index is not None:
+                return index
+            time.sleep(WAIT_INTERVAL)
+
+    def record(self, latency, overloaded):
+        """Adapts the window to the outcome of a request.
+
+        Args:
+            latency (float): Seconds between sending the request and receiving the response
+            overloaded (bool): Whether OTP reported to be temporarily unavailable
+        """
+        with self.outstanding.get_lock():
+            self.requests.value += 1
+
+            # rejections are quick and say nothing about how long a plan takes
+            if not overloaded:
+                if self.latency.value == 0.0:
+                    self.latency.value = latency
+                else:
+                    self.latency.value += LATENCY_SMOOTHING * (latency - self.latency.value)
+            if self.requests.value >= 1 / LATENCY_SMOOTHING:  # the average has settled
+                if self.base_latency.value == 0.0 or self.latency.value < self.base_latency.value:
+                    self.base_latency.value = self.latency.value
+                else:
+                    # drifts up slowly in case the requests themselves got harder, e. g. longer distances
+                    self.base_latency.value += LATENCY_SMOOTHING / 100 * (self.latency.value - self.base_latency.value)
+
+            congested = overloaded or (
+                self.base_latency.value > 0.0
+                and self.latency.value > OTP_LATENCY_TOLERANCE * self.base_latency.value
+            )
+            if not congested:
+                self.window.value = min(OTP_MAX_CONCURRENCY, self.window.value + 1 / self.window.value)
+                return
+
+            now = time.time()
+            if now - self.last_decrease.value < self.latency.value:
+                return  # the same congestion already made the window shrink
+            self.last_decrease.value = now
+            window = max(OTP_MIN_CONCURRENCY, self.window.value / 2)
+            if int(window) < int(self.window.value):
+                logger.info((
+                    f"OpenTripPlanner is {'overloaded' if overloaded else 'slowing down'}, "
+                    f"reducing concurrent requests to {int(window)}."
+                ))
+            self.window.value = window
+
+    def allow_retry(self, attempt):
+        """Decides whether a failed request may be tried again and counts the retry.
+
+        Args:
+            attempt (int): The attempt that failed, starting at 1
+
+        Returns:
+            bool: Whether to retry
+        """
+        if attempt >= OTP_MAX_ATTEMPTS:
+            return False
+        with self.outstanding.get_lock():
+            # some retries are always allowed so a bad start does not use up the budget
+            if self.retries.value >= OTP_RETRY_BUDGET * self.requests.value + OTP_MAX_ATTEMPTS:
+                return False
+            self.retries.value += 1
+            return True
+
+    def release(self, index):
+        """Marks a request to an instance as finished."""
+        with self.outstanding.get_lock():
+            self.outstanding[index] -= 1
+
+    def mark_down(self, index):
+        """Reports an instance as not reachable so it gets no more requests until it is restarted."""
+        with self.outstanding.get_lock():
+            if self.available[index] == UP:
+                self.available[index] = DOWN
+
+    def mark_up(self, index):
+        with self.outstanding.get_lock():
+            self.available[index] = UP
+
+    def mark_failed(self, index):
+        with self.outstanding.get_lock():
+            self.available[index] = FAILED
+
+
+class OtpInstance:
+    """A single OTP process serving on its own pair of ports.
+
+    It loads the graph saved in graph_directory or, without one, builds it from TEMP_DIRECTORY.
+    """
+
+    def __init__(self, port, jvm_parameters, graph_directory=None):
+        self.port = port
+        self.jvm_parameters = jvm_parameters
+        self.graph_directory = graph_directory
+        self.process = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def start(self):
+        if self.graph_directory:
+            graph = f"--load {self.graph_directory}"  # saved by OtpCluster
+        else:
+            graph = f"--build --serve {TEMP_DIRECTORY}"  # build non-permanent graphs on-the-fly
+
+        # the output of this subprocess is sadly hidden to the GUI, launch the tool in a terminal/shell to see it
+        self.process = subprocess.Popen((
+            "java "
+            f"{self.jvm_parameters} "
+            f"-jar {OTP_JAR} "
+            f"{graph} "
+            f"--port {self.port} --securePort {self.port + 1}"
+        ),
+            shell=True,
+        )
+
+    def kill(self):
+        """Kills the process and waits for it to exit, so a new one can bind to the ports."""
+        if self.process is not None:
+            kill_process(self.process.pid)
+            try:
+                self.process.wait(KILL_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"OpenTripPlanner on port {self.port} (PID: {self.pid}) did not exit after being killed.")
+            self.process = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_ready(self):
+        """Whether the instance answers HTTP requests."""
+        try:
+            with urllib.request.urlopen(f"http://localhost:{self.port}", timeout=10):
+                return True
+        except (OSError, http.client.HTTPException):  # not reachable, connection lost or timed out
+            return False
+
+    def wait_until_ready(self, stopping):
+        """Waits for the instance to answer requests.
+
+        Args:
+            stopping (threading.Event): Gives up waiting once set
+
+        Returns:
+            bool: Whether the instance is ready, False if it died or waiting was given up
+        """
+        while not stopping.is_set():
+            if self.is_ready():
+                logger.info(f"OpenTripPlanner on port {self.port} is ready!")
+                time.sleep(5)  # can't hurt... ;)
+                return True
+
+            logger.info(f"Still waiting for OpenTripPlanner on port {self.port} (PID: {self.pid})...")
+            if not self.is_alive():
+                return False
+            stopping.wait(15)
+        return False
+
+    def warm_up(self, path):
+        """Performs a dummy request so that OTP initializes its createHeuristicSearch and workers.
+
+        Otherwise we usually get a race condition and the first few requests receive an error (which requires a retry).
+
+        Args:
+            path (str): Path including the query string of any plan request
+        """
+        logger.debug(f"Performing a dummy request to make sure OTP on port {self.port} is fully prepared.")
+        with urllib.request.urlopen(f"http://localhost:{self.port}{path}") as response:
+            dummy_content = response.read()
+        logger.debug(f"Dummy request yielded: {dummy_content}")
+
+
+class OtpCluster:
+    """Runs several OTP instances and restarts those that fail.
+
+    Instance i serves on LOCAL_OTP_PORT + 2i (and + 2i + 1 for HTTPS) with an equal share of the
+    memory in JVM_PARAMETERS. Requests are spread over them by the balancer. A background thread
+    checks the instances every OTP_HEALTH_CHECK_INTERVAL seconds and restarts the ones that died or
+    were reported as not reachable, each in a thread of its own and at most OTP_MAX_RESTARTS times.
+    Instances reported as not reachable that respond again in between are given requests again
+    within DOWN_CHECK_INTERVAL.
+
+    With a fingerprint of the graph inputs, the graph is built and saved once in a subdirectory of
+    GRAPH_CACHE_DIRECTORY named after it. The instances and all later runs with the same inputs load it from there.
+    """
+
+    def __init__(self, fingerprint=None, instances=OTP_INSTANCES):
+        self.graph_directory = Path(GRAPH_CACHE_DIRECTORY) / fingerprint if fingerprint else None
+        jvm_parameters = split_jvm_memory(JVM_PARAMETERS, instances)
+        self.instances = [
+            OtpInstance(LOCAL_OTP_PORT + 2 * i, jvm_parameters, self.graph_directory) for i in range(instances)
+        ]
+        self.balancer = OtpBalancer([instance.port for instance in self.instances])
+        self.restarts = [0] * instances
+        self.warm_up_path = None
+        self.builder = None
+        self.stopping = threading.Event()
+        self.monitor = None
+        self.restarters = {}  # index -> thread restarting the instance
+        self.lock = threading.Lock()  # so no instance is started after stop()
+
+    def start(self, warm_up_path):
+        """Launches all instances and waits until they are ready.
+
+        Args:
+            warm_up_path (str): Path of a plan request for warming up the instances
+
+        Returns:
+            bool: Whether all instances are ready
+        """
+        self.warm_up_path = warm_up_path
+        if self.graph_directory is not None and not self._prepare_graph():
+            return False
+
+        for instance in self.instances:
+            instance.start()
+
+        logger.info((
+            f"Waiting for {len(self.instances)} OpenTripPlanner instance(s) to become ready "
+            "(this may take some minutes)..."
+        ))
+        for instance in self.instances:
+            if not instance.wait_until_ready(self.stopping):
+                return False
+            instance.warm_up(warm_up_path)
+
+        self.monitor = threading.Thread(target=self._watch, daemon=True)
+        self.monitor.start()
+        return True
+
+    def stop(self):
+        """Stops the health checks and kills all instances."""
+        self.stopping.set()
+        if self.builder is not None:
+            kill_process(self.builder.pid)
+        if self.monitor is not None:
+            self.monitor.join()
+            self.monitor = None
+        with self.lock:
+            for instance in self.instances:
+                instance.kill()
+
+    def _prepare_graph(self):
+        """Builds and saves the graph unless it has been saved by a previous run.
+
+        Returns:
+            bool: Whether the graph is available
+        """
+        graph = self.graph_directory / "graph.obj"
+        if graph.exists():
+            logger.info(f"Loading the graph saved in {self.graph_directory}/ instead of building it.")
+            os.utime(graph)  # marks it as recently used, see evict_graphs()
+            return True
+
+        logger.info((
+            "Building the graph, it is saved for later runs with the same inputs "
+            "(this may take some minutes)..."
+        ))
+        # the whole memory is available while building, the instances are not running yet
+        self.builder = subprocess.Popen(
+            f"java {JVM_PARAMETERS} -jar {OTP_JAR} --build --save {TEMP_DIRECTORY}",
+            shell=True,
+        )
+        returncode = self.builder.wait()
+        self.builder = None
+
+        built_graph = Path(TEMP_DIRECTORY) / "graph.obj"
+        if returncode != 0 or not built_graph.exists():
+            return False
+
+        # moved into place in one step so a crash never leaves a partial graph to be loaded
+        self.graph_directory.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(built_graph), str(self.graph_directory / "graph.obj.part"))
+        os.replace(self.graph_directory / "graph.obj.part", graph)
+        logger.info(f"Saved the graph in {self.graph_directory}/")
+
+        evict_graphs()
+        return True
+
+    def _watch(self):
+        last_check = time.monotonic()
+        while not self.stopping.wait(DOWN_CHECK_INTERVAL):
+            if time.monotonic() - last_check < OTP_HEALTH_CHECK_INTERVAL:
+                # instances reported as not reachable get requests again as soon as they respond,
+                # e. g. after a long GC pause, instead of waiting for the next full check
+                for index, instance in enumerate(self.instances):
+                    if self._is_restarting(index):
+                        continue
+                    if self.balancer.available[index] == DOWN and instance.is_alive() and instance.is_ready():
+                        self.balancer.mark_up(index)
+                continue
+
+            last_check = time.monotonic()
+            for index, instance in enumerate(self.instances):
+                state = self.balancer.available[index]
+                if state == FAILED or self._is_restarting(index):
+                    continue
+                if instance.is_alive() and (state == UP or instance.is_ready()):
+                    self.balancer.mark_up(index)  # reported as not reachable but it is, e. g. a long GC pause
+                    continue
+                # waiting for it to become ready takes minutes, the others are still checked meanwhile
+                self.balancer.mark_down(index)
+                self.restarters[index] = threading.Thread(target=self._restart, args=(index,), daemon=True)
+                self.restarters[index].start()
+
+    def _is_restarting(self, index):
+        return index in self.restarters and self.restarters[index].is_alive()
+
+    def _restart(self, index):
+        instance = self.instances[index]
+        self.balancer.mark_down(index)
+        instance.kill()
+
+        self.restarts[index] += 1
+        if self.restarts[index] > OTP_MAX_RESTARTS:
+            logger.critical(f"OpenTripPlanner on port {instance.port} failed too often, giving up on it!")
+            self.balancer.mark_failed(index)
+            return
+
+        logger.warning((
+            f"OpenTripPlanner on port {instance.port} failed, "
+            f"restarting it ({self.restarts[index]}/{OTP_MAX_RESTARTS})..."
+        ))
+        with self.lock:
+            if self.stopping.is_set():
+                return
+            instance.start()
+        if instance.wait_until_ready(self.stopping):
+            try:
+                instance.warm_up(self.warm_up_path)
+            except (OSError, http.client.HTTPException):
+                return  # tried again on the next check
+            self.balancer.mark_up(index)
@@ -0,0 +1,144 @@
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+
+from config import PLAN_CACHE_DIRECTORY, PLAN_CACHE_MAX_SIZE, PLAN_CACHE_SHARDS
+
+logger = logging.getLogger("MARA")
+
+EVICTION_INTERVAL = 1000  # responses stored in a shard between checks of its size
+EVICTION_TARGET = 0.9  # share of its size limit a shard is evicted down to
+TOUCH_AGE = 24 * 60 * 60  # seconds since the last use after which a hit updates it
+TOUCH_BATCH_SIZE = 1000  # updated uses of a shard kept in memory before they are written
+
+
+class PlanCache:
+    """A content-addressed on-disk cache of OTP plan responses.
+
+    Responses are keyed by the fingerprint of the graph and the path of the request, which
+    includes origin, destination, date and all other OTP parameters. They are stored zlib
+    compressed in several SQLite files so the scraping processes rarely wait for each other.
+    Once a shard grows beyond its share of max_size, the least recently used responses are evicted.
+    Hits only update the time of the last use if it is older than TOUCH_AGE, and in batches, so
+    lookups hardly ever need the write lock of a shard.
+    """
+
+    def __init__(self, fingerprint, directory=PLAN_CACHE_DIRECTORY, max_size=PLAN_CACHE_MAX_SIZE,
+                 shards=PLAN_CACHE_SHARDS):
+        self.fingerprint = fingerprint.encode("ascii")
+        self.directory = Path(directory)
+        self.max_shard_size = max_size // shards
+        self.shards = [None] * shards
+        self.puts = [0] * shards
+        self.touched = [[] for _ in range(shards)]  # keys of hits whose last use is not written yet
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _shard(self, key):
+        index = key[0] % len(self.shards)
+        if self.shards[index] is None:
+            connection = sqlite3.connect(str(self.directory / f"plans.{index:02d}.sqlite"), timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL;")
+            connection.execute("PRAGMA synchronous=NORMAL;")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses(
+                    key BLOB PRIMARY KEY,
+                    content BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used INTEGER NOT NULL
+                );""")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used);")
+            connection.commit()
+            self.shards[index] = connection
+        return index, self.shards[index]
+
+    def _key(self, path):
+        return hashlib.sha256(self.fingerprint + path.encode("utf-8")).digest()
+
+    def get(self, path):
+        """Looks up the response to a request.
+
+        Args:
+            path (str): Path including the query string, see otp_plan_path()
+
+        Returns:
+            bytes: The response body, None if it is not cached
+        """
+        key = self._key(path)
+        index, connection = self._shard(key)
+        row = connection.execute("SELECT content, last_used FROM responses WHERE key = ?;", (key,)).fetchone()
+        if row is None:
+            return None
+
+        content, last_used = row
+        if time.time() - last_used > TOUCH_AGE:
+            self.touched[index].append(key)
+            if len(self.touched[index]) >= TOUCH_BATCH_SIZE:
+                self._touch(index)
+        return zlib.decompress(content)
+
+    def _touch(self, index):
+        """Writes the last use of the hits of a shard kept in memory."""
+        if not self.touched[index]:
+            return
+        now = int(time.time())
+        with self.shards[index]:
+            self.shards[index].executemany(
+                "UPDATE responses SET last_used = ? WHERE key = ?;", ((now, key) for key in self.touched[index])
+            )
+        self.touched[index] = []
+
+    def put(self, path, content):
+        """Stores the response to a request.
+
+        Args:
+            path (str): Path including the query string, see otp_plan_path()
+            content (bytes): The response body
+        """
+        key = self._key(path)
+        index, connection = self._shard(key)
+        compressed = zlib.compress(content)
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses(key, content, size, last_used) VALUES (?, ?, ?, ?);",
+                (key, compressed, len(compressed), int(time.time()))
+            )
+
+        self.puts[index] += 1
+        if self.puts[index] % EVICTION_INTERVAL == 0:
+            self._touch(index)  # so recently used responses are not evicted
+            self._evict(connection)
+
+    def _evict(self, connection):
+        size = connection.execute("SELECT total(size) FROM responses;").fetchone()[0]
+        if size <= self.max_shard_size:
+            return
+
+        excess = size - self.max_shard_size * EVICTION_TARGET
+        evicted = []
+        cursor = connection.execute("SELECT key, size FROM responses ORDER BY last_used;")
+        for key, response_size in cursor:
+            evicted.append((key,))
+            excess -= response_size
+            if excess <= 0:
+                break
+        cursor.close()
+
+        with connection:
+            connection.executemany("DELETE FROM responses WHERE key = ?;", evicted)
+        logger.debug(f"Evicted {len(evicted)} responses from the plan cache.")
+
+    def close(self):
+        """Writes the last uses kept in memory and closes the files of all shards."""
+        for index, connection in enumerate(self.shards):
+            if connection is not None:
+                try:
+                    self._touch(index)
+                except sqlite3.Error as e:
+                    # only affects which responses are evicted first
+                    logger.warning(f"Could not update the last use of cached plans: {e}")
+                connection.close()
+                self.shards[index] = None
@@ -0,0 +1,256 @@
+-- folds a batch of collected itineraries into the tables of create_tables_incremental_analysis.sql
+-- each step is the one of the create_table_*.sql file of the same table, restricted to the itineraries of the batch
+CREATE TEMPORARY TABLE batch (
+	itinerary_id BIGINT PRIMARY KEY
+) ON COMMIT DROP;
+
+WITH taken AS (
+	DELETE FROM pending_itineraries
+	WHERE itinerary_id IN (SELECT itinerary_id FROM pending_itineraries LIMIT %(batch_size)s)
+	RETURNING itinerary_id
+)
+INSERT INTO batch SELECT itinerary_id FROM taken;
+
+INSERT INTO itineraries_with_regions
+SELECT
+	itineraries.itinerary_id,
+	from_stop_id,
+	to_stop_id,
+	start_time,
+	end_time,
+	swr.region_id AS from_region_id,
+	swr2.region_id AS to_region_id
+FROM itineraries
+JOIN batch ON batch.itinerary_id = itineraries.itinerary_id
+LEFT JOIN stops_with_regions swr  ON '1:' || swr.stop_id  = itineraries.from_stop_id
+LEFT JOIN stops_with_regions swr2 ON '1:' || swr2.stop_id = itineraries.to_stop_id
+-- same filters as filter_itineraries() in misc.py, itineraries might have been collected without them
+WHERE transit_legs <= 3  -- max of 3 PT legs (2 changes)
+AND NOT walk_limit_exceeded
+-- discard if public transport takes too long compared to car
+AND (duration::double precision / 3600)
+	/ (linear_distance_km * %(car_travel_factor)s::double precision / %(car_kmh)s::double precision)
+	<= %(travel_time_factor_threshold)s::double precision;
+
+INSERT INTO itinerary_stop_times_with_regions
+SELECT
+	ist.itinerary_id,
+	ist.itinerary_stop_index,
+	ist.stop_id,
+	ist.route_id,
+	ist.trip_id,
+	ist.trip_stop_index,
+	ist.arrival,
+	ist.departure,
+	ist.mode,
+	swr.region_id
+FROM itinerary_stop_times ist
+JOIN batch ON batch.itinerary_id = ist.itinerary_id
+JOIN itineraries_with_regions itig ON itig.itinerary_id = ist.itinerary_id  -- only those that passed the filters
+LEFT JOIN stops_with_regions swr ON '1:' || swr.stop_id = ist.stop_id;
+
+-- see create_table_itinerary_stop_times_with_lead_region.sql
+INSERT INTO itinerary_stop_times_with_lead_region
+WITH istrw_with_arrays AS (
+	SELECT
+		array_agg(DISTINCT t2.region_id) AS partition_region_ids  -- region_ids of the SIBLING stop times
+		, t1.*
+	FROM itinerary_stop_times_with_regions t1
+	LEFT OUTER JOIN itinerary_stop_times_with_regions t2 ON
+		t2.itinerary_id = t1.itinerary_id
+		AND t2.arrival = t1.arrival
+		AND t2.departure = t1.departure
+		AND t2.trip_id = t1.trip_id
+	WHERE t1.arrival IS NOT NULL AND t1.departure IS NOT NULL
+	AND t1.itinerary_id IN (SELECT itinerary_id FROM batch)
+	GROUP BY  -- everything
+		t1.itinerary_id, t1.itinerary_stop_index,
+		t1.stop_id, t1.route_id, t1.trip_id, t1.trip_stop_index,
+		t1.arrival, t1.departure, t1."mode", t1.region_id
+)
+, next_stops_regions_per_iti_arrival AS (
+	SELECT
+			LEAD(partition_region_ids) OVER(PARTITION BY itinerary_id ORDER BY min(itinerary_stop_index)) AS next_stops_region_ids,
+			itinerary_id,
+			arrival
+	FROM istrw_with_arrays
+	GROUP BY
+			partition_region_ids,
+			itinerary_id,
+			route_id, trip_id,
+			arrival, departure, mode
+)
+SELECT
+	istwr.*
+	, UNNEST(CASE WHEN next_stops_region_ids <> '{}' THEN next_stops_region_ids ELSE '{null}' END) AS next_stop_region_id
+FROM itinerary_stop_times_with_regions istwr
+LEFT JOIN next_stops_regions_per_iti_arrival nsrpia ON nsrpia.itinerary_id = istwr.itinerary_id AND nsrpia.arrival = istwr.arrival
+WHERE istwr.itinerary_id IN (SELECT itinerary_id FROM batch);
+
+-- see create_table_itinerary_stop_times_with_lag_region.sql
+INSERT INTO itinerary_stop_times_with_lag_region
+WITH istrw_with_arrays AS (
+	SELECT
+		array_agg(DISTINCT t2.region_id) AS partition_region_ids  -- region_ids of the SIBLING stop times
+		, t1.*
+	FROM itinerary_stop_times_with_regions t1
+	LEFT OUTER JOIN itinerary_stop_times_with_regions t2 ON
+		t2.itinerary_id = t1.itinerary_id
+		AND t2.arrival = t1.arrival
+		AND t2.departure = t1.departure
+		AND t2.trip_id = t1.trip_id
+	WHERE t1.arrival IS NOT NULL AND t1.departure IS NOT NULL
+	AND t1.itinerary_id IN (SELECT itinerary_id FROM batch)
+	GROUP BY  -- everything
+		t1.itinerary_id, t1.itinerary_stop_index,
+		t1.stop_id, t1.route_id, t1.trip_id, t1.trip_stop_index,
+		t1.arrival, t1.departure, t1."mode", t1.region_id
+)
+, previous_stops_regions_per_iti_arrival AS (
+	SELECT
+			LAG(partition_region_ids) OVER(PARTITION BY itinerary_id ORDER BY min(itinerary_stop_index)) AS previous_stops_region_ids,
+			itinerary_id,
+			arrival
+	FROM istrw_with_arrays
+	GROUP BY
+			partition_region_ids,
+			itinerary_id,
+			route_id, trip_id,
+			arrival, departure, mode
+)
+SELECT
+	istwr.*
+	, UNNEST(CASE WHEN previous_stops_region_ids <> '{}' THEN previous_stops_region_ids ELSE '{null}' END) AS previous_stop_region_id
+FROM itinerary_stop_times_with_regions istwr
+LEFT JOIN previous_stops_regions_per_iti_arrival psrpia ON psrpia.itinerary_id = istwr.itinerary_id AND psrpia.arrival = istwr.arrival
+WHERE istwr.itinerary_id IN (SELECT itinerary_id FROM batch);
+
+-- see create_table_stop_times_from_origin.sql and create_table_starting_in_origin_dow_hour.sql
+WITH itineraries_between_regions AS (
+	SELECT
+		itinerary_id,
+		from_region_id AS iti_from_region_id,
+		to_region_id AS iti_to_region_id
+	FROM itineraries_with_regions
+	WHERE from_region_id != to_region_id
+	AND itinerary_id IN (SELECT itinerary_id FROM batch)
+)
+, stop_times_with_lead AS (
+	SELECT
+		istwlr.*,
+		region_id AS stop_region_id,
+		ibr.iti_from_region_id,
+		ibr.iti_to_region_id
+	FROM itineraries_between_regions ibr
+	LEFT JOIN itinerary_stop_times_with_lead_region istwlr ON istwlr.itinerary_id = ibr.itinerary_id
+)
+, legs_from_origin AS (
+	SELECT
+		*,
+		ROW_NUMBER() OVER(PARTITION BY itinerary_id, stop_region_id, next_stop_region_id ORDER BY itinerary_stop_index DESC) AS rank
+	FROM stop_times_with_lead
+	WHERE
+		stop_region_id != next_stop_region_id
+		AND next_stop_region_id IS NOT NULL
+)
+, new_stop_times_from_origin AS (
+	INSERT INTO stop_times_from_origin
+	SELECT
+		DISTINCT ON (stop_region_id, iti_to_region_id, stop_id, trip_id)
+		itinerary_id,
+		stop_id,
+		route_id,
+		trip_id,
+		arrival,
+		departure,
+		stop_region_id,
+		next_stop_region_id,
+		iti_from_region_id,
+		iti_to_region_id
+	FROM legs_from_origin
+	WHERE
+		rank = 1
+		AND stop_region_id != iti_to_region_id
+	ORDER BY stop_region_id, iti_to_region_id, stop_id, trip_id
+	ON CONFLICT (stop_region_id, iti_to_region_id, stop_id, (COALESCE(trip_id, ''))) DO NOTHING  -- seen in an earlier batch
+	RETURNING stop_region_id, iti_to_region_id, departure
+)
+INSERT INTO starting_in_origin_dow_hour
+SELECT
+	stop_region_id AS from_region_id,
+	iti_to_region_id AS to_region_id,
+	EXTRACT(dow from departure at time zone 'Europe/Berlin') as dow,
+	EXTRACT(hour from departure at time zone 'Europe/Berlin') as hour,
+	count(*) AS count
+FROM new_stop_times_from_origin
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (from_region_id, to_region_id, dow, hour)
+DO UPDATE SET count = starting_in_origin_dow_hour.count + EXCLUDED.count;
+
+-- see create_table_incoming_per_region_dow_hour.sql
+WITH stop_times_with_lag AS (
+	SELECT
+		region_id,
+		trip_id,
+		arrival,
+		lag(region_id) OVER (PARTITION BY itinerary_id ORDER BY itinerary_stop_index) AS previous_stop_region_id
+	FROM itinerary_stop_times_with_regions
+	WHERE arrival IS NOT NULL
+	AND itinerary_id IN (SELECT itinerary_id FROM batch)
+)
+, new_trips_between_regions AS (
+	INSERT INTO incoming_trips_between_regions
+	SELECT
+		DISTINCT ON (region_id, trip_id)  -- count the same trip from other itineraries only ONCE
+		region_id,
+		trip_id,
+		arrival
+	FROM stop_times_with_lag
+	WHERE previous_stop_region_id != region_id
+	ON CONFLICT DO NOTHING  -- seen in an earlier batch
+	RETURNING region_id, arrival
+)
+INSERT INTO incoming_per_region_dow_hour
+SELECT
+	region_id,
+	EXTRACT(dow FROM arrival at time zone 'Europe/Berlin') AS dow,
+	EXTRACT(hour FROM arrival at time zone 'Europe/Berlin') AS hour,
+	count(*) AS count
+FROM new_trips_between_regions
+GROUP BY 1, 2, 3
+ON CONFLICT (region_id, dow, hour)
+DO UPDATE SET count = incoming_per_region_dow_hour.count + EXCLUDED.count;
+
+-- see create_table_outgoing_per_region_dow_hour.sql
+WITH stop_times_with_lead AS (
+	SELECT
+		region_id,
+		trip_id,
+		departure,
+		LEAD(region_id) OVER (PARTITION BY itinerary_id ORDER BY itinerary_stop_index) AS next_stop_region_id
+	FROM itinerary_stop_times_with_regions
+	WHERE departure IS NOT NULL
+	AND itinerary_id IN (SELECT itinerary_id FROM batch)
+)
+, new_trips_between_regions AS (
+	INSERT INTO outgoing_trips_between_regions
+	SELECT
+		DISTINCT ON (region_id, trip_id)  -- count the same trip from other itineraries only ONCE
+		region_id,
+		trip_id,
+		departure
+	FROM stop_times_with_lead
+	WHERE next_stop_region_id != region_id
+	ON CONFLICT DO NOTHING  -- seen in an earlier batch
+	RETURNING region_id, departure
+)
+INSERT INTO outgoing_per_region_dow_hour
+SELECT
+	region_id,
+	EXTRACT(dow FROM departure at time zone 'Europe/Berlin') AS dow,
+	EXTRACT(hour FROM departure at time zone 'Europe/Berlin') AS hour,
+	count(*) AS count
+FROM new_trips_between_regions
+GROUP BY 1, 2, 3
+ON CONFLICT (region_id, dow, hour)
+DO UPDATE SET count = outgoing_per_region_dow_hour.count + EXCLUDED.count;
@@ -0,0 +1,3 @@
+CREATE INDEX idx_stop_times_stop_sequence ON stop_times(stop_sequence);
+
+ANALYZE stop_times;
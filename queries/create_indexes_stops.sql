@@ -0,0 +1,5 @@
+CREATE INDEX idx_stops_stop_id_prefixed ON stops(('1:' || stop_id));
+CREATE INDEX idx_stops_stop_name ON stops(stop_name);
+CREATE INDEX idx_stops_geom ON stops USING gist(geom);
+
+ANALYZE stops;
@@ -0,0 +1,12 @@
+-- O-D relations per date (and slice of the day, see SEARCH_WINDOW_SLICES) whose itineraries have been collected,
+-- used to resume an interrupted collection
+CREATE TABLE IF NOT EXISTS completed_ods (
+	origin TEXT NOT NULL,
+	destination TEXT NOT NULL,
+	date DATE NOT NULL,
+	time_slice SMALLINT NOT NULL DEFAULT 0,
+	PRIMARY KEY (origin, destination, date, time_slice)
+);
+
+-- collections from before the time slices were whole days
+ALTER TABLE completed_ods ADD COLUMN IF NOT EXISTS time_slice SMALLINT NOT NULL DEFAULT 0;
@@ -1,7 +1,15 @@
 CREATE TABLE itineraries (
-        itinerary_id UUID PRIMARY KEY,
+        itinerary_id BIGINT PRIMARY KEY,
         from_stop_id TEXT NOT NULL,
         to_stop_id TEXT NOT NULL,
         start_time TIMESTAMP WITH TIME ZONE,
-        end_time TIMESTAMP WITH TIME ZONE
+        end_time TIMESTAMP WITH TIME ZONE,
+        -- inputs of the filters in create_table_itineraries_with_regions.sql
+        duration INTEGER NOT NULL,  -- seconds
+        linear_distance_km DOUBLE PRECISION NOT NULL,
+        transit_legs SMALLINT NOT NULL,
+        walk_limit_exceeded BOOLEAN NOT NULL
 );
+
+-- the scraping workers reserve blocks of itinerary IDs from this, see ItineraryIds in misc.py
+CREATE SEQUENCE IF NOT EXISTS itinerary_id_blocks;
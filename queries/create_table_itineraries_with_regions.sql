@@ -10,6 +10,13 @@ CREATE TABLE itineraries_with_regions AS (
 	FROM itineraries
 	LEFT JOIN stops_with_regions swr  ON '1:' || swr.stop_id  = itineraries.from_stop_id
 	LEFT JOIN stops_with_regions swr2 ON '1:' || swr2.stop_id = itineraries.to_stop_id
+	-- same filters as filter_itineraries() in misc.py, itineraries might have been collected without them
+	WHERE transit_legs <= 3  -- max of 3 PT legs (2 changes)
+	AND NOT walk_limit_exceeded
+	-- discard if public transport takes too long compared to car
+	AND (duration::double precision / 3600)
+		/ (linear_distance_km * %(car_travel_factor)s::double precision / %(car_kmh)s::double precision)
+		<= %(travel_time_factor_threshold)s::double precision
 	ORDER BY from_stop_id, to_stop_id, end_time
 );
 
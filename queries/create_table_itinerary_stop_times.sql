@@ -1,5 +1,5 @@
 CREATE TABLE itinerary_stop_times (
-	itinerary_id UUID,
+	itinerary_id BIGINT,
 	itinerary_stop_index INTEGER NOT NULL,
 	stop_id TEXT NOT NULL,
 	route_id TEXT DEFAULT NULL,
@@ -12,6 +12,7 @@ CREATE TABLE itinerary_stop_times_with_regions AS (
 		swr.region_id
 	FROM itinerary_stop_times ist 
 	LEFT JOIN stops_with_regions swr ON '1:' || swr.stop_id = ist.stop_id
+	WHERE ist.itinerary_id IN (SELECT itinerary_id FROM itineraries_with_regions)  -- only those that passed the filters
 	ORDER BY itinerary_id, itinerary_stop_index
 );
 
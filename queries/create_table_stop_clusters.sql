@@ -0,0 +1,7 @@
+-- rebuilt for every collection, see STOP_CLUSTER_BY_PARENT_STATION and STOP_CLUSTER_DISTANCE
+DROP TABLE IF EXISTS stop_clusters;
+
+CREATE TABLE stop_clusters (
+	stop_id TEXT NOT NULL PRIMARY KEY,
+	cluster_stop_id TEXT NOT NULL  -- the stop that is requested for all stops of the cluster
+);
@@ -4,4 +4,4 @@ CREATE TABLE stop_times (
 	stop_sequence INTEGER NOT NULL
 );
 
-CREATE INDEX idx_stop_times_stop_sequence ON stop_times(stop_sequence);
+-- indexes are created after loading, see create_indexes_stop_times.sql
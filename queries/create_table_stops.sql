@@ -7,6 +7,4 @@ CREATE TABLE stops (
 	geom geometry(POINT, 4326) NULL
 );
 
-CREATE INDEX idx_stops_stop_id_prefixed ON stops(('1:' || stop_id));
-CREATE INDEX idx_stops_stop_name ON stops(stop_name);
-CREATE INDEX idx_stops_geom ON stops USING gist(geom);
+-- indexes are created after loading, see create_indexes_stops.sql
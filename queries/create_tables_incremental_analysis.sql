@@ -0,0 +1,152 @@
+-- the derived tables of the analysis, filled while scraping, see IncrementalAnalysis in analysis.py
+-- they have the same columns as if created by the create_table_*.sql files, but start empty
+
+-- itineraries that have been collected but not analysed yet, queued by a trigger
+DROP TRIGGER IF EXISTS queue_pending_itineraries ON itineraries;
+CREATE TABLE pending_itineraries (
+	itinerary_id BIGINT PRIMARY KEY
+);
+
+CREATE OR REPLACE FUNCTION queue_pending_itineraries() RETURNS trigger AS $$
+BEGIN
+	INSERT INTO pending_itineraries SELECT itinerary_id FROM new_itineraries;
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- once per COPY of the scraping workers, in their transaction
+CREATE TRIGGER queue_pending_itineraries AFTER INSERT ON itineraries
+	REFERENCING NEW TABLE AS new_itineraries
+	FOR EACH STATEMENT EXECUTE FUNCTION queue_pending_itineraries();
+
+-- itineraries of a resumed collection
+INSERT INTO pending_itineraries SELECT itinerary_id FROM itineraries;
+
+-- the stop times of each batch are looked up by itinerary
+CREATE INDEX IF NOT EXISTS idx_ist_itinerary_id ON itinerary_stop_times(itinerary_id);
+
+CREATE TABLE itineraries_with_regions AS
+SELECT
+	itinerary_id,
+	from_stop_id,
+	to_stop_id,
+	start_time,
+	end_time,
+	swr.region_id AS from_region_id,
+	swr.region_id AS to_region_id
+FROM itineraries, stops_with_regions swr
+WITH NO DATA;
+
+CREATE INDEX idx_itig_itinerary_id ON itineraries_with_regions(itinerary_id);
+
+CREATE TABLE itinerary_stop_times_with_regions AS
+SELECT
+	ist.itinerary_id,
+	ist.itinerary_stop_index,
+	ist.stop_id,
+	ist.route_id,
+	ist.trip_id,
+	ist.trip_stop_index,
+	ist.arrival,
+	ist.departure,
+	ist.mode,
+	swr.region_id
+FROM itinerary_stop_times ist, stops_with_regions swr
+WITH NO DATA;
+
+CREATE INDEX idx_istwr_itinerary_id ON itinerary_stop_times_with_regions(itinerary_id);
+
+CREATE TABLE itinerary_stop_times_with_lead_region AS
+SELECT *, region_id AS next_stop_region_id FROM itinerary_stop_times_with_regions
+WITH NO DATA;
+
+CREATE INDEX idx_istwleadr_itinerary_id ON itinerary_stop_times_with_lead_region(itinerary_id);
+
+CREATE TABLE itinerary_stop_times_with_lag_region AS
+SELECT *, region_id AS previous_stop_region_id FROM itinerary_stop_times_with_regions
+WITH NO DATA;
+
+CREATE INDEX idx_istwlagr_itinerary_id ON itinerary_stop_times_with_lag_region(itinerary_id);
+
+-- one row per stop time as with DISTINCT ON in create_table_stop_times_from_origin.sql, the first one analysed is kept
+CREATE TABLE stop_times_from_origin AS
+SELECT
+	itinerary_id,
+	stop_id,
+	route_id,
+	trip_id,
+	arrival,
+	departure,
+	region_id AS stop_region_id,
+	next_stop_region_id,
+	region_id AS iti_from_region_id,
+	region_id AS iti_to_region_id
+FROM itinerary_stop_times_with_lead_region
+WITH NO DATA;
+
+-- walks have no trip, they are kept once per stop like with DISTINCT ON
+CREATE UNIQUE INDEX idx_stfo_distinct ON stop_times_from_origin(stop_region_id, iti_to_region_id, stop_id, (COALESCE(trip_id, '')));
+CREATE INDEX idx_stfo_stop_region_id ON stop_times_from_origin(stop_region_id);
+CREATE INDEX idx_stfo_iti_to_region_id ON stop_times_from_origin(iti_to_region_id);
+CREATE INDEX stfo_itinerary_id ON stop_times_from_origin(itinerary_id);
+
+-- the distinct trips between regions counted in create_table_incoming/outgoing_per_region_dow_hour.sql
+-- walks have no trip, they are counted once per region like with DISTINCT ON
+CREATE TABLE incoming_trips_between_regions AS
+SELECT region_id, trip_id, arrival FROM itinerary_stop_times_with_regions
+WITH NO DATA;
+
+CREATE UNIQUE INDEX idx_itbr_distinct ON incoming_trips_between_regions(region_id, (COALESCE(trip_id, '')));
+
+CREATE TABLE outgoing_trips_between_regions AS
+SELECT region_id, trip_id, departure FROM itinerary_stop_times_with_regions
+WITH NO DATA;
+
+CREATE UNIQUE INDEX idx_otbr_distinct ON outgoing_trips_between_regions(region_id, (COALESCE(trip_id, '')));
+
+-- result tables, the counts are increased batch by batch
+CREATE TABLE starting_in_origin_dow_hour AS
+SELECT
+	stop_region_id AS from_region_id,
+	iti_to_region_id AS to_region_id,
+	EXTRACT(dow from departure at time zone 'Europe/Berlin') as dow,
+	EXTRACT(hour from departure at time zone 'Europe/Berlin') as hour,
+	count(*) AS count
+FROM stop_times_from_origin
+GROUP BY 1, 2, 3, 4
+WITH NO DATA;
+
+CREATE UNIQUE INDEX idx_siodh_key ON starting_in_origin_dow_hour(from_region_id, to_region_id, dow, hour);
+CREATE INDEX idx_siodh_from_region_id ON starting_in_origin_dow_hour(from_region_id);
+CREATE INDEX idx_siodh_dow ON starting_in_origin_dow_hour(dow);
+CREATE INDEX idx_siodh_hour ON starting_in_origin_dow_hour(hour);
+
+CREATE TABLE incoming_per_region_dow_hour AS
+SELECT
+	region_id,
+	EXTRACT(dow FROM arrival at time zone 'Europe/Berlin') AS dow,
+	EXTRACT(hour FROM arrival at time zone 'Europe/Berlin') AS hour,
+	count(*) AS count
+FROM incoming_trips_between_regions
+GROUP BY 1, 2, 3
+WITH NO DATA;
+
+CREATE UNIQUE INDEX idx_iprdh_key ON incoming_per_region_dow_hour(region_id, dow, hour);
+CREATE INDEX idx_iprdh_region_id ON incoming_per_region_dow_hour(region_id);
+CREATE INDEX idx_iprdh_dow ON incoming_per_region_dow_hour(dow);
+CREATE INDEX idx_iprdh_hour ON incoming_per_region_dow_hour(hour);
+
+CREATE TABLE outgoing_per_region_dow_hour AS
+SELECT
+	region_id,
+	EXTRACT(dow FROM departure at time zone 'Europe/Berlin') AS dow,
+	EXTRACT(hour FROM departure at time zone 'Europe/Berlin') AS hour,
+	count(*) AS count
+FROM outgoing_trips_between_regions
+GROUP BY 1, 2, 3
+WITH NO DATA;
+
+CREATE UNIQUE INDEX idx_oprdh_key ON outgoing_per_region_dow_hour(region_id, dow, hour);
+CREATE INDEX idx_oprdh_region_id ON outgoing_per_region_dow_hour(region_id);
+CREATE INDEX idx_oprdh_dow ON outgoing_per_region_dow_hour(dow);
+CREATE INDEX idx_oprdh_hour ON outgoing_per_region_dow_hour(hour);
@@ -2,5 +2,9 @@ DROP TABLE IF EXISTS regions;
 DROP TABLE IF EXISTS stops;
 DROP TABLE IF EXISTS stop_times;
 DROP TABLE IF EXISTS itineraries;
+DROP SEQUENCE IF EXISTS itinerary_id_blocks;
 DROP TABLE IF EXISTS itinerary_stop_times;
+DROP TABLE IF EXISTS completed_ods;
+DROP TABLE IF EXISTS stop_clusters;
 DROP TABLE IF EXISTS proxy_stops;
+DROP TABLE IF EXISTS stops_with_regions;
@@ -1,4 +1,3 @@
-DROP TABLE IF EXISTS stops_with_regions;
 DROP TABLE IF EXISTS itineraries_with_regions;
 DROP TABLE IF EXISTS itinerary_stop_times_with_regions;
 DROP TABLE IF EXISTS itinerary_stop_times_with_lag_region;
@@ -15,3 +14,17 @@ DROP TABLE IF EXISTS starting_in_origin_dow_hour;
 DROP TABLE IF EXISTS starting_in_origin_dow_hour_with_nonregional;
 DROP TABLE IF EXISTS incoming_per_region_dow_hour;
 DROP TABLE IF EXISTS outgoing_per_region_dow_hour;
+
+-- incremental analysis, see create_tables_incremental_analysis.sql
+-- the trigger of an interrupted run would fail every insert into itineraries without pending_itineraries
+DO $$
+BEGIN
+	IF to_regclass('itineraries') IS NOT NULL THEN
+		DROP TRIGGER IF EXISTS queue_pending_itineraries ON itineraries;
+	END IF;
+END
+$$;
+DROP FUNCTION IF EXISTS queue_pending_itineraries();
+DROP TABLE IF EXISTS pending_itineraries;
+DROP TABLE IF EXISTS incoming_trips_between_regions;
+DROP TABLE IF EXISTS outgoing_trips_between_regions;
@@ -0,0 +1,10 @@
+-- stops queueing collected itineraries when the incremental analysis is given up,
+-- see IncrementalAnalysis in analysis.py, otherwise later inserts fail once pending_itineraries is dropped
+DO $$
+BEGIN
+	IF to_regclass('itineraries') IS NOT NULL THEN
+		DROP TRIGGER IF EXISTS queue_pending_itineraries ON itineraries;
+	END IF;
+END
+$$;
+DROP FUNCTION IF EXISTS queue_pending_itineraries();
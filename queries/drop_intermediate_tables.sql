@@ -1,5 +1,7 @@
 --DROP TABLE incoming_per_region_dow_hour;
+DROP TABLE completed_ods;
 DROP TABLE itineraries;
+DROP SEQUENCE itinerary_id_blocks;
 DROP TABLE itineraries_with_regions;
 DROP TABLE itinerary_stop_times;
 DROP TABLE itinerary_stop_times_at_proxy_stops;
@@ -13,7 +15,7 @@ DROP TABLE proxy_stops;
 --DROP TABLE regions;
 DROP TABLE starting_in_origin_dow_hour;
 --DROP TABLE starting_in_origin_dow_hour_with_nonregional;
-DROP TABLE stop_times;
+DROP TABLE IF EXISTS stop_times;  -- only imported with IMPORT_STOP_TIMES
 DROP TABLE stop_times_from_origin;
 DROP TABLE stops;
 DROP TABLE stops_with_regions;
@@ -0,0 +1,28 @@
+-- after the last batch of the incremental analysis, see IncrementalAnalysis in analysis.py
+DROP TRIGGER IF EXISTS queue_pending_itineraries ON itineraries;
+DROP FUNCTION IF EXISTS queue_pending_itineraries();
+DROP TABLE IF EXISTS pending_itineraries;
+DROP TABLE IF EXISTS incoming_trips_between_regions;
+DROP TABLE IF EXISTS outgoing_trips_between_regions;
+
+-- the indexes of the create_table_*.sql files that were not needed while analysing
+CREATE INDEX idx_itig_from_stop_id ON itineraries_with_regions(from_stop_id);
+CREATE INDEX idx_itig_to_stop_id ON itineraries_with_regions(to_stop_id);
+CREATE INDEX idx_itig_start_time ON itineraries_with_regions(start_time);
+CREATE INDEX idx_itig_end_time ON itineraries_with_regions(end_time);
+CREATE INDEX idx_itig_from_region_id ON itineraries_with_regions(from_region_id);
+CREATE INDEX idx_itig_to_region_id ON itineraries_with_regions(to_region_id);
+
+CREATE INDEX idx_istwr_itinerary_stop_index ON itinerary_stop_times_with_regions(itinerary_stop_index);
+CREATE INDEX idx_istwr_stop_id ON itinerary_stop_times_with_regions(stop_id);
+CREATE INDEX idx_istwr_trip_id ON itinerary_stop_times_with_regions(trip_id);
+CREATE INDEX idx_istwr_trip_stop_index ON itinerary_stop_times_with_regions(trip_stop_index);
+CREATE INDEX idx_istwr_departure ON itinerary_stop_times_with_regions(departure);
+
+CREATE INDEX idx_istwleadr_next_stop_region_id ON itinerary_stop_times_with_lead_region(next_stop_region_id);
+CREATE INDEX idx_istwleadr_stop_id ON itinerary_stop_times_with_lead_region(stop_id);
+CREATE INDEX idx_istwleadr_trip_id ON itinerary_stop_times_with_lead_region(trip_id);
+
+CREATE INDEX idx_istwlagr_previous_stop_region_id ON itinerary_stop_times_with_lag_region(previous_stop_region_id);
+CREATE INDEX idx_istwlagr_stop_id ON itinerary_stop_times_with_lag_region(stop_id);
+CREATE INDEX idx_istwlagr_trip_id ON itinerary_stop_times_with_lag_region(trip_id);
@@ -0,0 +1,132 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from misc import run_query
+from metrics import format_duration
+from config import ANALYSIS_MAX_CONNECTIONS
+
+logger = logging.getLogger("MARA")
+
+
+class QueryPipeline:
+    """Runs queries from queries/*.sql on concurrent connections, each as soon as the tables it needs exist.
+
+    Each step declares the tables it reads and the tables it creates. A step depends on the steps
+    creating any of its inputs, tables not created by any step must exist already. If a step
+    fails, the steps depending on it (directly or not) are skipped, the others still run.
+    """
+
+    def __init__(self, dsn, max_connections=ANALYSIS_MAX_CONNECTIONS):
+        """
+        Args:
+            dsn (str): DSN
+            max_connections (int): (Optional) How many steps may run at the same time
+        """
+        self.dsn = dsn
+        self.max_connections = max_connections
+        self.steps = {}  # name of the query file -> (inputs, outputs, parameters), in the order added
+
+    def add(self, filename, inputs, outputs, parameters=None):
+        """Adds a step.
+
+        Args:
+            filename (str): Name of the .sql file, see run_query()
+            inputs (iterable[str]): Tables the query reads
+            outputs (iterable[str]): Tables the query creates
+            parameters (dict): (Optional) Values for the placeholders in the file
+        """
+        self.steps[filename] = (frozenset(inputs), frozenset(outputs), parameters)
+
+    def dependencies(self):
+        """Determines the steps each step has to wait for.
+
+        Returns:
+            dict: name of a step -> set of names of the steps creating its inputs
+
+        Raises:
+            ValueError: If a table is created by more than one step
+        """
+        creators = {}
+        for name, (_, outputs, _) in self.steps.items():
+            for table in outputs:
+                if table in creators:
+                    raise ValueError(f"{table} is created by both {creators[table]} and {name}!")
+                creators[table] = name
+
+        return {
+            name: {creators[table] for table in inputs if table in creators} - {name}
+            for name, (inputs, _, _) in self.steps.items()
+        }
+
+    @staticmethod
+    def dependents(name, dependencies):
+        """Finds the steps depending on a step, directly or not.
+
+        Args:
+            name (str): Name of the step
+            dependencies (dict): See dependencies()
+
+        Returns:
+            list[str]: Names of the depending steps
+        """
+        found = []
+        waiting = [name]
+        while waiting:
+            current = waiting.pop()
+            for other, needed in dependencies.items():
+                if current in needed and other not in found:
+                    found.append(other)
+                    waiting.append(other)
+        return found
+
+    def _run_step(self, name):
+        _, _, parameters = self.steps[name]
+        started = time.monotonic()
+        run_query(name, self.dsn, parameters)
+        return time.monotonic() - started
+
+    def run(self):
+        """Runs all steps, blocking until done.
+
+        Raises:
+            ValueError: If the steps depend on each other in a cycle
+            Exception: If a step failed, after all steps not depending on it have run
+        """
+        dependencies = self.dependencies()
+        pending = list(self.steps)  # in the order added
+        done, failed, skipped = set(), [], []
+        running = {}  # future -> name of the step
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(self.max_connections) as executor:
+            while pending or running:
+                for name in [name for name in pending if dependencies[name] <= done]:
+                    pending.remove(name)
+                    running[executor.submit(self._run_step, name)] = name
+                if not running:
+                    raise ValueError(f"The steps {', '.join(pending)} depend on each other in a cycle!")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        duration = future.result()
+                    except Exception as e:
+                        logger.critical(f"Query {name} failed: {e}")
+                        failed.append(name)
+                        for other in self.dependents(name, dependencies):
+                            if other in pending:
+                                logger.warning(f"Skipping query {other}, it depends on {name}.")
+                                pending.remove(other)
+                                skipped.append(other)
+                    else:
+                        done.add(name)
+                        logger.info(f"Query {name} took {format_duration(duration)}.")
+
+        logger.info(f"Running {len(self.steps)} queries took {format_duration(time.monotonic() - started)}.")
+        if failed:
+            raise Exception(
+                f"Queries failed: {', '.join(failed)}"
+                + (f", skipped because of them: {', '.join(skipped)}" if skipped else "")
+            )
@@ -0,0 +1,301 @@
+import time
+import asyncio
+import logging
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+from config import OTP_MAX_IN_FLIGHT, PARSER_PROCESSES, OTP_REQUEST_TIMEOUT
+from otp import backoff_delay, WAIT_INTERVAL
+from misc import (
+    init_worker, ingest_cached_plan, ingest_plan_response, otp_plan_path, record_plan_response, http_status_error,
+    set_search_time_zone, OTP_TEMPORARILY_UNAVAILABLE,
+)
+
+CONNECT_TIMEOUT = 10  # seconds
+
+logger = logging.getLogger("MARA")
+
+
+class KeepAliveConnection:
+    """A minimal HTTP/1.1 client connection that is kept open between requests.
+
+    Only what is needed for talking to OTP is supported: GET requests with responses
+    using either Content-Length or chunked transfer encoding.
+    """
+
+    def __init__(self, host, port, timeout=OTP_REQUEST_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT
+        )
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass  # it is gone either way
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path):
+        """Sends a GET request and reads the response.
+
+        A kept-alive connection might have been closed by the server in the meantime,
+        so the request is sent once more on a fresh connection if that happens.
+        A request without a complete response after timeout seconds raises asyncio.TimeoutError,
+        the connection is closed then as it is in an unknown state.
+
+        Args:
+            path (str): Path including the query string
+
+        Returns:
+            int: HTTP status code
+            bytes: Response body
+        """
+        for attempt in (1, 2):
+            if self.writer is None:
+                await self.open()
+            try:
+                return await asyncio.wait_for(self._get(path), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                if attempt == 2:
+                    raise
+            except asyncio.TimeoutError:
+                await self.close()
+                raise
+
+    async def _get(self, path):
+        self.writer.write((
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            "Accept: application/json\r\n"
+            "Connection: keep-alive\r\n"
+            "\r\n"
+        ).encode("latin-1"))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if headers.get("transfer-encoding") == "chunked":
+            body = await self._read_chunked()
+        elif "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        else:  # the body ends with the connection
+            body = await self.reader.read()
+            await self.close()
+            return status, body
+
+        if headers.get("connection") == "close":
+            await self.close()
+
+        return status, body
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size_line = await self.reader.readline()
+            size = int(size_line.split(b";")[0], 16)
+            if size == 0:
+                # skip trailers up to the final empty line
+                while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)  # CRLF after each chunk
+
+
+class AsyncScraper:
+    """Scrapes itineraries with many concurrent OTP requests from a single process.
+
+    Each of the max_in_flight request loops owns one kept-alive connection to OTP and works
+    through the shared O-D tasks. Parsing the responses and writing the itineraries to PG
+    happens in a small pool of processes, set up like the workers of the pool engine. With
+    a plan cache, each relation is looked up there by a parsing process before requesting OTP.
+    Each request goes to the OTP instance picked by the balancer, a loop keeps one connection
+    per instance.
+    """
+
+    def __init__(self, dsn, travel_time_factor_threshold, balancer, metrics, plan_cache_fingerprint=None,
+                 equivalent_dates=None, time_zone=None, max_in_flight=OTP_MAX_IN_FLIGHT,
+                 parser_processes=PARSER_PROCESSES):
+        self.dsn = dsn
+        self.travel_time_factor_threshold = travel_time_factor_threshold
+        self.balancer = balancer
+        self.metrics = metrics
+        self.plan_cache_fingerprint = plan_cache_fingerprint
+        self.equivalent_dates = equivalent_dates
+        self.time_zone = time_zone
+        self.max_in_flight = max_in_flight
+        self.parser_processes = parser_processes
+        self.errors = 0
+
+    def run(self, tasks):
+        """Scrapes all tasks, blocking until done.
+
+        Args:
+            tasks (iterable[tuple]): (origin, destination, date, time slice)
+
+        Returns:
+            int: Number of tasks that failed, their errors are logged right away
+        """
+        self.errors = 0
+        set_search_time_zone(self.time_zone)  # the requests are built in this process
+        asyncio.run(self._run(iter(tasks)))
+        return self.errors
+
+    async def _run(self, tasks):
+        # leaving the with block lets the parser processes exit normally so they flush their buffers
+        with ProcessPoolExecutor(
+                self.parser_processes,
+                initializer=init_worker,
+                initargs=(
+                    self.dsn, self.travel_time_factor_threshold, self.plan_cache_fingerprint, None, self.metrics,
+                    self.equivalent_dates, self.time_zone,
+                ),
+        ) as executor:
+            queue = asyncio.Queue(2 * self.max_in_flight)
+            await asyncio.gather(
+                self._produce(tasks, queue),
+                *(self._request_loop(queue, executor) for _ in range(self.max_in_flight)),
+            )
+
+    async def _produce(self, tasks, queue):
+        """Feeds the tasks into the queue of the request loops, followed by one None per loop.
+
+        The tasks are taken from the iterator in a thread, it may block, e. g. pending_ods()
+        querying PG, which would stall all requests on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, list, islice(tasks, self.max_in_flight))
+                if not chunk:
+                    break
+                for od in chunk:
+                    await queue.put(od)
+        finally:
+            for _ in range(self.max_in_flight):
+                await queue.put(None)
+
+    async def _request_loop(self, queue, executor):
+        connections = {}
+        try:
+            # the loops share the queue, each picks the next task once it is free
+            while True:
+                od = await queue.get()
+                if od is None:
+                    break
+                error = await self._scrape(connections, executor, od)
+                self.metrics.inc("ods_completed_total")
+                if error:
+                    self.errors += 1
+                    self.metrics.inc("otp_errors_total")
+                    logger.critical(error)
+        finally:
+            for connection in connections.values():
+                await connection.close()
+
+    async def _fetch(self, connections, path):
+        """Sends a request to the OTP instance with the least outstanding requests, see fetch_plan().
+
+        Args:
+            connections (dict): Index of the instance -> KeepAliveConnection of the request loop
+            path (str): Path including the query string
+
+        Returns:
+            int: HTTP status code
+            bytes: Response body
+            float: Seconds it took OTP to respond, without waiting for a free slot
+        """
+        failed = set()  # instances this request could not reach once
+        while True:
+            index = self.balancer.try_acquire()
+            if index is None:  # the window is full or all instances are being restarted
+                await asyncio.sleep(WAIT_INTERVAL)
+                continue
+
+            port = self.balancer.ports[index]
+            if index not in connections:
+                connections[index] = KeepAliveConnection("localhost", port)
+            started = time.monotonic()
+            try:
+                status, content = await connections[index].get(path)
+                return status, content, time.monotonic() - started
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                if index not in failed:  # e. g. the instance closed an idle keep-alive connection
+                    failed.add(index)
+                    continue
+                logger.warning(f"OpenTripPlanner on port {port} is not reachable, trying another instance.")
+                self.balancer.mark_down(index)
+            finally:
+                self.balancer.release(index)
+
+    async def _scrape(self, connections, executor, od):
+        """Query OTP for a O-D relation and feed the result into PG, see od_to_postgres().
+
+        Args:
+            connections (dict): Index of the instance -> KeepAliveConnection of the request loop
+            executor (ProcessPoolExecutor): The parsing processes
+            od (tuple): (origin, destination, date, time slice)
+
+        Returns:
+            None or information about an error
+        """
+        if od[0] == od[1]:
+            return
+
+        loop = asyncio.get_running_loop()
+        path = otp_plan_path(*od)
+
+        if self.plan_cache_fingerprint and await loop.run_in_executor(executor, ingest_cached_plan, path, od):
+            return
+
+        attempt = 1
+        while True:
+            status, content, latency = await self._fetch(connections, path)
+            if status == 200:
+                record_plan_response(self.metrics, content, latency)
+                error = await loop.run_in_executor(executor, ingest_plan_response, content, od, path)
+            else:
+                error = http_status_error(status)  # like the pool engine, see od_to_postgres()
+            overloaded = bool(error) and error.get("msg") == OTP_TEMPORARILY_UNAVAILABLE
+            self.balancer.record(latency, overloaded)
+
+            if not error:
+                return
+
+            # we can handle temporary errors with a retry
+            if not overloaded:
+                return f"Unknown error for {path}: {error}"
+
+            if not self.balancer.allow_retry(attempt):
+                break
+
+            delay = backoff_delay(attempt)  # just to make sure the router gets some relieve
+            logger.warning(f"Nonfatal fail: Making attempt {attempt + 1} for {path} in {delay:.1f} s")
+            self.metrics.inc("otp_retries_total")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        logger.critical(f"Final FAIL for {path}!")
+        return f"Error, no plan after {attempt} attempts"
@@ -0,0 +1,78 @@
+import datetime
+from zipfile import ZipFile
+
+import pytest
+
+from feed_index import ZoneInfo, service_day_classes
+
+DAY = 86400 * 1000  # milliseconds
+
+
+def write_feed(path, calendar, timezone="Europe/Berlin"):
+    """Writes a GTFS feed with the given rows of calendar.txt and an agency in the time zone, if any."""
+    with ZipFile(path, "w") as feed:
+        if timezone:
+            feed.writestr(
+                "agency.txt",
+                "agency_id,agency_name,agency_url,agency_timezone\n"
+                f"1,Test,https://example.com,{timezone}\n",
+            )
+        feed.writestr(
+            "calendar.txt",
+            "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n"
+            + "".join(f"{row}\n" for row in calendar),
+        )
+    return str(path)
+
+
+def days(start, count):
+    return [(start + datetime.timedelta(days=i)).isoformat() for i in range(count)]
+
+
+@pytest.fixture
+def feed_index_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the feed index is written to the working directory
+    return tmp_path
+
+
+@pytest.mark.skipif(ZoneInfo is None, reason="needs zoneinfo (Python 3.9+)")
+def test_friday_before_a_service_change_is_not_grouped_with_other_weekdays(feed_index_directory):
+    gtfs_path = write_feed(feed_index_directory / "gtfs.zip", [
+        "weekdays,1,1,1,1,1,0,0,20240603,20240609",
+        "weekend,0,0,0,0,0,1,1,20240603,20240609",
+    ])
+
+    classes = service_day_classes(days(datetime.date(2024, 6, 3), 7), [gtfs_path])
+
+    # itineraries departing on Friday evening arrive on Saturday, which has other services
+    assert classes == {
+        "2024-06-03": [],  # Monday follows the weekend
+        "2024-06-04": [("2024-06-05", DAY), ("2024-06-06", 2 * DAY)],
+        "2024-06-07": [],
+        "2024-06-08": [],
+        "2024-06-09": [],  # Sunday precedes a weekday
+    }
+
+
+@pytest.mark.skipif(ZoneInfo is None, reason="needs zoneinfo (Python 3.9+)")
+def test_days_around_a_dst_change_are_not_grouped(feed_index_directory):
+    gtfs_path = write_feed(feed_index_directory / "gtfs.zip", ["daily,1,1,1,1,1,1,1,20240325,20240407"])
+
+    # summer time starts on Sunday, 31 March 2024 in Berlin
+    classes = service_day_classes(days(datetime.date(2024, 3, 28), 6), [gtfs_path])
+
+    assert classes == {
+        "2024-03-28": [("2024-03-29", DAY)],
+        "2024-03-30": [],  # itineraries of the night run into the change
+        "2024-03-31": [],
+        "2024-04-01": [("2024-04-02", DAY)],
+    }
+
+
+def test_every_date_is_requested_without_a_time_zone(feed_index_directory):
+    gtfs_path = write_feed(
+        feed_index_directory / "gtfs.zip", ["daily,1,1,1,1,1,1,1,20240603,20240609"], timezone=None
+    )
+    dates = days(datetime.date(2024, 6, 4), 3)
+
+    assert service_day_classes(dates, [gtfs_path]) == {date: [] for date in dates}